@@ -0,0 +1,73 @@
+"""Server-side cache of the read-heavy API responses.
+
+Dashboards and kiosks poll the same few endpoints every few seconds, and
+each response is the same until a pour (or a keg, tap or catalog change)
+happens. `cache_response` keeps the serialized data in redis, under the
+"drink generation" of `RESPONSE_CACHE` (see `pykeg.core.cache.KegbotCache`).
+`invalidate()` starts a new generation; it is called for every change
+that can show up in a cached response (see `pykeg.core.signal_handlers`).
+
+Entries also expire after `CACHE_SECONDS`, which bounds how stale a
+response can get from the passage of time alone (a session ending, say).
+"""
+
+import functools
+import hashlib
+
+from django.conf import settings
+from django.db import transaction
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from pykeg.core.cache import SEP, KegbotCache
+
+RESPONSE_CACHE = KegbotCache(prefix="api")
+# 0 disables the cache.
+CACHE_SECONDS = getattr(settings, "KEGBOT_API_CACHE_SECONDS", 30)
+
+
+def cache_key(request, generation):
+    """Returns the key of a request's response in the given generation.
+
+    Responses hold absolute URLs, so the host is part of the key; the site
+    privacy is too, though saving the site starts a new generation anyway.
+    """
+    privacy = getattr(getattr(request, "kbsite", None), "privacy", "")
+    digest = hashlib.sha1(request.build_absolute_uri().encode()).hexdigest()
+    return SEP.join(("response", privacy, digest, str(generation)))
+
+
+def cache_response(view_fn):
+    """Caches a view's successful GET responses, for every user it admits.
+
+    Decorate (read-only) viewset methods or `api_view` functions, beneath
+    the DRF decorators: permissions are checked before the cache is read,
+    so only the data is shared, never the access to it.
+    """
+
+    @functools.wraps(view_fn)
+    def wrapper(*args, **kwargs):
+        request = args[0] if isinstance(args[0], Request) else args[1]
+        if not CACHE_SECONDS or request.method != "GET":
+            return view_fn(*args, **kwargs)
+
+        key = cache_key(request, RESPONSE_CACHE.get_generation())
+        data = RESPONSE_CACHE.get(key)
+        if data is not None:
+            return Response(data)
+        response = view_fn(*args, **kwargs)
+        if response.status_code == 200 and response.data is not None:
+            RESPONSE_CACHE.set(key, response.data, CACHE_SECONDS)
+        return response
+
+    return wrapper
+
+
+def invalidate():
+    """Starts a new generation: every cached response is rebuilt.
+
+    Invalidated again on commit, so a response cached mid-transaction by
+    another process doesn't outlive the change.
+    """
+    RESPONSE_CACHE.update_generation()
+    transaction.on_commit(RESPONSE_CACHE.update_generation)
@@ -0,0 +1,148 @@
+"""Conditional GETs of the polled API endpoints, from change counters.
+
+Each kind of data a response can show (kegs, taps, drinks, ...) has a
+change counter in a redis hash, bumped when such data is saved or
+deleted (see `pykeg.core.signal_handlers`). A view's ETag is a digest of
+the counters of the kinds it shows, so a client polling with
+`If-None-Match` is answered 304 from a single redis read, before any
+query runs.
+
+Counters are bumped once the change commits. Until then the old data
+and the old counters agree; in between, a reader can only tag new data
+with the old ETag, which costs the client one more full response.
+"""
+
+import functools
+import hashlib
+import threading
+import time
+import uuid
+
+from django.db import transaction
+from django.utils.http import http_date, parse_http_date_safe
+from django_redis import get_redis_connection
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from pykeg.core import models
+
+# Kind -> change count, plus "<kind>:at" -> time of the last change and
+# "epoch", which a lost hash (a flushed redis) renews so that old ETags
+# can't match again.
+CHANGES_KEY = "kb:api:changes"
+EPOCH = "epoch"
+
+MODEL_KINDS = {
+    models.Beverage: "beverage",
+    models.BeverageProducer: "beverage",
+    models.Drink: "drink",
+    models.DrinkingSession: "session",
+    models.Keg: "keg",
+    models.KegbotSite: "site",
+    models.KegTap: "tap",
+    models.Picture: "picture",
+    models.SystemEvent: "event",
+    models.User: "user",
+}
+
+# Kinds changed by the current thread's transaction, not yet counted.
+_pending = threading.local()
+
+
+def record_change(*kinds):
+    """Counts a change to data of the given kinds, once it commits."""
+    pending = getattr(_pending, "kinds", None)
+    if pending is None:
+        pending = _pending.kinds = set()
+    pending.update(kinds)
+    transaction.on_commit(_count_pending)
+
+
+def _count_pending():
+    # Every change registers this; the first call after a commit counts
+    # them all. Kinds left over by a rollback are counted too, which
+    # only costs clients a full response.
+    kinds = getattr(_pending, "kinds", None)
+    if not kinds:
+        return
+    _pending.kinds = set()
+    now = int(time.time())
+    with get_redis_connection("default").pipeline(transaction=False) as pipe:
+        for kind in kinds:
+            pipe.hincrby(CHANGES_KEY, kind, 1)
+            pipe.hset(CHANGES_KEY, f"{kind}:at", now)
+        pipe.execute()
+
+
+def get_validators(kinds):
+    """Returns (changes, last_modified) for the given kinds.
+
+    `changes` identifies the state of the data; `last_modified` is the
+    time of its last change, or None if unknown.
+    """
+    client = get_redis_connection("default")
+    fields = [EPOCH, *kinds, *(f"{kind}:at" for kind in kinds)]
+    values = client.hmget(CHANGES_KEY, fields)
+    if values[0] is None:
+        client.hsetnx(CHANGES_KEY, EPOCH, uuid.uuid4().hex)
+        values = client.hmget(CHANGES_KEY, fields)
+    values = [value.decode() if value is not None else "0" for value in values]
+    times = [int(value) for value in values[1 + len(kinds) :]]
+    changes = ":".join(values[: 1 + len(kinds)])
+    return changes, max(times, default=0) or None
+
+
+def _etag(request, changes):
+    privacy = getattr(getattr(request, "kbsite", None), "privacy", "")
+    renderer = getattr(request, "accepted_media_type", "")
+    key = "|".join((request.build_absolute_uri(), privacy, renderer, changes))
+    return f'W/"{hashlib.sha1(key.encode()).hexdigest()}"'
+
+
+def _not_modified(request, etag, last_modified):
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        # Weak comparison: W/"x" matches "x".
+        return "*" in tags or etag.removeprefix("W/") in [t.removeprefix("W/") for t in tags]
+    if_modified_since = parse_http_date_safe(request.headers.get("If-Modified-Since", ""))
+    return bool(last_modified and if_modified_since and last_modified <= if_modified_since)
+
+
+def conditional_get(kinds=None):
+    """Decorates a view with ETag and Last-Modified, answering 304 if unchanged.
+
+    Like `cache.cache_response`, it goes beneath the DRF decorators, so
+    only requests the view's permissions admit are answered.
+
+    Args:
+        kinds: The kinds of data (see `MODEL_KINDS`) the view shows; by
+            default, its viewset's `change_kinds`.
+    """
+
+    def decorator(view_fn):
+        @functools.wraps(view_fn)
+        def wrapper(*args, **kwargs):
+            request = args[0] if isinstance(args[0], Request) else args[1]
+            if request.method != "GET":
+                return view_fn(*args, **kwargs)
+
+            view_kinds = kinds if kinds is not None else args[0].change_kinds
+            # Read before the data, so the tag is never newer than it.
+            changes, last_modified = get_validators(view_kinds)
+            etag = _etag(request, changes)
+            if _not_modified(request, etag, last_modified):
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            else:
+                response = view_fn(*args, **kwargs)
+                if response.status_code != 200:
+                    return response
+            response["ETag"] = etag
+            if last_modified:
+                response["Last-Modified"] = http_date(last_modified)
+            return response
+
+        return wrapper
+
+    return decorator
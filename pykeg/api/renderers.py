@@ -0,0 +1,18 @@
+import json
+
+from rest_framework import renderers
+
+
+class EventStreamRenderer(renderers.BaseRenderer):
+    """Lets `text/event-stream` clients through content negotiation.
+
+    Streams are returned as `StreamingHttpResponse`s and never rendered;
+    this only renders errors, as a single `error` event.
+    """
+
+    media_type = "text/event-stream"
+    format = "sse"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return f"event: error\ndata: {json.dumps(data)}\n\n".encode()
@@ -7,6 +7,64 @@ from rest_framework.exceptions import ValidationError
 from pykeg.core import kb_common, keg_sizes, models
 
 
+def _split_param(value):
+    return {part.strip() for part in (value or "").split(",") if part.strip()}
+
+
+def requests_stats(request):
+    """Whether a list request asks for the full `stats` blob."""
+    params = request.query_params
+    return "stats" in _split_param(params.get("expand")) | _split_param(params.get("fields"))
+
+
+# Serves stats compactly in lists: `stats_summary` is always served, while
+# the full `stats` blob is left out of list views unless requested with
+# `?expand=stats`.  For the top-level objects, `?fields=` (comma-separated
+# names) picks the fields returned; naming `stats` there also requests it.
+#
+# `stats_data` and `stats_summary_data` annotations (see
+# `Stats.latest_stats_subquery()`) save a query per object.  (Comments
+# rather than a docstring, which the API schema would pick up for every
+# serializer using this.)
+class StatsFieldsMixin:
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get("request")
+        view = self.context.get("view")
+        if request is None or getattr(view, "swagger_fake_view", False):
+            # The schema describes every field.
+            return fields
+
+        requested = set()
+        if self._is_top_level():
+            requested = _split_param(request.query_params.get("fields"))
+            if requested:
+                fields = {name: field for name, field in fields.items() if name in requested}
+
+        if getattr(view, "action", None) == "list" and "stats" not in requested:
+            if "stats" not in _split_param(request.query_params.get("expand")):
+                fields.pop("stats", None)
+        return fields
+
+    def _is_top_level(self):
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        return parent is None
+
+    @extend_schema_field(serializers.JSONField())
+    def get_stats(self, obj):
+        if hasattr(obj, "stats_data"):
+            return models.Stats.prepare_stats(obj.stats_data)
+        return obj.get_stats()
+
+    @extend_schema_field(OpenApiTypes.OBJECT)
+    def get_stats_summary(self, obj):
+        if hasattr(obj, "stats_summary_data"):
+            return models.Stats.prepare_stats(obj.stats_summary_data)
+        return obj.get_stats_summary()
+
+
 class PictureSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.Picture
@@ -45,7 +103,7 @@ class PictureSerializer(serializers.ModelSerializer):
         return picture.thumbnail_png.url if picture else None
 
 
-class KegbotSiteSerializer(serializers.ModelSerializer):
+class KegbotSiteSerializer(StatsFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = models.KegbotSite
         fields = [
@@ -64,10 +122,12 @@ class KegbotSiteSerializer(serializers.ModelSerializer):
             "enable_sensing",
             "enable_users",
             "stats",
+            "stats_summary",
         ]
 
     background_image = PictureSerializer(read_only=True)
-    stats = serializers.JSONField(source="get_stats", read_only=True)
+    stats = serializers.SerializerMethodField()
+    stats_summary = serializers.SerializerMethodField()
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -227,7 +287,7 @@ class StatsSerializer(serializers.ModelSerializer):
         ]
 
 
-class KegSerializer(serializers.ModelSerializer):
+class KegSerializer(StatsFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = models.Keg
         fields = [
@@ -245,6 +305,7 @@ class KegSerializer(serializers.ModelSerializer):
             "illustration",
             "illustration_thumbnail",
             "stats",
+            "stats_summary",
         ]
         # Status and volumes change only through the keg lifecycle
         # endpoints (attach/end/reactivate/spill), never by direct edit.
@@ -258,7 +319,8 @@ class KegSerializer(serializers.ModelSerializer):
     beverage = BeverageSerializer(source="type", read_only=True)
     illustration = serializers.URLField(source="get_illustration", read_only=True)
     illustration_thumbnail = serializers.URLField(source="get_illustration_thumb", read_only=True)
-    stats = serializers.JSONField(source="get_stats", read_only=True)
+    stats = serializers.SerializerMethodField()
+    stats_summary = serializers.SerializerMethodField()
 
 
 class KegTapSerializer(serializers.ModelSerializer):
@@ -323,7 +385,7 @@ class AuthenticationTokenSerializer(serializers.ModelSerializer):
     )
 
 
-class DrinkingSessionSerializer(serializers.ModelSerializer):
+class DrinkingSessionSerializer(StatsFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = models.DrinkingSession
         fields = [
@@ -334,9 +396,11 @@ class DrinkingSessionSerializer(serializers.ModelSerializer):
             "timezone",
             "name",
             "stats",
+            "stats_summary",
         ]
 
-    stats = serializers.JSONField(source="get_stats", read_only=True)
+    stats = serializers.SerializerMethodField()
+    stats_summary = serializers.SerializerMethodField()
 
 
 class ThermoSensorSerializer(serializers.ModelSerializer):
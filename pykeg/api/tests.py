@@ -1,18 +1,21 @@
 import base64
 import datetime
 import re
+from unittest import mock
 
 from django.contrib.auth.tokens import default_token_generator
 from django.core import mail as django_mail
 from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
-from django.test.utils import override_settings
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.utils import timezone
 from django.utils.encoding import force_bytes
 from django.utils.http import urlsafe_base64_encode
 from rest_framework.test import APIClient
 
-from pykeg.core import models
+from pykeg.api import cache as api_cache
+from pykeg.core import models, stats
 from pykeg.core.util import get_version
 
 
@@ -720,6 +723,238 @@ class StatsEndpointsTestCase(TestCase):
 
 
 @override_settings(EMAIL_BACKEND="pykeg.core.mail.KegbotEmailBackend")
+class StatsSummaryTestCase(TestCase):
+    fixtures = ["testdata/demo-site.json"]
+
+    def setUp(self):
+        self.client = ApiClient()
+        self.site = models.KegbotSite.objects.all().first()
+        self.site.server_version = get_version()
+        self.site.save()
+        # The fixture predates stored summaries.
+        stats.invalidate_all()
+        stats.rebuild_from_id(0)
+
+    def test_list_serves_summaries(self):
+        status, data = self.client.get("/api/kegs")
+        self.assertEqual(200, status)
+        for keg_data in data["results"]:
+            self.assertNotIn("stats", keg_data)
+            keg = models.Keg.objects.get(pk=keg_data["id"])
+            summary = keg_data["stats_summary"]
+            self.assertEqual(keg.drinks.count(), summary.get("total_pours", 0))
+            for name in summary.get("top_drinkers", {}):
+                self.assertFalse(name.isdigit(), name)
+
+    def test_expand_stats(self):
+        status, data = self.client.get("/api/sessions?expand=stats")
+        self.assertEqual(200, status)
+        session_data = data["results"][0]
+        session = models.DrinkingSession.objects.get(pk=session_data["id"])
+        self.assertEqual(session.drinks.count(), session_data["stats"]["total_pours"])
+
+    def test_detail_serves_stats(self):
+        keg = models.Keg.objects.first()
+        status, data = self.client.get(f"/api/kegs/{keg.id}")
+        self.assertEqual(200, status)
+        self.assertEqual(data["stats_summary"]["total_pours"], data["stats"]["total_pours"])
+
+    def test_fields(self):
+        status, data = self.client.get("/api/sessions?fields=id,stats_summary")
+        self.assertEqual(200, status)
+        self.assertEqual({"id", "stats_summary"}, set(data["results"][0]))
+
+        status, data = self.client.get("/api/sessions?fields=id,stats")
+        self.assertEqual({"id", "stats"}, set(data["results"][0]))
+
+
+@mock.patch.object(api_cache, "CACHE_SECONDS", 0)
+class QueryBudgetTestCase(TestCase):
+    """Each listing takes a fixed number of queries, whatever the page size.
+
+    Budgets are for building responses, so the response cache is off.
+    """
+
+    fixtures = ["testdata/demo-site.json"]
+
+    # The most queries a page of each listing may take, counting
+    # authentication, site loading and pagination.
+    BUDGETS = {
+        "/api/api-keys": 4,
+        "/api/auth-tokens": 4,
+        "/api/beverage-producers": 4,
+        "/api/beverages": 4,
+        "/api/controllers": 4,
+        "/api/devices": 4,
+        "/api/drinks": 5,
+        "/api/drinks?expand=stats": 5,
+        "/api/events": 8,
+        "/api/flow-meters": 4,
+        "/api/flow-toggles": 4,
+        "/api/invitations": 4,
+        "/api/kegs": 4,
+        "/api/kegs?expand=stats": 4,
+        "/api/notification-settings": 4,
+        "/api/plugin-data": 4,
+        "/api/sessions": 4,
+        "/api/sessions?expand=stats": 4,
+        "/api/stats": 4,
+        "/api/taps": 5,
+        "/api/thermo-logs": 4,
+        "/api/thermo-sensors": 4,
+        "/api/users": 4,
+    }
+
+    def setUp(self):
+        self.client = ApiClient()
+        self.site = models.KegbotSite.objects.all().first()
+        self.site.server_version = get_version()
+        self.site.save()
+        admin = models.User.objects.filter(is_staff=True).first()
+        self.client.api_key = models.ApiKey.objects.get_or_create(user=admin)[0].key
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            status, _ = self.client.get(url)
+        self.assertEqual(200, status, url)
+        return len(queries)
+
+    def test_list_budgets(self):
+        for url, budget in self.BUDGETS.items():
+            with self.subTest(url=url):
+                sep = "&" if "?" in url else "?"
+                # Warm the caches (usernames, for instance) first.
+                self.count_queries(f"{url}{sep}page_size=100")
+                small = self.count_queries(f"{url}{sep}page_size=1")
+                large = self.count_queries(f"{url}{sep}page_size=100")
+                self.assertEqual(small, large)
+                self.assertLessEqual(large, budget)
+
+    def test_status_budget(self):
+        self.count_queries("/api/status")
+        self.assertLessEqual(self.count_queries("/api/status"), 12)
+
+
+class ResponseCacheTestCase(TestCase):
+    fixtures = ["testdata/demo-site.json"]
+
+    def setUp(self):
+        cache.clear()
+        self.client = ApiClient()
+        self.site = models.KegbotSite.objects.all().first()
+        self.site.server_version = get_version()
+        self.site.save()
+        self.tap = models.KegTap.objects.filter(current_keg__isnull=False).first()
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            status, data = self.client.get(url)
+        self.assertEqual(200, status, url)
+        return len(queries), data
+
+    def test_reads_are_cached_until_a_pour(self):
+        for url in ("/api/taps", f"/api/kegs/{self.tap.current_keg_id}", "/api/status"):
+            with self.subTest(url=url):
+                built, _ = self.count_queries(url)
+                cached, _ = self.count_queries(url)
+                self.assertEqual(0, cached)
+                self.assertGreater(built, cached)
+
+        url = f"/api/kegs/{self.tap.current_keg_id}"
+        _, before = self.count_queries(url)
+        models.Drink.record_drink(self.tap, ticks=0, volume_ml=100)
+        built, after = self.count_queries(url)
+        self.assertGreater(built, 0)
+        self.assertAlmostEqual(before["served_volume_ml"] + 100, after["served_volume_ml"])
+
+    def test_keg_edit_invalidates(self):
+        url = f"/api/taps/{self.tap.id}"
+        self.count_queries(url)
+        models.Beverage.objects.filter(id=self.tap.current_keg.type_id).update(name="Renamed")
+        # A queryset update sends no signals: the cached response stands...
+        _, data = self.count_queries(url)
+        self.assertNotEqual("Renamed", data["current_keg"]["beverage"]["name"])
+        # ...until a save.
+        self.tap.current_keg.type.refresh_from_db()
+        self.tap.current_keg.type.save()
+        _, data = self.count_queries(url)
+        self.assertEqual("Renamed", data["current_keg"]["beverage"]["name"])
+
+    def test_privacy_is_checked_first(self):
+        self.count_queries("/api/taps")
+        self.site.privacy = models.KegbotSite.PRIVACY_CHOICE_MEMBERS
+        self.site.save()
+        status, _ = self.client.get("/api/taps")
+        self.assertEqual(403, status)
+
+
+class ConditionalGetTestCase(TestCase):
+    fixtures = ["testdata/demo-site.json"]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.site = models.KegbotSite.objects.all().first()
+        self.site.server_version = get_version()
+        self.site.save()
+        self.tap = models.KegTap.objects.filter(current_keg__isnull=False).first()
+
+    def get(self, url, **headers):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, headers=headers)
+        return response, len(queries)
+
+    def pour(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            models.Drink.record_drink(self.tap, ticks=0, volume_ml=100)
+
+    def test_unchanged_is_not_modified(self):
+        for url in ("/api/taps", f"/api/kegs/{self.tap.current_keg_id}", "/api/events"):
+            with self.subTest(url=url):
+                response, _ = self.get(url)
+                self.assertEqual(200, response.status_code)
+                etag = response["ETag"]
+                response, queries = self.get(url, if_none_match=etag)
+                self.assertEqual(304, response.status_code)
+                self.assertEqual(etag, response["ETag"])
+                self.assertEqual(0, queries)
+
+    def test_change_is_modified(self):
+        url = f"/api/taps/{self.tap.id}"
+        etag = self.get(url)[0]["ETag"]
+        self.pour()
+        response, _ = self.get(url, if_none_match=etag)
+        self.assertEqual(200, response.status_code)
+        self.assertNotEqual(etag, response["ETag"])
+        self.assertEqual(304, self.get(url, if_none_match=response["ETag"])[0].status_code)
+
+    def test_unrelated_change_is_not_modified(self):
+        url = "/api/kegs"
+        etag = self.get(url)[0]["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tap.save()
+        self.assertEqual(304, self.get(url, if_none_match=etag)[0].status_code)
+        self.assertEqual(200, self.get("/api/taps", if_none_match=etag)[0].status_code)
+
+    def test_if_modified_since(self):
+        self.pour()
+        response, _ = self.get("/api/events")
+        last_modified = response["Last-Modified"]
+        response, _ = self.get("/api/events", if_modified_since=last_modified)
+        self.assertEqual(304, response.status_code)
+        # If-None-Match takes precedence.
+        response, _ = self.get(
+            "/api/events", if_modified_since=last_modified, if_none_match='W/"stale"'
+        )
+        self.assertEqual(200, response.status_code)
+
+    def test_privacy_is_checked_first(self):
+        etag = self.get("/api/taps")[0]["ETag"]
+        self.site.privacy = models.KegbotSite.PRIVACY_CHOICE_MEMBERS
+        self.site.save()
+        self.assertEqual(403, self.get("/api/taps", if_none_match=etag)[0].status_code)
+
+
 class AccountFlowsTestCase(TestCase):
     fixtures = ["testdata/demo-site.json"]
 
@@ -68,6 +68,7 @@ urlpatterns = [
     path("setup/finish", views_setup.finish),
     path("setup/upgrade", views_setup.upgrade),
     path("status", views.system_status),
+    path("live", views.live, name="live"),
     path("schema", SpectacularAPIView.as_view(), name="api-schema"),
     path("docs", SpectacularSwaggerView.as_view(url_name="api-schema"), name="api-docs"),
 ]
@@ -3,6 +3,8 @@ from collections import defaultdict
 from django.conf import settings
 from django.contrib.auth import login as auth_login
 from django.contrib.auth import logout as auth_logout
+from django.db.models import OuterRef, Prefetch
+from django.http import StreamingHttpResponse
 from django.utils import timezone
 from django.views.decorators.csrf import ensure_csrf_cookie
 from drf_spectacular.types import OpenApiTypes
@@ -14,6 +16,7 @@ from rest_framework.decorators import (
     authentication_classes,
     parser_classes,
     permission_classes,
+    renderer_classes,
 )
 from rest_framework.exceptions import (
     NotAuthenticated,
@@ -22,14 +25,124 @@ from rest_framework.exceptions import (
     ValidationError,
 )
 from rest_framework.parsers import FormParser, MultiPartParser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 
 from pykeg.core import models
+from pykeg.kegboard import live as kegboard_live
 
-from . import filters, permissions, serializers
+from . import filters, permissions, renderers, serializers
+from .cache import cache_response
+from .conditional import conditional_get
+
+# Eager-loading plans: querysets that load, up front, everything the
+# matching serializer reads, so that serializing a page of objects takes
+# the same number of queries however long the page is.  Stats and
+# summaries come in as `stats_data`/`stats_summary_data` annotations (see
+# `serializers.StatsFieldsMixin`); the full stats only `with_stats`, since
+# lists leave them out by default.
+
+
+def _load_kegs(kegs, with_stats=False):
+    kegs = kegs.select_related("type__producer__picture", "type__picture").annotate(
+        stats_summary_data=models.Stats.latest_summary_subquery(keg=OuterRef("pk"))
+    )
+    if with_stats:
+        kegs = kegs.annotate(stats_data=models.Stats.latest_stats_subquery(keg=OuterRef("pk")))
+    return kegs
+
+
+def _load_sessions(sessions, with_stats=False):
+    sessions = sessions.annotate(
+        stats_summary_data=models.Stats.latest_summary_subquery(session=OuterRef("pk"))
+    )
+    if with_stats:
+        sessions = sessions.annotate(
+            stats_data=models.Stats.latest_stats_subquery(session=OuterRef("pk"))
+        )
+    return sessions
+
+
+def _load_taps(taps, with_stats=False):
+    kegs = _load_kegs(models.Keg.objects.all(), with_stats)
+    return taps.prefetch_related(Prefetch("current_keg", queryset=kegs))
+
+
+def _load_drinks(drinks, with_stats=False):
+    kegs = _load_kegs(models.Keg.objects.all(), with_stats)
+    return drinks.select_related("user__mugshot", "picture").prefetch_related(
+        Prefetch("keg", queryset=kegs)
+    )
+
+
+def _load_events(events, with_stats=False):
+    return events.select_related("user__mugshot").prefetch_related(
+        Prefetch("drink", queryset=_load_drinks(models.Drink.objects.all(), with_stats)),
+        Prefetch("keg", queryset=_load_kegs(models.Keg.objects.all(), with_stats)),
+        Prefetch(
+            "session", queryset=_load_sessions(models.DrinkingSession.objects.all(), with_stats)
+        ),
+    )
+
+
+class EagerLoadingMixin:
+    """Serves reads from the viewset's eager-loading plan.
+
+    Subclasses implement `eager_load()` with the `_load_*()` plan for their
+    serializer.  Other actions load objects plainly, since they serialize
+    them after changing them.
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ("list", "retrieve"):
+            queryset = self.eager_load(queryset)
+        return queryset
+
+    def eager_load(self, queryset):
+        raise NotImplementedError
+
+    def wants_stats(self):
+        """Whether the full stats of the objects being read are served."""
+        return self.action == "retrieve" or serializers.requests_stats(self.request)
+
+
+# What the polled views show, by change kind (see `conditional`).
+KEG_KINDS = ("keg", "beverage", "picture", "stats")
+TAP_KINDS = ("tap", *KEG_KINDS)
+EVENT_KINDS = ("event", "drink", "session", "user", *KEG_KINDS)
+
+
+class ConditionalReadMixin:
+    # Tags `list` and `retrieve` with the counters of `change_kinds`, and
+    # answers conditional GETs of them (see `conditional`).
+
+    change_kinds = ()
+
+    @conditional_get()
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional_get()
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+
+class CachedReadMixin:
+    # Serves `list` and `retrieve` from the response cache (see `cache`).
+    # No docstrings here: the schema would take them for the views'.
+
+    @cache_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cache_response
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
 
 
 class UserViewSet(
+    EagerLoadingMixin,
     mixins.CreateModelMixin,
     mixins.RetrieveModelMixin,
     mixins.ListModelMixin,
@@ -52,6 +165,9 @@ class UserViewSet(
     # Default lookup regex excludes ".", which usernames may contain.
     lookup_value_regex = "[^/]+"
 
+    def eager_load(self, queryset):
+        return queryset.select_related("mugshot")
+
     def get_permissions(self):
         if self.action in ("retrieve", "stats"):
             return [permissions.DashboardViewer()]
@@ -201,23 +317,31 @@ class PictureAttachMixin:
         return Response(self.get_serializer(obj).data)
 
 
-class BeverageProducerViewSet(PictureAttachMixin, viewsets.ModelViewSet):
+class BeverageProducerViewSet(EagerLoadingMixin, PictureAttachMixin, viewsets.ModelViewSet):
     """Lists all beverage producers in the system."""
 
     queryset = models.BeverageProducer.objects.all()
     serializer_class = serializers.BeverageProducerSerializer
     permission_classes = [permissions.AdminWriteDashboardRead]
 
+    def eager_load(self, queryset):
+        return queryset.select_related("picture")
 
-class BeverageViewSet(PictureAttachMixin, viewsets.ModelViewSet):
+
+class BeverageViewSet(EagerLoadingMixin, PictureAttachMixin, viewsets.ModelViewSet):
     """Lists all beverages in the system."""
 
     queryset = models.Beverage.objects.all()
     serializer_class = serializers.BeverageSerializer
     permission_classes = [permissions.AdminWriteDashboardRead]
 
+    def eager_load(self, queryset):
+        return queryset.select_related("producer__picture", "picture")
+
 
-class KegTapViewSet(viewsets.ModelViewSet):
+class KegTapViewSet(
+    ConditionalReadMixin, CachedReadMixin, EagerLoadingMixin, viewsets.ModelViewSet
+):
     """Lists all KegTaps in the system.
 
     Reads follow site privacy; tap management (including the keg and
@@ -227,6 +351,10 @@ class KegTapViewSet(viewsets.ModelViewSet):
     queryset = models.KegTap.objects.all()
     serializer_class = serializers.KegTapSerializer
     permission_classes = [permissions.AdminWriteDashboardRead]
+    change_kinds = TAP_KINDS
+
+    def eager_load(self, queryset):
+        return _load_taps(queryset, self.wants_stats())
 
     def _tap_response(self, tap):
         tap.refresh_from_db()
@@ -383,7 +511,7 @@ class FlowToggleViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAdminUser]
 
 
-class KegViewSet(viewsets.ModelViewSet):
+class KegViewSet(ConditionalReadMixin, CachedReadMixin, EagerLoadingMixin, viewsets.ModelViewSet):
     """Lists all Kegs in the system.
 
     Reads follow site privacy; keg management requires an admin. Deleting
@@ -394,6 +522,10 @@ class KegViewSet(viewsets.ModelViewSet):
     serializer_class = serializers.KegSerializer
     permission_classes = [permissions.AdminWriteDashboardRead]
     filterset_class = filters.KegFilter
+    change_kinds = KEG_KINDS
+
+    def eager_load(self, queryset):
+        return _load_kegs(queryset, self.wants_stats())
 
     @extend_schema(request=serializers.KegCreateRequestSerializer)
     def create(self, request, *args, **kwargs):
@@ -458,12 +590,12 @@ class KegViewSet(viewsets.ModelViewSet):
         keg = self.get_object()
         req = serializers.KegSpillRequestSerializer(data=request.data)
         req.is_valid(raise_exception=True)
-        keg.spilled_ml += req.validated_data["volume_ml"]
-        keg.save(update_fields=["spilled_ml"])
+        keg.add_volume(spilled_ml=req.validated_data["volume_ml"])
         return Response(self.get_serializer(keg).data)
 
 
 class DrinkViewSet(
+    EagerLoadingMixin,
     mixins.RetrieveModelMixin,
     mixins.ListModelMixin,
     mixins.DestroyModelMixin,
@@ -481,6 +613,9 @@ class DrinkViewSet(
     permission_classes = [permissions.DashboardViewer]
     filterset_class = filters.DrinkFilter
 
+    def eager_load(self, queryset):
+        return _load_drinks(queryset, self.wants_stats())
+
     def get_permissions(self):
         if self.action in ("destroy", "reassign"):
             return [permissions.IsAdminUser()]
@@ -571,7 +706,7 @@ class AuthenticationTokenViewSet(viewsets.ModelViewSet):
     filterset_class = filters.AuthenticationTokenFilter
 
 
-class DrinkingSessionViewSet(viewsets.ReadOnlyModelViewSet):
+class DrinkingSessionViewSet(EagerLoadingMixin, viewsets.ReadOnlyModelViewSet):
     """Lists all DrinkingSessions in the system."""
 
     queryset = models.DrinkingSession.objects.all()
@@ -579,8 +714,12 @@ class DrinkingSessionViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = [permissions.DashboardViewer]
     filterset_class = filters.DrinkingSessionFilter
 
+    def eager_load(self, queryset):
+        return _load_sessions(queryset, self.wants_stats())
+
     @extend_schema(responses=serializers.DrinkingSessionSerializer)
     @action(detail=False)
+    @cache_response
     def current(self, request):
         """Returns the currently-active session, or 404 if there is none."""
         try:
@@ -657,19 +796,25 @@ class StatsViewSet(viewsets.ReadOnlyModelViewSet):
 
     @extend_schema(responses=OpenApiTypes.OBJECT)
     @action(detail=False)
+    @conditional_get(("stats",))
+    @cache_response
     def system(self, request):
         """Returns the latest system-wide (all-time) stats blob."""
         site = getattr(request, "kbsite", None) or models.KegbotSite.get()
         return Response(site.get_stats())
 
 
-class SystemEventViewSet(viewsets.ReadOnlyModelViewSet):
+class SystemEventViewSet(ConditionalReadMixin, EagerLoadingMixin, viewsets.ReadOnlyModelViewSet):
     """Lists all SystemEvents in the system."""
 
     queryset = models.SystemEvent.objects.all()
     serializer_class = serializers.SystemEventSerializer
     permission_classes = [permissions.DashboardViewer]
     filterset_class = filters.SystemEventFilter
+    change_kinds = EVENT_KINDS
+
+    def eager_load(self, queryset):
+        return _load_events(queryset, self.wants_stats())
 
 
 class NotificationSettingsViewSet(viewsets.ModelViewSet):
@@ -700,6 +845,8 @@ class PluginDataViewSet(viewsets.ModelViewSet):
 @extend_schema(responses=serializers.SystemStatusSerializer)
 @api_view(["GET"])
 @permission_classes([permissions.DashboardViewer])
+@conditional_get(("site", "tap", *EVENT_KINDS))
+@cache_response
 def system_status(request):
     """The 'current system status' view.
 
@@ -711,13 +858,56 @@ def system_status(request):
     serializer = serializers.SystemStatusSerializer(
         instance={
             "site": request.kbsite,
-            "taps": models.KegTap.objects.all(),
-            "events": models.SystemEvent.objects.all().order_by("-id")[:20],
+            "taps": _load_taps(models.KegTap.objects.all(), with_stats=True),
+            "events": _load_events(models.SystemEvent.objects.all(), with_stats=True).order_by(
+                "-id"
+            )[:20],
         }
     )
     return Response(serializer.data)
 
 
+# Server-sent events, not JSON; documented in docs/source/kegboards.rst.
+@extend_schema(exclude=True)
+@api_view(["GET"])
+@renderer_classes([JSONRenderer, renderers.EventStreamRenderer])
+@permission_classes([permissions.DashboardViewer])
+def live(request):
+    """Streams pour updates, pours and temperatures as they arrive.
+
+    `?taps=1,2` limits the stream to those taps and their temperature
+    sensors; without it, every tap and sensor is streamed.
+    """
+    tap_ids = None
+    sensor_ids = ()
+    if "taps" in request.query_params:
+        try:
+            wanted = {int(tap_id) for tap_id in request.query_params["taps"].split(",")}
+        except ValueError:
+            raise ValidationError({"taps": "Expected a comma-separated list of tap ids."})
+        rows = models.KegTap.objects.filter(pk__in=wanted).values_list(
+            "id", "temperature_sensor_id"
+        )
+        if not rows:
+            raise NotFound("No such taps.")
+        tap_ids = [tap_id for tap_id, _ in rows]
+        sensor_ids = {sensor_id for _, sensor_id in rows if sensor_id}
+
+    try:
+        stream = kegboard_live.LiveStream(tap_ids, sensor_ids)
+    except kegboard_live.StreamsExhausted:
+        return Response(
+            {"detail": "Too many live streams open; retry shortly."},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": "5"},
+        )
+    response = StreamingHttpResponse(stream, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Don't let a fronting nginx buffer the stream.
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
 @extend_schema(
     request=serializers.SiteSettingsSerializer, responses=serializers.SiteSettingsSerializer
 )
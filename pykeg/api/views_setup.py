@@ -25,6 +25,7 @@ from rest_framework.response import Response
 
 from pykeg.core import defaults, models
 from pykeg.core.util import get_version, get_version_object
+from pykeg.util import dbstatus
 
 from . import permissions, serializers
 
@@ -69,6 +70,8 @@ def migrate(request):
     except Exception as e:
         logger.exception("Error migrating database")
         raise ValidationError({"detail": [str(e)]}) from e
+    finally:
+        dbstatus.invalidate()
     return Response({"output": out.getvalue()})
 
 
@@ -151,4 +154,6 @@ def upgrade(request):
     except Exception as e:
         logger.exception("Error upgrading database")
         raise ValidationError({"detail": [str(e)]}) from e
+    finally:
+        dbstatus.invalidate()
     return Response({"output": out.getvalue()})
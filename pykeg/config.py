@@ -145,3 +145,5 @@ define_setting("KEGBOT_IN_DOCKER", default=False, typefn=boolstr, required=False
 define_setting("KEGBOT_MEDIA_URL", default="", required=False)
 
 define_setting("KEGBOT_INSECURE_SHARED_API_KEY", default="", required=False)
+
+define_setting("KEGBOT_KEGBOARD_ASYNC", default=False, typefn=boolstr, required=False)
@@ -16,6 +16,9 @@ THERMO_SENSOR_RANGE = (-20.0, 80.0)
 # Maximum number of readings to keep.
 THERMO_SENSOR_HISTORY_MINUTES = 60 * 24
 
+# How often each sensor's readings older than that are pruned.
+THERMO_SENSOR_PRUNE_MINUTES = 60
+
 # Device names
 AUTH_MODULE_CORE_ONEWIRE = "core.onewire"
 AUTH_MODULE_CORE_RFID = "core.rfid"
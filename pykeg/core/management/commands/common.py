@@ -7,7 +7,7 @@ from django.core.management.base import BaseCommand
 from pykeg.util.runner import Runner
 
 
-def progbar(title, pos, total, width=40):
+def progbar(title, pos, total, width=40, extra=""):
     """Prints a progress bar to stdout.
 
     Args
@@ -15,6 +15,7 @@ def progbar(title, pos, total, width=40):
       pos: current position (integer)
       total: total positions (integer)
       width: width of the progres bar, in characters
+      extra: text to show after the position, such as a rate
     """
     if not sys.stdout.isatty():
         return
@@ -24,7 +25,7 @@ def progbar(title, pos, total, width=40):
         chars = int((float(pos) / total) * width)
     rem = width - chars
     inner = "+" * chars + " " * rem
-    sys.stdout.write(f"{title:<30}  [{inner}] {pos}/{total}\r")
+    sys.stdout.write(f"{title:<30}  [{inner}] {pos}/{total} {extra}\r")
     sys.stdout.flush()
 
 
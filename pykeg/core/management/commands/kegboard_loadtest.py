@@ -0,0 +1,98 @@
+import copy
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (
+    override_settings,
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+
+from pykeg.core import models
+from pykeg.core.management.commands.common import progbar
+from pykeg.core.util import get_version
+from pykeg.kegboard import loadtest
+
+
+class Command(BaseCommand):
+    help = "Benchmark the kegboard event endpoint with simulated boards."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--boards", type=int, default=10, help="Number of simulated boards.")
+        parser.add_argument("--rounds", type=int, default=100, help="Batches each board sends.")
+        parser.add_argument(
+            "--meters", type=int, default=2, help="Flow meters (and taps) per board."
+        )
+        parser.add_argument("--seed", type=int, default=0, help="Seed for pour volumes and delays.")
+        parser.add_argument(
+            "--redis-url",
+            help="A scratch redis to run against (it is written to), instead of an "
+            "in-process fakeredis. Must not be the site's own REDIS_URL.",
+        )
+
+    def handle(self, *args, **options):
+        # Everything happens in a throwaway test database and a scratch
+        # redis; the site's own data and redis state are never touched.
+        with override_settings(CACHES=self.scratch_caches(options["redis_url"])):
+            report = self.run_fleet(options)
+        self.print_report(report, options)
+
+    def scratch_caches(self, redis_url):
+        caches = copy.deepcopy(settings.CACHES)
+        if redis_url:
+            if redis_url.rstrip("/") == settings.KEGBOT["REDIS_URL"].rstrip("/"):
+                raise CommandError("--redis-url must not be the site's own redis")
+            pool_kwargs = {}
+        else:
+            try:
+                import fakeredis
+            except ImportError:
+                raise CommandError("fakeredis is not installed; pass --redis-url") from None
+            redis_url = "redis://kegboard-loadtest:6379/0"
+            pool_kwargs = {"connection_class": fakeredis.FakeRedisConnection}
+        for cache in caches.values():
+            if cache.get("BACKEND") == "django_redis.cache.RedisCache":
+                cache["LOCATION"] = redis_url
+                cache["OPTIONS"]["CONNECTION_POOL_KWARGS"] = pool_kwargs
+        return caches
+
+    def run_fleet(self, options):
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        boards = []
+        try:
+            site = models.KegbotSite.get()
+            site.is_setup = True
+            site.server_version = get_version()
+            site.save()
+            boards = loadtest.create_fleet(options["boards"], options["meters"], options["seed"])
+            total = options["rounds"]
+
+            def cb(round_number, report):
+                progbar("sending batches", round_number, total)
+
+            return loadtest.run(boards, total, callback=cb)
+        finally:
+            loadtest.forget_fleet(boards)
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+    def print_report(self, report, options):
+        print("")
+        summary = report.summary()
+        print(
+            f"{summary['batches']} batches, {summary['events']} events "
+            f"from {options['boards']} boards in {report.elapsed:.1f}s "
+            f"({summary['events_per_second']:.0f} events/s, {summary['errors']} errors)"
+        )
+        print(
+            f"latency per batch: p50 {summary['p50_ms']:.1f}ms, "
+            f"p99 {summary['p99_ms']:.1f}ms, max {summary['max_ms']:.1f}ms"
+        )
+        print(f"queries per event: {summary['queries_per_event']:.2f}")
+        print(
+            f"redis commands per event: {summary['redis_commands_per_event']:.2f} "
+            f"({summary['redis_round_trips_per_batch']:.1f} round trips per batch)"
+        )
@@ -1,3 +1,5 @@
+import time
+
 from django.core.management.base import BaseCommand
 from django.db import transaction
 
@@ -8,17 +10,32 @@ from pykeg.core.management.commands.common import progbar
 class Command(BaseCommand):
     help = "Regenerate all cached stats."
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            action="store",
+            type=int,
+            dest="batch_size",
+            default=stats.REBUILD_BATCH_SIZE,
+            help="Number of drinks read, and stats rows written, per query.",
+        )
+
     @transaction.atomic
     def handle(self, *args, **options):
         num_drinks = models.Drink.objects.all().count()
         self.pos = 0
+        start = time.monotonic()
 
-        def cb(results, self=self):
+        def cb(drink, self=self):
             self.pos += 1
-            progbar("regenerating stats", self.pos, num_drinks)
+            elapsed = time.monotonic() - start
+            rate = self.pos / elapsed if elapsed else 0
+            progbar("regenerating stats", self.pos, num_drinks, extra=f"({rate:.0f} drinks/s)")
 
         stats.invalidate_all()
-        stats.rebuild_from_id(0, cb=cb)
+        stats.rebuild_from_id(0, cb=cb, batch_size=options["batch_size"])
 
+        elapsed = time.monotonic() - start
+        rate = self.pos / elapsed if elapsed else 0
         print("")
-        print("done!")
+        print(f"done! {self.pos} drinks in {elapsed:.1f}s ({rate:.0f} drinks/s)")
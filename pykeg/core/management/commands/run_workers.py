@@ -18,6 +18,7 @@ class Command(RunnerCommand):
 
         queue_names = " ".join(settings.RQ_QUEUES.keys())
         ret = [
-            ("rq", f"{sys.argv[0]} rqworker {queue_names}{default_log} -v 3"),
+            # The scheduler runs retries that back off (kegboard batches).
+            ("rq", f"{sys.argv[0]} rqworker {queue_names} --with-scheduler{default_log} -v 3"),
         ]
         return ret
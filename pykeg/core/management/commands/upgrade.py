@@ -8,6 +8,7 @@ from packaging.version import Version
 from pykeg.core import models
 from pykeg.core.management.commands import regen_stats
 from pykeg.core.util import get_version_object
+from pykeg.util import dbstatus
 
 # Versions earlier than this cannot be upgraded. History:
 #  v0.9.35 - migrations rebased to 0001
@@ -82,6 +83,7 @@ class Command(BaseCommand):
         self.do_version_upgrades(installed_version)
 
         run(migrate.Command(), args=["--noinput", "-v", "0"])
+        dbstatus.invalidate()
 
         if not options.get("skip_stats"):
             run(regen_stats.Command())
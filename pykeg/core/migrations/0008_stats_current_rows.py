@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0007_kegboard_protocol_fields"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="stats",
+            name="drink",
+            field=models.ForeignKey(
+                null=True, on_delete=django.db.models.deletion.SET_NULL, to="core.drink"
+            ),
+        ),
+    ]
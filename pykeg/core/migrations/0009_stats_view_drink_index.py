@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0008_stats_current_rows"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="stats",
+            index=models.Index(
+                fields=["user", "session", "keg", "drink"], name="core_stats_view_drink"
+            ),
+        ),
+    ]
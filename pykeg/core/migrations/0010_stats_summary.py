@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:19
+
+import pykeg.util.kbjson
+from django.db import migrations, models
+
+# Copied from pykeg.core.stats at the time of this migration.
+SUMMARY_TOP_DRINKERS = 10
+
+
+def summarize(stats):
+    if not stats.get("total_pours"):
+        return {}
+    volumes = stats.get("volume_by_drinker", {})
+    top = sorted(volumes.items(), key=lambda item: item[1], reverse=True)
+    return {
+        "top_drinkers": dict(top[:SUMMARY_TOP_DRINKERS]),
+        "total_pours": stats["total_pours"],
+        "total_volume_ml": stats.get("total_volume_ml", 0),
+    }
+
+
+def summarize_latest_rows(apps, schema_editor):
+    """Fills in the summaries served by the keg, session and site endpoints.
+
+    Other rows get theirs on their next update, or from `kegbot regen_stats`.
+    """
+    Stats = apps.get_model("core", "Stats")
+    Keg = apps.get_model("core", "Keg")
+    DrinkingSession = apps.get_model("core", "DrinkingSession")
+
+    views = [{}]
+    views += [{"keg_id": pk} for pk in Keg.objects.values_list("id", flat=True)]
+    views += [{"session_id": pk} for pk in DrinkingSession.objects.values_list("id", flat=True)]
+    for view in views:
+        view = {"user_id": None, "keg_id": None, "session_id": None, **view}
+        row = Stats.objects.filter(**view).order_by("-id").first()
+        if row is not None:
+            row.summary = summarize(row.stats)
+            row.save(update_fields=["summary"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0009_stats_view_drink_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="stats",
+            name="summary",
+            field=models.JSONField(
+                default=dict,
+                encoder=pykeg.util.kbjson.JSONEncoder,
+                help_text="Compact summary of `stats`, served by list endpoints.",
+            ),
+        ),
+        migrations.RunPython(summarize_latest_rows, migrations.RunPython.noop),
+    ]
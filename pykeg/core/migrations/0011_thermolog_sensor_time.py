@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:20
+
+from django.db import migrations, models
+
+
+def remove_duplicate_readings(apps, schema_editor):
+    """Keeps the newest record of each (sensor, time), as the old writes did.
+
+    Concurrent readings could race `get_or_create` into duplicates.
+    """
+    Thermolog = apps.get_model("core", "Thermolog")
+    duplicates = (
+        Thermolog.objects.values("sensor", "time")
+        .annotate(count=models.Count("id"), keep=models.Max("id"))
+        .filter(count__gt=1)
+    )
+    for row in duplicates.iterator():
+        Thermolog.objects.filter(sensor=row["sensor"], time=row["time"]).exclude(
+            id=row["keep"]
+        ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0010_stats_summary"),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_readings, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="thermolog",
+            constraint=models.UniqueConstraint(
+                fields=("sensor", "time"), name="core_thermolog_sensor_time"
+            ),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0011_thermolog_sensor_time"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="drinkingsession",
+            index=models.Index(fields=["end_time"], name="core_session_end_time"),
+        ),
+    ]
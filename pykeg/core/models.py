@@ -1,8 +1,12 @@
+import collections
+import copy
 import datetime
 import logging
 import os
 import random
 import re
+import threading
+import time
 import urllib.parse
 from uuid import uuid4
 
@@ -13,9 +17,10 @@ from django.core import validators
 from django.core.cache import cache
 from django.core.files.storage import default_storage
 from django.core.mail import send_mail
+from django.core.signals import request_finished, request_started
 from django.core.validators import MaxValueValidator, MinValueValidator, RegexValidator
 from django.db import models, transaction
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.urls import reverse, reverse_lazy
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
@@ -178,6 +183,52 @@ class User(AbstractBaseUser):
         signals.user_created.send_robust(sender=cls, user=user)
         return user
 
+    @classmethod
+    def get_usernames(cls, pks):
+        """Returns a map of each of `pks` to the username of that user id.
+
+        Ids of unknown users, and malformed ids, are left out.  Usernames are
+        cached, and memoized for the rest of the current request; at most
+        one query is made for those not already known.
+        """
+        ids = {}
+        for pk in pks:
+            try:
+                ids[pk] = int(pk)
+            except TypeError, ValueError:
+                continue
+
+        memo = getattr(_username_memo, "names", None)
+        names = {}
+        wanted = set(ids.values())
+        if memo is not None:
+            names.update((user_id, memo[user_id]) for user_id in wanted if user_id in memo)
+            wanted -= set(names)
+        if wanted:
+            keys = {USERNAME_CACHE_KEY.format(pk=user_id): user_id for user_id in wanted}
+            for key, username in cache.get_many(list(keys)).items():
+                names[keys[key]] = username
+            wanted -= set(names)
+        if wanted:
+            found = dict(cls.objects.filter(pk__in=wanted).values_list("id", "username"))
+            # Unknown ids (such as deleted users) are remembered as "".
+            found.update((user_id, "") for user_id in wanted - set(found))
+            cache.set_many(
+                {USERNAME_CACHE_KEY.format(pk=user_id): name for user_id, name in found.items()},
+                USERNAME_CACHE_TIMEOUT,
+            )
+            names.update(found)
+        if memo is not None:
+            memo.update(names)
+
+        return {pk: names[user_id] for pk, user_id in ids.items() if names.get(user_id)}
+
+
+# Caches `User.get_usernames()`, which resolves the user ids kept in stats.
+USERNAME_CACHE_KEY = "user:{pk}:username"
+USERNAME_CACHE_TIMEOUT = int(datetime.timedelta(days=1).total_seconds())
+_username_memo = threading.local()
+
 
 def _user_pre_save(sender, instance, **kwargs):
     user = instance
@@ -185,7 +236,31 @@ def _user_pre_save(sender, instance, **kwargs):
         user.display_name = user.username
 
 
+def _user_changed(sender, instance, **kwargs):
+    # The username may have changed (see the rename_user command). Dropped
+    # again on commit, so a name cached by another process mid-transaction
+    # doesn't outlive the change.
+    key = USERNAME_CACHE_KEY.format(pk=instance.pk)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+    memo = getattr(_username_memo, "names", None)
+    if memo is not None:
+        memo.pop(instance.pk, None)
+
+
+def _start_username_memo(sender, **kwargs):
+    _username_memo.names = {}
+
+
+def _end_username_memo(sender, **kwargs):
+    _username_memo.names = None
+
+
 pre_save.connect(_user_pre_save, sender=User)
+post_save.connect(_user_changed, sender=User)
+post_delete.connect(_user_changed, sender=User)
+request_started.connect(_start_username_memo)
+request_finished.connect(_end_username_memo)
 
 
 class Invitation(models.Model):
@@ -343,11 +418,41 @@ class KegbotSite(models.Model):
         return self.name
 
     @classmethod
-    def get(cls):
-        """Gets the default site settings."""
-        return KegbotSite.objects.get_or_create(
-            name="default", defaults={"is_setup": False, "server_version": get_version()}
-        )[0]
+    def get(cls, create=True):
+        """Gets the default site settings.
+
+        The row is cached for the whole process, and re-read only once a
+        save anywhere has changed its version stamp (see `SITE_VERSION_KEY`).
+        Each call returns a copy, so callers may modify it freely.
+
+        Args:
+            create: If the row doesn't exist yet, whether to create it; if
+                not, None is returned.
+        """
+        global _site_cache
+        now = time.monotonic()
+        cached = _site_cache
+        if cached is None or not _site_is_current(cached, now):
+            version = cache.get(SITE_VERSION_KEY)
+            if version is None:
+                version = uuid4().hex
+                if not cache.add(SITE_VERSION_KEY, version, None):
+                    version = cache.get(SITE_VERSION_KEY, version)
+            if cached is not None and cached[0] == version:
+                site = cached[2]
+            else:
+                site = cls.objects.filter(name="default").first()
+                if site is None:
+                    if not create:
+                        return None
+                    site = cls.objects.get_or_create(
+                        name="default",
+                        defaults={"is_setup": False, "server_version": get_version()},
+                    )[0]
+            cached = _site_cache = (version, now, site)
+            if getattr(_site_memo, "checked", None) is not None:
+                _site_memo.checked = True
+        return copy.copy(cached[2])
 
     @classmethod
     def get_installed_version(cls):
@@ -363,6 +468,9 @@ class KegbotSite(models.Model):
     def get_stats(self):
         return Stats.get_latest_for_view()
 
+    def get_stats_summary(self):
+        return Stats.get_summary_for_view()
+
     def get_session_timeout_timedelta(self):
         return datetime.timedelta(minutes=self.session_timeout_minutes)
 
@@ -451,12 +559,59 @@ class ApiKey(models.Model):
         return f"{random.randint(0, 2**128 - 1):032x}"
 
 
+# `KegbotSite.get()` keeps the site row for the whole process, with the
+# version stamp it was read at.  Saves store a new stamp in redis; each
+# process compares stamps once per request, or every SITE_RECHECK_SECONDS
+# outside of requests (workers, commands), and re-reads the row when they
+# differ.
+SITE_VERSION_KEY = "site:version"
+SITE_RECHECK_SECONDS = 5
+# (version, checked_at, site), or None.
+_site_cache = None
+# `checked` is False at the start of each request, and None outside one.
+_site_memo = threading.local()
+
+
+def _site_is_current(cached, now):
+    checked = getattr(_site_memo, "checked", None)
+    if checked is None:
+        return now - cached[1] < SITE_RECHECK_SECONDS
+    return checked
+
+
+def invalidate_site_cache():
+    """Drops this process' copy of the site row; the next read reloads it."""
+    global _site_cache
+    _site_cache = None
+
+
+def _new_site_version():
+    invalidate_site_cache()
+    cache.set(SITE_VERSION_KEY, uuid4().hex, None)
+
+
+def _start_site_memo(sender, **kwargs):
+    _site_memo.checked = False
+
+
+def _end_site_memo(sender, **kwargs):
+    _site_memo.checked = None
+
+
 def _sitesettings_post_save(sender, instance, **kwargs):
-    # Privacy settings may have changed.
-    cache.clear()
+    # Only the site row itself is invalidated here: redis also holds state
+    # that must survive (kegboard inboxes and cursors, queued jobs, pending
+    # stats). Cached API responses are dropped by `signal_handlers`.
+    # Stamped again on commit, so a row re-read by another process
+    # mid-transaction doesn't outlive the change.
+    _new_site_version()
+    transaction.on_commit(_new_site_version)
 
 
 post_save.connect(_sitesettings_post_save, sender=KegbotSite)
+post_delete.connect(_sitesettings_post_save, sender=KegbotSite)
+request_started.connect(_start_site_memo)
+request_finished.connect(_end_site_memo)
 
 
 class BeverageProducer(models.Model):
@@ -788,7 +943,7 @@ class KegTap(models.Model):
             meter.save()
 
         if toggle_name:
-            toggle = models.FlowToggle.get_or_create_from_toggle_name(toggle_name)
+            toggle = FlowToggle.get_or_create_from_toggle_name(toggle_name)
             tap.connect_toggle(toggle)
 
         signals.tap_created.send_robust(sender=cls, tap=tap)
@@ -1022,6 +1177,24 @@ class Keg(models.Model):
     def remaining_volume_ml(self):
         return self.full_volume_ml - self.served_volume_ml - self.spilled_ml
 
+    def add_volume(self, served_ml=0, spilled_ml=0):
+        """Adds to the served and spilled volumes, and reloads them.
+
+        The sums are computed by the database (with `F()` expressions), so
+        concurrent pours each count in full; the updated row then stays
+        locked until the transaction ends. Negative volumes subtract.
+        """
+        fields = []
+        if served_ml:
+            self.served_volume_ml = models.F("served_volume_ml") + served_ml
+            fields.append("served_volume_ml")
+        if spilled_ml:
+            self.spilled_ml = models.F("spilled_ml") + spilled_ml
+            fields.append("spilled_ml")
+        if fields:
+            self.save(update_fields=fields)
+            self.refresh_from_db(fields=fields)
+
     def percent_full(self):
         if self.full_volume_ml is None or self.full_volume_ml <= 0:
             return 0
@@ -1054,6 +1227,9 @@ class Keg(models.Model):
     def get_stats(self):
         return Stats.get_latest_for_view(keg=self)
 
+    def get_stats_summary(self):
+        return Stats.get_summary_for_view(keg=self)
+
     def get_illustration(self, thumbnail=False):
         pct = self.percent_full()
         if pct >= 98.0:
@@ -1073,7 +1249,8 @@ class Keg(models.Model):
 
         url = urllib.parse.urljoin(settings.STATIC_URL, img_path)
         if not urllib.parse.urlparse(url).scheme:
-            url = KegbotSite.get().full_url(url)
+            # As `KegbotSite.full_url()`, without loading the site.
+            url = urllib.parse.urljoin(str(get_base_url()), url)
         return url
 
     def get_illustration_thumb(self):
@@ -1106,17 +1283,20 @@ class Keg(models.Model):
     @transaction.atomic
     def cancel(self):
         """Permanently deletes this keg and ALL drinks."""
-        keg_drinks = self.drinks.all().order_by("id")
-
-        first_deleted_drink_id = None
-        if keg_drinks:
-            first_deleted_drink_id = keg_drinks[0].id
-            sessions = set()
-            for drink in keg_drinks:
-                sessions.add(drink.session)
-                drink.delete()
-            for session in sessions:
-                session.Rebuild()
+        keg_drinks = self.drinks.all()
+
+        first_deleted_drink_id = keg_drinks.aggregate(first=models.Min("id"))["first"]
+        if first_deleted_drink_id is not None:
+            session_ids = set(keg_drinks.values_list("session_id", flat=True))
+            # Locked (in a fixed order) before the drinks go, so pours into
+            # these sessions wait for their rebuild.
+            sessions = list(
+                DrinkingSession.objects.select_for_update()
+                .filter(id__in=session_ids)
+                .order_by("id")
+            )
+            keg_drinks.delete()
+            DrinkingSession.rebuild_sessions(sessions)
 
         keg_id = self.id
         self.delete()
@@ -1410,6 +1590,8 @@ class Drink(models.Model):
         if previous_user == user:
             return False
 
+        # Concurrent edits of the session's drinks rebuild it in turn.
+        self.session = DrinkingSession.objects.select_for_update().get(id=self.session_id)
         self.user = user
         self.save()
 
@@ -1422,7 +1604,7 @@ class Drink(models.Model):
 
         self.session.Rebuild()
         signals.drink_assigned.send_robust(
-            sender=self.__class__, drink_id=self.id, previous_user=previous_user
+            sender=self.__class__, drink_id=self.id, drink=self, previous_user=previous_user
         )
         return True
 
@@ -1432,20 +1614,20 @@ class Drink(models.Model):
         if volume_ml == self.volume_ml:
             return
 
+        # Concurrent edits of the session's drinks rebuild it in turn.
+        self.session = DrinkingSession.objects.select_for_update().get(id=self.session_id)
         previous_volume = self.volume_ml
 
         difference = volume_ml - self.volume_ml
         self.volume_ml = volume_ml
         self.save(update_fields=["volume_ml"])
 
-        keg = self.keg
-        keg.served_volume_ml += difference
-        keg.save(update_fields=["served_volume_ml"])
+        self.keg.add_volume(served_ml=difference)
 
         self.session.Rebuild()
 
         signals.drink_adjusted.send_robust(
-            sender=self.__class__, drink_id=self.id, previous_volume=previous_volume
+            sender=self.__class__, drink_id=self.id, drink=self, previous_volume=previous_volume
         )
 
     @classmethod
@@ -1505,8 +1687,7 @@ class Drink(models.Model):
         keg = tap.current_keg
 
         if spilled:
-            keg.spilled_ml += volume_ml
-            keg.save(update_fields=["spilled_ml"])
+            keg.add_volume(spilled_ml=volume_ml)
             return None
 
         if volume_ml is None:
@@ -1524,14 +1705,7 @@ class Drink(models.Model):
         if not pour_time:
             pour_time = timezone.now()
 
-        if tick_time_series:
-            try:
-                # Validate the time series by parsing it; canonicalize it by generating
-                # it again.  If malformed, just junk it; it's non-essential information.
-                tick_time_series = time_series.to_string(time_series.from_string(tick_time_series))
-            except ValueError as e:
-                logger.warning(f"Time series invalid, ignoring. Error was: {e}")
-                tick_time_series = ""
+        tick_time_series = _canonical_time_series(tick_time_series)
 
         d = Drink(
             ticks=ticks,
@@ -1547,8 +1721,7 @@ class Drink(models.Model):
         DrinkingSession.AssignSessionForDrink(d)
         d.save()
 
-        keg.served_volume_ml += volume_ml
-        keg.save(update_fields=["served_volume_ml"])
+        keg.add_volume(served_ml=volume_ml)
 
         if photo:
             pic = Picture.objects.create(image=photo, user=d.user, keg=d.keg, session=d.session)
@@ -1560,6 +1733,96 @@ class Drink(models.Model):
         signals.drink_recorded.send_robust(sender=cls, drink=d)
         return d
 
+    @classmethod
+    @transaction.atomic
+    def record_drinks(cls, pours):
+        """Records a batch of pours, like `record_drink()` for each.
+
+        Args:
+            pours: A list of dicts of `record_drink()` keyword arguments:
+                `tap` (a KegTap), `ticks` and `volume_ml`, and optionally
+                `username`, `pour_time`, `duration`, `shout`,
+                `tick_time_series` and `pour_id`.
+
+        Pours whose `pour_id` is already recorded (or repeated in the batch)
+        are skipped, as are pours at a tap with no active keg. Unknown
+        usernames are recorded as guest. Sessions, kegs and system events are
+        updated once for the whole batch, and `events_created` and
+        `drinks_recorded` are sent once.
+
+        Returns:
+            The newly-created Drinks, in pour order.
+        """
+        now = timezone.now()
+        pours = sorted(pours, key=lambda pour: pour.get("pour_time") or now)
+
+        pour_ids = {pour["pour_id"] for pour in pours if pour.get("pour_id")}
+        seen = set(
+            Drink.objects.filter(pour_id__in=pour_ids).values_list("pour_id", flat=True)
+            if pour_ids
+            else ()
+        )
+        usernames = {pour.get("username") or "guest" for pour in pours} | {"guest"}
+        users = User.objects.in_bulk(usernames, field_name="username")
+
+        site = KegbotSite.get()
+        session_delta = site.get_session_timeout_timedelta()
+        session = None
+        sessions = {}
+        kegs = {}
+        served = collections.defaultdict(float)
+        drinks = []
+        for pour in pours:
+            pour_id = pour.get("pour_id") or None
+            if pour_id in seen:
+                continue
+            tap = pour["tap"]
+            if not tap.is_active or not tap.current_keg:
+                logger.warning(f"Pour {pour_id} dropped: no active keg at {tap}")
+                continue
+            if pour_id:
+                seen.add(pour_id)
+            keg = kegs.setdefault(tap.current_keg.id, tap.current_keg)
+            user = users.get(pour.get("username") or "guest")
+            if user is None:
+                logger.warning(
+                    f"Pour {pour_id}: unknown user {pour['username']!r}, recording as guest"
+                )
+                user = users["guest"]
+
+            drink = Drink(
+                ticks=pour["ticks"],
+                keg=keg,
+                user=user,
+                volume_ml=pour["volume_ml"],
+                time=pour.get("pour_time") or now,
+                duration=pour.get("duration", 0),
+                shout=pour.get("shout", ""),
+                tick_time_series=_canonical_time_series(pour.get("tick_time_series", "")),
+                pour_id=pour_id,
+            )
+            if session is None or not session.IsActive(drink.time):
+                session = DrinkingSession.session_for_update(drink.time)
+            session._AddDrinkNoSave(drink, session_delta)
+            sessions[session.id] = session
+            drink.session = session
+            drink.save()
+
+            served[keg.id] += drink.volume_ml
+            drinks.append(drink)
+
+        if not drinks:
+            return []
+        for session in sessions.values():
+            session.save(update_fields=["start_time", "end_time", "volume_ml"])
+        for keg in kegs.values():
+            keg.add_volume(served_ml=served[keg.id])
+
+        events = SystemEvent.build_events_for_drinks(drinks)
+        signals.events_created.send_robust(sender=cls, events=events)
+        signals.drinks_recorded.send_robust(sender=cls, drinks=drinks)
+        return drinks
+
     @transaction.atomic
     def cancel_drink(self, spilled=False):
         """Permanently deletes a Drink from the system.
@@ -1577,26 +1840,19 @@ class Drink(models.Model):
         Returns:
             The deleted drink.
         """
-        session = self.session
+        # Concurrent edits of the session's drinks rebuild it in turn.
+        session = DrinkingSession.objects.select_for_update().get(id=self.session_id)
         drink_id = self.id
-        keg = self.keg
         volume_ml = self.volume_ml
 
-        keg_update_fields = ["served_volume_ml"]
-        keg.served_volume_ml -= volume_ml
-
         # Transfer volume to spillage if requested.
-        if spilled and volume_ml and self.keg:
-            keg.spilled_ml += volume_ml
-            keg_update_fields.append("spilled_ml")
-
-        keg.save(update_fields=keg_update_fields)
+        self.keg.add_volume(served_ml=-volume_ml, spilled_ml=volume_ml if spilled else 0)
 
         # Delete the drink, including any objects related to it.
         drink_id = self.id
         self.delete()
         session.Rebuild()
-        signals.drink_canceled.send_robust(sender=self.__class__, drink_id=drink_id)
+        signals.drink_canceled.send_robust(sender=self.__class__, drink_id=drink_id, drink=self)
 
     def __str__(self):
         return f"Drink {self.id} by {self.user}"
@@ -1713,6 +1969,11 @@ class DrinkingSession(models.Model):
     class Meta:
         get_latest_by = "start_time"
         ordering = ("-start_time",)
+        indexes = [
+            # Pours lock the latest session (`session_for_update()`); without
+            # an index, InnoDB would lock every row it scans to find it.
+            models.Index(fields=["end_time"], name="core_session_end_time"),
+        ]
 
     start_time = models.DateTimeField()
     end_time = models.DateTimeField()
@@ -1728,8 +1989,9 @@ class DrinkingSession(models.Model):
     def Duration(self):
         return self.end_time - self.start_time
 
-    def _AddDrinkNoSave(self, drink):
-        session_delta = KegbotSite.get().get_session_timeout_timedelta()
+    def _AddDrinkNoSave(self, drink, session_delta=None):
+        if session_delta is None:
+            session_delta = KegbotSite.get().get_session_timeout_timedelta()
         session_end = drink.time + session_delta
 
         if self.start_time > drink.time:
@@ -1771,6 +2033,9 @@ class DrinkingSession(models.Model):
     def get_stats(self):
         return Stats.get_latest_for_view(session=self)
 
+    def get_stats_summary(self):
+        return Stats.get_summary_for_view(session=self)
+
     def summarize_drinkers(self):
         stats = self.get_stats()
         volmap = stats.get("volume_by_drinker", {})
@@ -1818,51 +2083,85 @@ class DrinkingSession(models.Model):
         """Recomputes start time, end time, and volume, based on current drinks.
 
         This method should be called after changing the set of drinks
-        belonging to this session.
+        belonging to this session.  A session left without drinks is deleted.
 
         This method has no effect on statistics; see stats module.
         """
-        self.volume_ml = 0
+        DrinkingSession.rebuild_sessions([self])
 
-        drinks = self.drinks.all()
-        if not drinks:
-            self.delete()
-            return
+    @classmethod
+    def rebuild_sessions(cls, sessions):
+        """Like `Rebuild()`, for many sessions at once.
 
+        The sessions' drinks are totalled in a single aggregate query and
+        the sessions written back in a single update, however many drinks
+        they hold.
+
+        Returns:
+            The sessions that still have drinks.
+        """
+        sessions = {session.id: session for session in sessions}
+        if not sessions:
+            return []
+
+        totals = (
+            Drink.objects.filter(session_id__in=sessions)
+            .values("session_id")
+            .annotate(
+                total_ml=models.Sum("volume_ml"),
+                first_time=models.Min("time"),
+                last_time=models.Max("time"),
+            )
+            .order_by()
+        )
         session_delta = KegbotSite.get().get_session_timeout_timedelta()
-        min_time = None
-        max_time = None
-        for d in drinks:
-            self.AddDrink(d)
-            if min_time is None or d.time < min_time:
-                min_time = d.time
-            if max_time is None or d.time > max_time:
-                max_time = d.time
-        self.start_time = min_time
-        self.end_time = max_time + session_delta
-        self.save()
+        rebuilt = []
+        for row in totals:
+            session = sessions.pop(row["session_id"])
+            session.volume_ml = row["total_ml"]
+            session.start_time = row["first_time"]
+            session.end_time = row["last_time"] + session_delta
+            rebuilt.append(session)
+
+        if rebuilt:
+            cls.objects.bulk_update(rebuilt, ["volume_ml", "start_time", "end_time"])
+        if sessions:
+            cls.objects.filter(id__in=sessions).delete()
+        return rebuilt
 
     @classmethod
-    def AssignSessionForDrink(cls, drink):
-        # Return existing session if already assigned.
-        if drink.session:
-            return drink.session
+    def session_for_update(cls, when):
+        """Returns the session a drink poured at `when` joins, locked.
+
+        That's the latest session if it is still active, else a new one.
+        The session's row stays locked until the transaction ends, so
+        concurrent pours extend it one at a time. Starting a session also
+        locks the site row, and looks again for one started meanwhile:
+        pours racing past an expired session share the new one.
+        """
+        latest = cls.objects.select_for_update().order_by("-end_time").first()
+        if latest is not None and latest.IsActive(when):
+            return latest
 
-        # Return last session if one already exists
-        q = DrinkingSession.objects.all().order_by("-end_time")[:1]
-        if q and q[0].IsActive(drink.time):
-            session = q[0]
-            session.AddDrink(drink)
-            drink.session = session
-            drink.save()
-            return session
+        site = KegbotSite.objects.select_for_update().filter(name="default")
+        list(site.values_list("id", flat=True))
+        latest = cls.objects.select_for_update().order_by("-end_time").first()
+        if latest is not None and latest.IsActive(when):
+            return latest
 
-        # Create a new session.
         # Record the session's timezone, since this is important for statistical
         # purposes (eg computing the day of the week).
         tzname = KegbotSite.get().timezone
-        session = cls(start_time=drink.time, end_time=drink.time, timezone=tzname)
-        session.save()
+        return cls.objects.create(start_time=when, end_time=when, timezone=tzname)
+
+    @classmethod
+    @transaction.atomic
+    def AssignSessionForDrink(cls, drink):
+        # Return existing session if already assigned.
+        if drink.session:
+            return drink.session
+
+        session = cls.session_for_update(drink.time)
         session.AddDrink(drink)
         drink.session = session
         drink.save()
@@ -1887,7 +2186,6 @@ class ThermoSensor(models.Model):
         except Thermolog.DoesNotExist:
             return None
 
-    @transaction.atomic
     def log_sensor_reading(self, temperature, when=None):
         """Logs a ThermoSensor reading.
 
@@ -1896,9 +2194,9 @@ class ThermoSensor(models.Model):
         given time period, that record will be updated with the current temperature
         ("last one wins").
 
-        Regardless of this record's timestamp, any records older than
-        `kb_common.THERMO_SENSOR_HISTORY_MINUTES` will be deleted as a side effect
-        of this call.
+        The reading is written with a single upsert.  Records older than
+        `kb_common.THERMO_SENSOR_HISTORY_MINUTES` are removed separately, by
+        `prune_readings()`.
 
         Args:
             temperature: Temperature, in celsius degrees.  Values outside of the
@@ -1910,9 +2208,8 @@ class ThermoSensor(models.Model):
         Returns:
             The record for this reading.
         """
-        now = timezone.now()
         if not when:
-            when = now
+            when = timezone.now()
 
         # The maximum resolution of ThermoSensor records is 1 minute.  Round the
         # time down to the nearest minute; if a record already exists for this time,
@@ -1925,21 +2222,30 @@ class ThermoSensor(models.Model):
         if temperature < min_val or temperature > max_val:
             raise ValueError("Temperature out of bounds")
 
-        log_defaults = {
-            "temp": temperature,
-        }
-        record, _ = Thermolog.objects.get_or_create(sensor=self, time=when, defaults=log_defaults)
-        record.temp = temperature
-        record.save()
-
-        # Delete old entries.
-        keep_time = now - datetime.timedelta(minutes=kb_common.THERMO_SENSOR_HISTORY_MINUTES)
-        old_entries = Thermolog.objects.filter(time__lt=keep_time)
-        old_entries.delete()
+        (record,) = Thermolog.objects.bulk_create(
+            [Thermolog(sensor=self, time=when, temp=temperature)],
+            update_conflicts=True,
+            unique_fields=["sensor", "time"],
+            update_fields=["temp"],
+        )
+        if record.pk is None:
+            # MySQL can't return the id of an upserted row.
+            record = Thermolog.objects.get(sensor=self, time=when)
 
         signals.temperature_recorded.send_robust(sender=self.__class__, record=record)
         return record
 
+    def prune_readings(self, now=None):
+        """Deletes records older than `kb_common.THERMO_SENSOR_HISTORY_MINUTES`.
+
+        Returns:
+            The number of records deleted.
+        """
+        now = now or timezone.now()
+        keep_time = now - datetime.timedelta(minutes=kb_common.THERMO_SENSOR_HISTORY_MINUTES)
+        deleted, _ = Thermolog.objects.filter(sensor=self, time__lt=keep_time).delete()
+        return deleted
+
 
 class Thermolog(models.Model):
     """A log from an ITemperatureSensor device of periodic measurements."""
@@ -1947,6 +2253,11 @@ class Thermolog(models.Model):
     class Meta:
         get_latest_by = "time"
         ordering = ("-time",)
+        constraints = [
+            # One record per sensor per minute; also serves per-sensor,
+            # time-ordered reads and pruning.
+            models.UniqueConstraint(fields=["sensor", "time"], name="core_thermolog_sensor_time"),
+        ]
 
     sensor = models.ForeignKey(ThermoSensor, on_delete=models.CASCADE)
     temp = models.FloatField()
@@ -1970,15 +2281,23 @@ class Stats(models.Model):
     is determined by the columns (user, keg, session), any combination of which
     may be null.
 
-    Stats are temporal on a per-drink basis: for every drink that is recorded,
-    a new row is generated for each view (2^3 rows total).
+    Each view has a single current row, holding the cumulative stats as of
+    `drink` (the view's most recent drink); it is updated in place as drinks
+    are recorded.  Periodic checkpoint rows are kept behind it to seed
+    rebuilds.  `drink` is cleared, rather than the row deleted, when its
+    drink is deleted; such rows are stale until stats are rebuilt.
 
-    See stats.generate(..) for generation details.
+    See the stats module for generation details.
     """
 
     time = models.DateTimeField(default=timezone.now)
     stats = models.JSONField(encoder=kbjson.JSONEncoder)
-    drink = models.ForeignKey(Drink, on_delete=models.CASCADE)
+    summary = models.JSONField(
+        default=dict,
+        encoder=kbjson.JSONEncoder,
+        help_text="Compact summary of `stats`, served by list endpoints.",
+    )
+    drink = models.ForeignKey(Drink, null=True, on_delete=models.SET_NULL)
 
     is_first = models.BooleanField(
         default=False, help_text="True if this is the most first record for the view."
@@ -1994,30 +2313,29 @@ class Stats(models.Model):
     class Meta:
         get_latest_by = "id"
         unique_together = ("drink", "user", "keg", "session")
+        indexes = [
+            # Finds a view's latest row before a given drink.
+            models.Index(fields=["user", "session", "keg", "drink"], name="core_stats_view_drink"),
+        ]
 
     @classmethod
     def apply_usernames(cls, stats):
-        """Given a stats dictionary, translate numeric user ids to usernames."""
+        """Given a stats (or summary) dictionary, translate numeric user ids to usernames."""
+        drinkers = stats.get("registered_drinkers", [])
+        volumes = stats.get("volume_by_drinker", Dict())
+        top = stats.get("top_drinkers", Dict())
+        if not drinkers and not volumes and not top:
+            return
+        usernames = User.get_usernames([*drinkers, *volumes, *top])
 
-        def safe_get_user(pk):
-            try:
-                return User.objects.get(pk=pk)
-            except User.DoesNotExist, ValueError:
-                return None
-
-        orig = stats.get("registered_drinkers", [])
-        if orig:
-            stats["registered_drinkers"] = [
-                safe_get_user(pk).username for pk in orig if safe_get_user(pk)
-            ]
-
-        orig = stats.get("volume_by_drinker", Dict())
-        if orig:
-            stats["volume_by_drinker"] = Dict(
-                (safe_get_user(pk).username, val)
-                for pk, val in list(orig.items())
-                if safe_get_user(pk)
-            )
+        if drinkers:
+            stats["registered_drinkers"] = [usernames[pk] for pk in drinkers if pk in usernames]
+
+        for key, orig in (("volume_by_drinker", volumes), ("top_drinkers", top)):
+            if orig:
+                stats[key] = Dict(
+                    (usernames[pk], val) for pk, val in list(orig.items()) if pk in usernames
+                )
 
     @classmethod
     def get_latest_for_view(cls, user=None, keg=None, session=None):
@@ -2029,8 +2347,40 @@ class Stats(models.Model):
             stats = cls.objects.filter(user=user, keg=keg, session=session).order_by("-id")[0].stats
         except IndexError:
             stats = {}
+        return cls.prepare_stats(stats)
+
+    @classmethod
+    def latest_stats_subquery(cls, **view):
+        """Returns a subquery of the latest stats for a view, for annotations.
+
+        Each of `view` (user, keg, session) not given is null; for example,
+        `Keg.objects.annotate(s=Stats.latest_stats_subquery(keg=OuterRef("pk")))`.
+        """
+        return cls._latest_subquery("stats", view)
+
+    @classmethod
+    def latest_summary_subquery(cls, **view):
+        """Like `latest_stats_subquery()`, but for the latest summary."""
+        return cls._latest_subquery("summary", view)
+
+    @classmethod
+    def _latest_subquery(cls, field, view):
+        view = {"user": None, "keg": None, "session": None, **view}
+        rows = cls.objects.filter(**view).order_by("-id").values(field)[:1]
+        return models.Subquery(rows, output_field=models.JSONField())
+
+    @classmethod
+    def get_summary_for_view(cls, user=None, keg=None, session=None):
+        """Like `get_latest_for_view()`, but returns the row's summary."""
+        summary = cls.objects.filter(user=user, keg=keg, session=session).order_by("-id")
+        return cls.prepare_stats(summary.values_list("summary", flat=True).first())
+
+    @classmethod
+    def prepare_stats(cls, stats):
+        """Returns stats (or a summary), as loaded from the database, ready to serve."""
+        stats = Dict(stats or {})
         cls.apply_usernames(stats)
-        return Dict(stats)
+        return stats
 
 
 class SystemEvent(models.Model):
@@ -2184,6 +2534,99 @@ class SystemEvent(models.Model):
 
         return events
 
+    @classmethod
+    def build_events_for_drinks(cls, drinks):
+        """Like `build_events_for_drink()`, for a batch of new drinks.
+
+        The drinks must be in pour order, and their kegs must already
+        include the whole batch's volume.
+        """
+        events = []
+        kegs = {drink.keg_id: drink.keg for drink in drinks}
+        for keg in kegs.values():
+            events += cls.build_events_for_keg(keg)
+
+        session_ids = {drink.session_id for drink in drinks}
+        existing = cls.objects.filter(session_id__in=session_ids)
+        started = set(
+            existing.filter(kind=cls.SESSION_STARTED).values_list("session_id", flat=True)
+        )
+        joined = set(existing.filter(kind=cls.SESSION_JOINED).values_list("session_id", "user_id"))
+
+        # Each keg's remaining volume right after each drink, counting back
+        # from its volume after the batch.
+        remaining = {keg_id: keg.remaining_volume_ml() for keg_id, keg in kegs.items()}
+        volume_after = {}
+        for drink in reversed(drinks):
+            volume_after[drink.id] = remaining[drink.keg_id]
+            remaining[drink.keg_id] += drink.volume_ml
+
+        for drink in drinks:
+            keg, session, user = drink.keg, drink.session, drink.user
+            if session.id not in started:
+                started.add(session.id)
+                events.append(
+                    cls.objects.create(
+                        kind=cls.SESSION_STARTED,
+                        time=session.start_time,
+                        drink=drink,
+                        user=user,
+                        session=session,
+                    )
+                )
+            if (session.id, user.id) not in joined:
+                joined.add((session.id, user.id))
+                events.append(
+                    cls.objects.create(
+                        kind=cls.SESSION_JOINED,
+                        time=drink.time,
+                        session=session,
+                        drink=drink,
+                        user=user,
+                    )
+                )
+            events.append(
+                cls.objects.create(
+                    kind=cls.DRINK_POURED,
+                    time=drink.time,
+                    drink=drink,
+                    user=user,
+                    keg=keg,
+                    session=session,
+                )
+            )
+
+            volume_now = volume_after[drink.id]
+            volume_before = volume_now + drink.volume_ml
+            threshold = keg.full_volume_ml * kb_common.KEG_VOLUME_LOW_PERCENT
+            if volume_now <= threshold and volume_before > threshold:
+                events.append(
+                    cls.objects.create(
+                        kind=cls.KEG_VOLUME_LOW,
+                        time=drink.time,
+                        drink=drink,
+                        user=user,
+                        keg=keg,
+                        session=session,
+                    )
+                )
+
+        return events
+
+
+def _canonical_time_series(tick_time_series):
+    """Validates a tick time series by parsing it, and regenerates it.
+
+    A malformed series is junked; it's non-essential information.
+    """
+    if not tick_time_series:
+        return ""
+    try:
+        return time_series.to_string(time_series.from_string(tick_time_series))
+    except ValueError as e:
+        logger.warning(f"Time series invalid, ignoring. Error was: {e}")
+        return ""
+
 
 def _pics_file_name(instance, filename, now=None, uuid_str=None):
     if not now:
@@ -1,11 +1,20 @@
 """Unittests for pykeg.core.models"""
 
+import concurrent.futures
 import datetime
 import os
+from unittest import mock
 
+from django.core.cache import cache
 from django.core.files import File
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Sum
 from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django_redis import get_redis_connection
 
+from pykeg.api import cache as api_cache
 from pykeg.core.testutils import get_filename
 from pykeg.util import units
 
@@ -173,6 +182,102 @@ class CoreModelsTestCase(TransactionTestCase):
 
         self.assertEqual("kb_tester2 and kb_tester", s2.summarize_drinkers())
 
+    def test_record_drinks(self):
+        models.User.objects.get_or_create(username="guest")
+        base_time = make_datetime(2009, 1, 1, 1, 0, 0)
+        minute = datetime.timedelta(minutes=1)
+        models.Drink.record_drink(
+            self.tap, ticks=0, volume_ml=100, pour_time=base_time, pour_id="p0"
+        )
+
+        def pour(pour_id, minutes, volume_ml, username=None):
+            return {
+                "tap": self.tap,
+                "ticks": 0,
+                "volume_ml": volume_ml,
+                "username": username,
+                "pour_time": base_time + minutes * minute,
+                "pour_id": pour_id,
+            }
+
+        # Delivered out of order, with a replay and an already-recorded pour.
+        pours = [
+            pour("p2", 2, 1000, self.user2.username),
+            pour("p1", 1, 500, self.user.username),
+            pour("p0", 0, 100),
+            pour("p3", 3, 200, "nobody"),
+            pour("p1", 1, 500, self.user.username),
+        ]
+        drinks = models.Drink.record_drinks(pours)
+
+        self.assertEqual(["p1", "p2", "p3"], [d.pour_id for d in drinks])
+        self.assertEqual(["kb_tester", "kb_tester2", "guest"], [d.user.username for d in drinks])
+        self.assertEqual(1, models.DrinkingSession.objects.count())
+        session = models.DrinkingSession.objects.get()
+        self.assertEqual(1800, session.volume_ml)
+        self.assertEqual(base_time, session.start_time)
+
+        keg = models.Keg.objects.get(pk=self.keg.pk)
+        self.assertEqual(1800, keg.served_volume_ml)
+
+        kinds = list(
+            models.SystemEvent.objects.filter(drink__in=drinks).values_list("kind", flat=True)
+        )
+        self.assertEqual(3, kinds.count("drink_poured"))
+        self.assertEqual(2, kinds.count("session_joined"))
+        self.assertEqual(0, kinds.count("session_started"))
+        # 2000 mL keg: 1600 mL served leaves 400, above 15%; 1800 leaves 200.
+        low = models.SystemEvent.objects.get(kind="keg_volume_low")
+        self.assertEqual("p3", low.drink.pour_id)
+
+        self.assertEqual([], models.Drink.record_drinks(pours))
+
+    def test_session_rebuild(self):
+        base_time = make_datetime(2009, 1, 1, 1, 0, 0)
+        minute = datetime.timedelta(minutes=1)
+        keg2 = models.Keg.objects.create(
+            type=self.beverage, keg_type="other", full_volume_ml=20000, description="Second"
+        )
+        tap2 = models.KegTap.objects.create(name="Tap 2", current_keg=keg2)
+        for i in range(10):
+            models.Drink.record_drink(
+                self.tap if i % 2 else tap2,
+                ticks=0,
+                volume_ml=100,
+                username=self.user.username,
+                pour_time=base_time + i * minute,
+            )
+        # A later session, only from the second keg.
+        late = models.Drink.record_drink(
+            tap2,
+            ticks=0,
+            volume_ml=300,
+            username=self.user2.username,
+            pour_time=base_time + 1000 * minute,
+        )
+        first, second = models.DrinkingSession.objects.order_by("start_time")
+        self.assertEqual(1000, first.volume_ml)
+
+        drink = first.drinks.order_by("time").first()
+        drink.set_volume(600)
+        first.refresh_from_db()
+        self.assertEqual(1500, first.volume_ml)
+
+        # However many drinks, a rebuild is one aggregate and one update.
+        with CaptureQueriesContext(connection) as queries:
+            first.Rebuild()
+        statements = [q["sql"] for q in queries if q["sql"].split()[0] not in ("BEGIN", "COMMIT")]
+        self.assertEqual(2, len(statements), statements)
+
+        keg2.cancel()
+        first.refresh_from_db()
+        self.assertEqual(500, first.volume_ml)
+        self.assertEqual(base_time + minute, first.start_time)
+        session_delta = datetime.timedelta(minutes=kb_common.DRINK_SESSION_TIME_MINUTES)
+        self.assertEqual(base_time + 9 * minute + session_delta, first.end_time)
+        self.assertFalse(models.DrinkingSession.objects.filter(id=second.id).exists())
+        self.assertFalse(models.Drink.objects.filter(id=late.id).exists())
+
     def test_pic_filename(self):
         basename = "1/2/3-4567 89.jpg"
         now = datetime.datetime(2011, 0o2, 0o3)
@@ -216,3 +321,221 @@ class CoreModelsTestCase(TransactionTestCase):
         picture_obj.erase_and_delete()
         for path in paths:
             self.assertFalse(os.path.exists(path))
+
+
+class UsernameResolutionTestCase(TransactionTestCase):
+    def setUp(self):
+        self.users = [
+            models.User.objects.create(username=f"user{i}", email=f"user{i}@example.com")
+            for i in range(3)
+        ]
+        models.User.get_usernames([u.id for u in self.users] + [999])
+
+    def test_cached_lookup(self):
+        pks = [str(u.id) for u in self.users] + ["999", "bogus"]
+        with CaptureQueriesContext(connection) as queries:
+            usernames = models.User.get_usernames(pks)
+        self.assertEqual(0, len(queries))
+        self.assertEqual({str(u.id): u.username for u in self.users}, usernames)
+
+    def test_rename_invalidates(self):
+        call_command("rename_user", "user1", "renamed")
+        with CaptureQueriesContext(connection) as queries:
+            usernames = models.User.get_usernames([self.users[1].id])
+        self.assertEqual(1, len(queries))
+        self.assertEqual({self.users[1].id: "renamed"}, usernames)
+
+    def test_rename_invalidates_on_commit(self):
+        user = self.users[1]
+        with transaction.atomic():
+            user.username = "renamed"
+            user.save()
+            # Another process reads the old row before the commit.
+            cache.set(models.USERNAME_CACHE_KEY.format(pk=user.id), "user1")
+        self.assertEqual({user.id: "renamed"}, models.User.get_usernames([user.id]))
+
+    def test_apply_usernames(self):
+        user_ids = [str(u.id) for u in self.users]
+        stats = {
+            "registered_drinkers": user_ids + ["999"],
+            "volume_by_drinker": {user_ids[0]: 10.0, user_ids[2]: 20.0},
+        }
+        with CaptureQueriesContext(connection) as queries:
+            models.Stats.apply_usernames(stats)
+        self.assertEqual(0, len(queries))
+        self.assertEqual(["user0", "user1", "user2"], stats["registered_drinkers"])
+        self.assertEqual({"user0": 10.0, "user2": 20.0}, stats["volume_by_drinker"])
+
+
+@mock.patch("pykeg.core.tasks.schedule_thermolog_pruning")
+class ThermoSensorTestCase(TransactionTestCase):
+    def setUp(self):
+        self.sensor = models.ThermoSensor.objects.create(raw_name="kb.thermo0", nice_name="t0")
+        self.other = models.ThermoSensor.objects.create(raw_name="kb.thermo1", nice_name="t1")
+
+    def test_reading_is_one_upsert(self, schedule_pruning):
+        when = make_datetime(2026, 10, 1, 12, 0, 15)
+        with CaptureQueriesContext(connection) as queries:
+            first = self.sensor.log_sensor_reading(4.0, when=when)
+        # bulk_create brackets it in a transaction of its own, when outside one.
+        statements = [q["sql"] for q in queries if q["sql"].split()[0] not in ("BEGIN", "COMMIT")]
+        self.assertEqual(1, len(statements))
+        self.assertIsNotNone(first.id)
+
+        # Last one wins, within the minute.
+        second = self.sensor.log_sensor_reading(5.5, when=when + datetime.timedelta(seconds=30))
+        self.assertEqual(first.id, second.id)
+        self.assertEqual(1, self.sensor.thermolog_set.count())
+        self.assertEqual(5.5, self.sensor.LastLog().temp)
+
+        with self.assertRaises(ValueError):
+            self.sensor.log_sensor_reading(kb_common.THERMO_SENSOR_RANGE[1] + 1, when=when)
+
+    def test_prune_readings(self, schedule_pruning):
+        now = make_datetime(2026, 10, 2, 12, 0)
+        history = datetime.timedelta(minutes=kb_common.THERMO_SENSOR_HISTORY_MINUTES)
+        old = now - history - datetime.timedelta(minutes=1)
+        for sensor in (self.sensor, self.other):
+            sensor.log_sensor_reading(3.0, when=old)
+            sensor.log_sensor_reading(3.0, when=now)
+        self.assertEqual(4, schedule_pruning.call_count)
+
+        self.assertEqual(1, self.sensor.prune_readings(now=now))
+        self.assertEqual([now], [r.time for r in self.sensor.thermolog_set.all()])
+        # Other sensors' readings are left to their own pruning.
+        self.assertEqual(2, self.other.thermolog_set.count())
+
+
+class SiteCacheTestCase(TransactionTestCase):
+    def setUp(self):
+        models.KegbotSite.get()
+
+    def test_cached_and_copied(self):
+        site = models.KegbotSite.get()
+        site.title = "Scribbled"
+        with CaptureQueriesContext(connection) as queries:
+            again = models.KegbotSite.get()
+        self.assertEqual(0, len(queries))
+        self.assertNotEqual("Scribbled", again.title)
+
+    def test_save_elsewhere_is_seen(self):
+        # Another process saves the row: it changes under us, with a new stamp.
+        models.KegbotSite.objects.filter(name="default").update(title="Elsewhere")
+        cache.set(models.SITE_VERSION_KEY, "another-version", None)
+        self.assertNotEqual("Elsewhere", models.KegbotSite.get().title)
+
+        # Within a request, the stamp is checked once, on first use.
+        models._start_site_memo(sender=None)
+        try:
+            self.assertEqual("Elsewhere", models.KegbotSite.get().title)
+            cache.set(models.SITE_VERSION_KEY, "yet-another-version", None)
+            with CaptureQueriesContext(connection) as queries:
+                models.KegbotSite.get()
+            self.assertEqual(0, len(queries))
+        finally:
+            models._end_site_memo(sender=None)
+
+    def test_save_is_seen(self):
+        site = models.KegbotSite.get()
+        site.title = "Saved"
+        site.save()
+        self.assertEqual("Saved", models.KegbotSite.get().title)
+
+    def test_save_keeps_other_state(self):
+        # Redis also holds queues and device state, which a save must not drop.
+        client = get_redis_connection("default")
+        client.rpush("kegboard:inbox:board", "batch")
+        cache.set("kegboard:cursor:board", {"last_id": 1}, None)
+        generation = api_cache.RESPONSE_CACHE.get_generation()
+
+        models.KegbotSite.get().save()
+        self.assertEqual(1, client.llen("kegboard:inbox:board"))
+        self.assertEqual({"last_id": 1}, cache.get("kegboard:cursor:board"))
+        self.assertNotEqual(generation, api_cache.RESPONSE_CACHE.get_generation())
+
+    def test_missing_site(self):
+        models.KegbotSite.objects.all().delete()
+        self.assertIsNone(models.KegbotSite.get(create=False))
+        self.assertEqual("default", models.KegbotSite.get().name)
+
+
+@mock.patch("pykeg.core.tasks.schedule_tasks")
+@mock.patch("pykeg.core.tasks.schedule_stats")
+class ConcurrentPoursTestCase(TransactionTestCase):
+    POURS = 200
+    THREADS = 8
+
+    def setUp(self):
+        # SQLite has no row locks; writers queue on the database lock, which
+        # only IMMEDIATE transactions wait for.
+        if connection.vendor == "sqlite" and connection.transaction_mode != "IMMEDIATE":
+            self.skipTest("concurrent writes need sqlite's IMMEDIATE transaction mode")
+        models.KegbotSite.get()
+        models.User.objects.create(username="guest")
+        self.drinker = models.User.objects.create(username="drinker", email="d@example.com")
+        beverage = models.Beverage.objects.create(
+            name="Stress Lager", producer=models.BeverageProducer.objects.create(name="Brewery")
+        )
+        self.tap_ids = []
+        for i in range(2):
+            keg = models.Keg.objects.create(
+                type=beverage, keg_type="other", full_volume_ml=100000, status="on_tap"
+            )
+            tap = models.KegTap.objects.create(name=f"Tap {i}", current_keg=keg)
+            self.tap_ids.append(tap.id)
+
+    def run_in_threads(self, fn, args):
+        def run(arg):
+            try:
+                return fn(arg)
+            finally:
+                connection.close()
+
+        with concurrent.futures.ThreadPoolExecutor(self.THREADS) as executor:
+            return list(executor.map(run, args))
+
+    def assertTotalsReconcile(self):
+        for keg in models.Keg.objects.all():
+            poured = keg.drinks.aggregate(total=Sum("volume_ml"))["total"] or 0
+            self.assertAlmostEqual(poured, keg.served_volume_ml)
+        for session in models.DrinkingSession.objects.all():
+            poured = session.drinks.aggregate(total=Sum("volume_ml"))["total"]
+            self.assertAlmostEqual(poured, session.volume_ml)
+
+    def test_parallel_pours(self, schedule_stats, schedule_tasks):
+        def pour(i):
+            # Each pour loads its own tap and keg, as a request would.
+            tap = models.KegTap.objects.get(id=self.tap_ids[i % 2])
+            if i % 3:
+                return models.Drink.record_drink(tap, ticks=i, volume_ml=i + 1).id
+            pours = [{"tap": tap, "ticks": i, "volume_ml": i + 1, "pour_id": f"pour-{i}"}]
+            return models.Drink.record_drinks(pours)[0].id
+
+        drink_ids = self.run_in_threads(pour, range(self.POURS))
+        self.assertEqual(self.POURS, len(set(drink_ids)))
+        total = sum(i + 1 for i in range(self.POURS))
+        served = models.Keg.objects.aggregate(total=Sum("served_volume_ml"))["total"]
+        self.assertAlmostEqual(total, served)
+        # One session, however the pours raced to start it.
+        self.assertEqual(1, models.DrinkingSession.objects.count())
+        self.assertAlmostEqual(total, models.DrinkingSession.objects.get().volume_ml)
+        self.assertTotalsReconcile()
+
+        def adjust(drink_id):
+            if drink_id is None:
+                # More pours, into the sessions being rebuilt.
+                return pour(1)
+            drink = models.Drink.objects.get(id=drink_id)
+            if drink_id % 4 == 1:
+                drink.reassign(self.drinker)
+            elif drink_id % 4:
+                drink.set_volume(drink.volume_ml + 10)
+            else:
+                drink.cancel_drink(spilled=drink_id % 8 == 0)
+
+        self.run_in_threads(adjust, [x for drink_id in drink_ids for x in (drink_id, None)])
+        self.assertTotalsReconcile()
+        reassigned = [drink_id for drink_id in drink_ids if drink_id % 4 == 1]
+        self.assertEqual(len(reassigned), self.drinker.drinks.count())
+        spilled = sum(i + 1 for i, drink_id in enumerate(drink_ids) if drink_id % 8 == 0)
+        self.assertAlmostEqual(spilled, models.Keg.objects.aggregate(s=Sum("spilled_ml"))["s"])
@@ -1,22 +1,50 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
-from . import signals, tasks
+from pykeg.api import cache as api_cache
+from pykeg.api import conditional
+from pykeg.kegboard import state as kegboard_state
+from pykeg.kegboard import topology
+
+from . import models, signals, stats, tasks
 
 
 @receiver(signals.drink_recorded)
 def on_drink_recorded(sender, **kwargs):
     """Build stats when a drink is created."""
     drink = kwargs["drink"]
-    tasks.build_stats.delay(drink_id=drink.id, rebuild_following=False)
+    views = stats.views_for([drink.user_id], drink.session_id, drink.keg_id)
+    tasks.schedule_stats(drink.id, views)
+
+
+@receiver(signals.drinks_recorded)
+def on_drinks_recorded(sender, **kwargs):
+    """Build stats once for a batch of new drinks."""
+    drinks = kwargs["drinks"]
+    views = set()
+    for drink in drinks:
+        views |= stats.views_for([drink.user_id], drink.session_id, drink.keg_id)
+    tasks.schedule_stats(min(drink.id for drink in drinks), views)
 
 
 @receiver(signals.drink_assigned)
 @receiver(signals.drink_adjusted)
 @receiver(signals.drink_canceled)
 def on_drink_changed(sender, **kwargs):
-    """Rebuild stats when a drink is changed or (re-)assigned."""
+    """Rebuild stats when a drink is changed or (re-)assigned.
+
+    Only the views the drink counts towards, before and after the change,
+    are rebuilt.
+    """
     drink_id = kwargs["drink_id"]
-    tasks.build_stats.delay(drink_id=drink_id, rebuild_following=True)
+    drink = kwargs["drink"]
+    user_ids = [drink.user_id]
+    previous_user = kwargs.get("previous_user")
+    if previous_user:
+        user_ids.append(previous_user.id)
+    views = stats.views_for(user_ids, drink.session_id, drink.keg_id)
+    tasks.schedule_stats(drink_id, views)
 
 
 @receiver(signals.keg_deleted)
@@ -24,7 +52,7 @@ def on_keg_deleted(sender, **kwargs):
     """Rebuild stats when a keg is deleted."""
     first_deleted_drink_id = kwargs["first_deleted_drink_id"]
     if first_deleted_drink_id:
-        tasks.build_stats.delay(drink_id=first_deleted_drink_id, rebuild_following=True)
+        tasks.schedule_stats(first_deleted_drink_id)
 
 
 @receiver(signals.events_created)
@@ -32,3 +60,86 @@ def on_events_created(sender, **kwargs):
     """Send events to plugins."""
     events = kwargs["events"]
     tasks.schedule_tasks(events)
+
+
+@receiver(signals.drink_recorded)
+@receiver(signals.drinks_recorded)
+@receiver(signals.drink_assigned)
+@receiver(signals.drink_adjusted)
+@receiver(signals.drink_canceled)
+@receiver(signals.keg_created)
+@receiver(signals.keg_attached)
+@receiver(signals.keg_ended)
+@receiver(signals.keg_deleted)
+@receiver(signals.tap_created)
+@receiver(post_save, sender=models.Keg)
+@receiver(post_delete, sender=models.Keg)
+@receiver(post_save, sender=models.KegTap)
+@receiver(post_delete, sender=models.KegTap)
+@receiver(post_save, sender=models.Beverage)
+@receiver(post_delete, sender=models.Beverage)
+@receiver(post_save, sender=models.BeverageProducer)
+@receiver(post_delete, sender=models.BeverageProducer)
+@receiver(post_save, sender=models.Picture)
+@receiver(post_delete, sender=models.Picture)
+@receiver(post_save, sender=models.User)
+@receiver(post_delete, sender=models.User)
+@receiver(post_save, sender=models.KegbotSite)
+@receiver(post_delete, sender=models.KegbotSite)
+def on_dashboard_changed(sender, **kwargs):
+    """Drop cached API responses when pours, kegs, taps, the catalog or the site change."""
+    api_cache.invalidate()
+
+
+@receiver(post_save, sender=models.Beverage)
+@receiver(post_delete, sender=models.Beverage)
+@receiver(post_save, sender=models.BeverageProducer)
+@receiver(post_delete, sender=models.BeverageProducer)
+@receiver(post_save, sender=models.Drink)
+@receiver(post_delete, sender=models.Drink)
+@receiver(post_save, sender=models.DrinkingSession)
+@receiver(post_delete, sender=models.DrinkingSession)
+@receiver(post_save, sender=models.Keg)
+@receiver(post_delete, sender=models.Keg)
+@receiver(post_save, sender=models.KegbotSite)
+@receiver(post_delete, sender=models.KegbotSite)
+@receiver(post_save, sender=models.KegTap)
+@receiver(post_delete, sender=models.KegTap)
+@receiver(post_save, sender=models.Picture)
+@receiver(post_delete, sender=models.Picture)
+@receiver(post_save, sender=models.SystemEvent)
+@receiver(post_delete, sender=models.SystemEvent)
+@receiver(post_save, sender=models.User)
+@receiver(post_delete, sender=models.User)
+def on_api_data_changed(sender, **kwargs):
+    """Count the change towards the ETags of the API views showing it."""
+    conditional.record_change(conditional.MODEL_KINDS[sender])
+
+
+@receiver(signals.temperature_recorded)
+def on_temperature_recorded(sender, **kwargs):
+    """Prune the sensor's old readings now and then."""
+    record = kwargs["record"]
+    tasks.schedule_thermolog_pruning(record.sensor_id)
+
+
+@receiver(post_save, sender=models.FlowMeter)
+@receiver(post_delete, sender=models.FlowMeter)
+@receiver(post_save, sender=models.FlowToggle)
+@receiver(post_delete, sender=models.FlowToggle)
+@receiver(post_delete, sender=models.KegTap)
+def on_topology_changed(sender, **kwargs):
+    """Drop cached kegboard topology when meters, toggles or taps change.
+
+    Invalidated again on commit, so a snapshot rebuilt by another process
+    mid-transaction doesn't outlive the change.
+    """
+    topology.invalidate()
+    transaction.on_commit(topology.invalidate)
+
+
+@receiver(post_save, sender=models.Controller)
+@receiver(post_delete, sender=models.Controller)
+def on_controller_changed(sender, instance, **kwargs):
+    """Drop the controller cached for its kegboard token, if any."""
+    kegboard_state.forget_token(instance.auth_token)
@@ -10,6 +10,8 @@ auth_token_created = Signal()
 
 drink_recorded = Signal()
 
+drinks_recorded = Signal()
+
 drink_canceled = Signal()
 
 drink_assigned = Signal()
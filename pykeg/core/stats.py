@@ -1,17 +1,31 @@
 """Methods to generate cached statistics from drinks."""
 
 import copy
-import inspect
 import logging
 import zoneinfo
 
-from addict import Dict
+from django.conf import settings
+from django.db.models import Q
 from django.utils.timezone import localtime
 
 from pykeg.core import models
 
 STAT_MAP = {}
 
+# Each view keeps one "current" stats row, moved forward in place as drinks
+# are added.  Every this many pours the current row is instead left behind
+# as a checkpoint (and a new current row started), so that rebuilding after
+# a drink changes can resume from a nearby checkpoint rather than from the
+# view's first drink.  1 keeps a full snapshot for every drink; 0 keeps no
+# checkpoints at all.
+CHECKPOINT_INTERVAL = getattr(settings, "KEGBOT_STATS_CHECKPOINT_INTERVAL", 100)
+
+# Number of drinkers listed in a stats summary; see `StatsAccumulator.summary()`.
+SUMMARY_TOP_DRINKERS = 10
+
+# Number of drinks read, and of stats rows written, per query when rebuilding.
+REBUILD_BATCH_SIZE = getattr(settings, "KEGBOT_STATS_REBUILD_BATCH_SIZE", 1000)
+
 logger = logging.getLogger(__name__)
 
 
@@ -40,13 +54,23 @@ class StatsView:
             self.keg.id if self.keg else None,
         )
 
-    def get_prior_drinks(self, drink):
-        """Returns the queryset of prior drinks occurring in this view.
+    @classmethod
+    def from_tuple(cls, view_tuple):
+        """Inverse of `as_tuple()`; raises `DoesNotExist` for deleted objects."""
+        user_id, session_id, keg_id = view_tuple
+        return cls(
+            user=models.User.objects.get(pk=user_id) if user_id else None,
+            session=models.DrinkingSession.objects.get(pk=session_id) if session_id else None,
+            keg=models.Keg.objects.get(pk=keg_id) if keg_id else None,
+        )
+
+    def get_prior_drinks(self, drink_id):
+        """Returns the queryset of drinks before `drink_id` occurring in this view.
 
         The result can be empty, which implies the drink is the first drink
         for the given {user, session, keg}.
         """
-        qs = models.Drink.objects.filter(id__lt=drink.id)
+        qs = models.Drink.objects.filter(id__lt=drink_id)
         if self.user:
             qs = qs.filter(user=self.user.id)
         if self.session:
@@ -56,131 +80,175 @@ class StatsView:
         return qs.order_by("-id")
 
 
-class StatsBuilder:
-    """Derives statistics from drinks."""
-
-    def __init__(self):
-        self.functions = []
-        for name, fn in inspect.getmembers(self, inspect.ismethod):
-            if not name.startswith("_") and name != "build" and name != "next":
-                self.functions.append((name, fn))
-
-    def build(self, drink, previous_stats):
-        if previous_stats is None:
-            previous_stats = Dict()
-
-        logger.debug(f"build: drink={drink.id}")
-        stats = Dict()
-
-        for statname, fn in self.functions:
-            previous_value = previous_stats.get(statname, None)
-            if previous_value is not None:
-                val = fn(drink, previous_stats, previous_value=previous_value)
-            else:
-                val = fn(drink, previous_stats)
-
-            if val is None:
-                raise ValueError(f"Stat generator for {statname} returned None")
-            stats[statname] = val
-        return stats
-
-    def last_drink_id(self, drink, previous_stats, previous_value=0):
-        return drink.id
-
-    def keg_ids(self, drink, previous_stats, previous_value=[]):
-        ret = copy.copy(previous_value)
-        if drink.keg.id not in ret:
-            ret.append(drink.keg.id)
-        return ret
-
-    def total_volume_ml(self, drink, previous_stats, previous_value=0):
-        return previous_value + drink.volume_ml
+class StatsAccumulator:
+    """Incrementally derives the statistics of a single view from drinks.
 
-    def total_pours(self, drink, previous_stats, previous_value=0):
-        return previous_value + 1
+    Every `add()` does a constant amount of work regardless of how much
+    history the view already has: counters are bumped, per-key volume maps
+    are updated in place, and list membership is tracked with side sets
+    instead of scanning the lists.
 
-    def average_volume_ml(self, drink, previous_stats, previous_value=0):
-        vol = previous_stats.get("total_volume_ml", 0)
-        count = previous_stats.get("total_pours", 0)
-        vol += drink.volume_ml
-        count += 1
-        return vol / float(count)
+    `as_dict()` produces the same blob (keys, key order and value types)
+    as has always been stored in `Stats.stats`.
+    """
 
-    def greatest_volume_ml(self, drink, previous_stats, previous_value=0):
-        return float(max(drink.volume_ml, previous_value))
+    def __init__(self, stats=None):
+        """Constructor.
 
-    def greatest_volume_id(self, drink, previous_stats, previous_value=0):
-        if drink.volume_ml > previous_stats.get("greatest_volume_ml", 0):
-            return drink.id
-        return previous_value
+        Args:
+            stats: A previously-generated stats dictionary to continue from,
+                or None to start from an empty view.  The dictionary is
+                copied, never modified.
+        """
+        if stats is None:
+            stats = {}
+        self.last_drink_id = stats.get("last_drink_id", 0)
+        self.total_volume_ml = stats.get("total_volume_ml", 0)
+        self.total_pours = stats.get("total_pours", 0)
+        self.average_volume_ml = stats.get("average_volume_ml", 0)
+        self.greatest_volume_ml = stats.get("greatest_volume_ml", 0)
+        self.greatest_volume_id = stats.get("greatest_volume_id", 0)
+        self.has_guest_pour = stats.get("has_guest_pour", False)
+        self.largest_session = dict(stats.get("largest_session", {}))
+
+        self.keg_ids = list(stats.get("keg_ids", []))
+        self.registered_drinkers = list(stats.get("registered_drinkers", []))
+        self._keg_id_set = set(self.keg_ids)
+        self._registered_drinker_set = set(self.registered_drinkers)
+
+        self.volume_by_day_of_week = dict(stats.get("volume_by_day_of_week", {}))
+        self.volume_by_year = dict(stats.get("volume_by_year", {}))
+        self.volume_by_drinker = dict(stats.get("volume_by_drinker", {}))
+        self.volume_by_session = dict(stats.get("volume_by_session", {}))
+
+    def is_empty(self):
+        return not self.total_pours
+
+    def add(self, drink):
+        """Accounts for `drink`, which must be newer than any prior drink."""
+        volume_ml = drink.volume_ml
+
+        self.last_drink_id = drink.id
+        if drink.keg.id not in self._keg_id_set:
+            self._keg_id_set.add(drink.keg.id)
+            self.keg_ids.append(drink.keg.id)
+
+        if volume_ml > self.greatest_volume_ml:
+            self.greatest_volume_id = drink.id
+        self.greatest_volume_ml = float(max(volume_ml, self.greatest_volume_ml))
+
+        self.total_volume_ml += volume_ml
+        self.total_pours += 1
+        self.average_volume_ml = self.total_volume_ml / float(self.total_pours)
 
-    def volume_by_day_of_week(self, drink, previous_stats, previous_value={}):
-        ret = copy.copy(previous_value)
         tz = zoneinfo.ZoneInfo(drink.session.timezone)
         local_time = localtime(drink.session.start_time, timezone=tz)
         drink_weekday = str(local_time.strftime("%w"))
-        ret[drink_weekday] = ret.get(drink_weekday, 0) + drink.volume_ml
-        return ret
+        self.volume_by_day_of_week[drink_weekday] = (
+            self.volume_by_day_of_week.get(drink_weekday, 0) + volume_ml
+        )
 
-    def registered_drinkers(self, drink, previous_stats, previous_value=[]):
-        ret = copy.copy(previous_value)
         if drink.user:
             user_id = str(drink.user.id)
-            if user_id not in ret:
-                ret.append(user_id)
-        return ret
-
-    def sessions_count(self, drink, previous_stats, previous_value=0):
-        # Use volume_by_session, ensuring our session is captured
-        # by injecting a dummy value.
-        prev_sessions = previous_stats.get("volume_by_session", {})
-        ret = len(list(prev_sessions.keys()))
-        if str(drink.session.id) not in prev_sessions:
-            ret += 1
-        return ret
+            if user_id not in self._registered_drinker_set:
+                self._registered_drinker_set.add(user_id)
+                self.registered_drinkers.append(user_id)
 
-    def volume_by_year(self, drink, previous_stats, previous_value={}):
-        ret = copy.copy(previous_value)
         year = str(drink.time.year)
-        ret[year] = ret.get(year, 0) + drink.volume_ml
-        return ret
+        self.volume_by_year[year] = self.volume_by_year.get(year, 0) + volume_ml
 
-    def has_guest_pour(self, drink, previous_stats, previous_value=False):
-        if previous_value:
-            return True
-        return drink.is_guest_pour()
+        if not self.has_guest_pour:
+            self.has_guest_pour = drink.is_guest_pour()
 
-    def volume_by_drinker(self, drink, previous_stats, previous_value={}):
-        ret = copy.copy(previous_value)
         user_id = str(drink.user.id)
-        orig = ret.get(user_id, 0)
-        ret[user_id] = float(orig + drink.volume_ml)
-        return ret
+        self.volume_by_drinker[user_id] = float(self.volume_by_drinker.get(user_id, 0) + volume_ml)
 
-    def volume_by_session(self, drink, previous_stats, previous_value={}):
-        ret = copy.copy(previous_value)
         session_id = str(drink.session.id)
-        ret[session_id] = ret.get(session_id, 0) + drink.volume_ml
-        return ret
+        self.volume_by_session[session_id] = self.volume_by_session.get(session_id, 0) + volume_ml
 
-    def largest_session(self, drink, previous_stats, previous_value={}):
-        if drink.session.volume_ml >= previous_value.get("volume_ml", 0):
-            return {
+        if drink.session.volume_ml >= self.largest_session.get("volume_ml", 0):
+            self.largest_session = {
                 "session_id": drink.session.id,
                 "volume_ml": drink.session.volume_ml,
             }
-        return previous_value
 
+    def as_dict(self):
+        """Returns the stats blob for the drinks added so far.
+
+        Nested values are shared with the accumulator, so the result must
+        be serialized (or copied) before the next `add()`.
+        """
+        if self.is_empty():
+            return {}
+        return {
+            "average_volume_ml": self.average_volume_ml,
+            "greatest_volume_id": self.greatest_volume_id,
+            "greatest_volume_ml": self.greatest_volume_ml,
+            "has_guest_pour": self.has_guest_pour,
+            "keg_ids": self.keg_ids,
+            "largest_session": self.largest_session,
+            "last_drink_id": self.last_drink_id,
+            "registered_drinkers": self.registered_drinkers,
+            "sessions_count": len(self.volume_by_session),
+            "total_pours": self.total_pours,
+            "total_volume_ml": self.total_volume_ml,
+            "volume_by_day_of_week": self.volume_by_day_of_week,
+            "volume_by_drinker": self.volume_by_drinker,
+            "volume_by_session": self.volume_by_session,
+            "volume_by_year": self.volume_by_year,
+        }
+
+    def summary(self):
+        """Returns the compact summary stored beside the stats blob.
+
+        List endpoints serve this instead of the full blob: the totals, and
+        the view's biggest drinkers (keyed by user id, like
+        `volume_by_drinker`).
+        """
+        if self.is_empty():
+            return {}
+        top = sorted(self.volume_by_drinker.items(), key=lambda item: item[1], reverse=True)
+        return {
+            "top_drinkers": dict(top[:SUMMARY_TOP_DRINKERS]),
+            "total_pours": self.total_pours,
+            "total_volume_ml": self.total_volume_ml,
+        }
 
-BUILDER = StatsBuilder()
 
 # Public methods
 
 
-def invalidate(drink_id):
-    """Clears all statistics starting from (and including) drink_id."""
+def views_for(user_ids, session_id, keg_id):
+    """Returns the views, as `StatsView.as_tuple()`, counting a drink by any
+    of `user_ids` in the given session and keg.
+    """
+    return {
+        (user_id, sid, kid)
+        for user_id in (None, *user_ids)
+        for sid in (None, session_id)
+        for kid in (None, keg_id)
+    }
+
+
+def invalidate(drink_id, views=None):
+    """Clears all statistics starting from (and including) drink_id.
+
+    Rows left behind by deleted drinks are cleared as well.  If `views` is
+    given, only rows of those views (as `StatsView.as_tuple()`) are cleared.
+
+    Returns:
+        The set of views, as `StatsView.as_tuple()`, which lost rows.
+    """
     logger.debug(f"--- Invalidating stats since id {drink_id}")
-    models.Stats.objects.filter(drink_id__gte=drink_id).delete()
+    rows = models.Stats.objects.filter(Q(drink_id__gte=drink_id) | Q(drink__isnull=True))
+    if views is not None:
+        in_views = Q(pk__in=[])
+        for user_id, session_id, keg_id in views:
+            in_views |= Q(user_id=user_id, session_id=session_id, keg_id=keg_id)
+        rows = rows.filter(in_views)
+    views = set(rows.values_list("user_id", "session_id", "keg_id").distinct())
+    rows.delete()
+    return views
 
 
 def invalidate_all():
@@ -200,68 +268,280 @@ def build_for_id(drink_id):
     _build_all_views(drink)
 
 
-def rebuild_from_id(drink_id, cb=None):
+def rebuild_from_id(drink_id, cb=None, batch_size=None):
     """Builds statistics stating from `drink_id`.  Unlike `build_for_id()`,
     this method computes statistics for any subsequent drinks found in the
     database.
+
+    Drinks are read `batch_size` at a time, the stats of every view are
+    accumulated in memory, and rows are written with bulk queries.  If given,
+    `cb` is called with each drink once it has been processed.
     """
-    invalidate(drink_id)
-    results_cache = {}
-    for drink in models.Drink.objects.filter(id__gte=drink_id).order_by("id"):
-        _build_all_views(drink, results_cache=results_cache)
-        if cb:
-            cb(results_cache)
+    _rebuild(drink_id, None, cb, batch_size)
+
 
+def rebuild_views(drink_id, views, cb=None, batch_size=None):
+    """Like `rebuild_from_id()`, but only rebuilds the given views.
 
-def _build_single_view(drink, view, prior_stats=None):
+    Use when a drink changes in a way that can only affect some views, such
+    as being reassigned to another user; rows of all other views are left
+    alone.
+
+    Args:
+        drink_id: The first drink to rebuild from.
+        views: The views to rebuild, as `StatsView.as_tuple()`; see
+            `views_for()`.
+    """
+    _rebuild(drink_id, {tuple(v) for v in views}, cb, batch_size)
+
+
+def _rebuild(drink_id, views, cb, batch_size):
+    batch_size = batch_size or REBUILD_BATCH_SIZE
+    stale_views = invalidate(drink_id, views)
+    rebuild = _BulkRebuild(
+        batch_size,
+        has_history=models.Drink.objects.filter(id__lt=drink_id).exists(),
+        only_views=views,
+    )
+    drinks = models.Drink.objects.select_related("user", "session", "keg").order_by("id")
+    last_id = drink_id - 1
+    while True:
+        batch = list(drinks.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            break
+        for drink in batch:
+            rebuild.add(drink)
+            if cb:
+                cb(drink)
+        last_id = batch[-1].id
+    rebuild.finish()
+
+    # A view's current row may have been cleared even though the view has no
+    # drinks from `drink_id` onward; bring it back up to its last drink.
+    for view_tuple in stale_views - set(rebuild.views):
+        _restore_view(view_tuple, drink_id)
+
+
+class _ViewRebuild:
+    """The in-memory state of one view during a bulk rebuild."""
+
+    def __init__(self, view, accumulator, row):
+        self.view = view
+        self.accumulator = accumulator
+        # The view's current row, to be moved forward on the next write; None
+        # if the next write starts a new row.
+        self.row = row
+        self.last_drink = None
+        self.dirty = False
+        self.starts_view = False
+
+
+class _BulkRebuild:
+    """Accumulates all views over a run of drinks, writing rows in batches.
+
+    Produces the same rows as building each drink with `_build_all_views()`:
+    checkpoint rows are written as soon as they are reached, and every
+    view's current row once all drinks have been added.
+    """
+
+    def __init__(self, batch_size, has_history=True, only_views=None):
+        self.batch_size = batch_size
+        # When no drinks precede the rebuild, no view can have prior stats
+        # and the per-view lookup is skipped.
+        self.has_history = has_history
+        self.only_views = only_views
+        self.views = {}
+        self.creates = []
+        self.updates = []
+
+    def add(self, drink):
+        for view in _views_for_drink(drink):
+            key = view.as_tuple()
+            if self.only_views is not None and key not in self.only_views:
+                continue
+            state = self.views.get(key)
+            if state is None:
+                state = self.views[key] = self._start_view(view, drink)
+            self._add_to_view(state, drink)
+        if len(self.creates) + len(self.updates) >= self.batch_size:
+            self.flush()
+
+    def finish(self):
+        for state in self.views.values():
+            if state.dirty:
+                self._write(state, snapshot=False)
+        self.flush()
+
+    def flush(self):
+        if self.creates:
+            models.Stats.objects.bulk_create(self.creates, batch_size=self.batch_size)
+            self.creates = []
+        if self.updates:
+            models.Stats.objects.bulk_update(
+                self.updates, ["drink", "time", "stats", "summary"], batch_size=self.batch_size
+            )
+            self.updates = []
+
+    def _start_view(self, view, drink):
+        if not self.has_history:
+            return _ViewRebuild(view, StatsAccumulator(), None)
+        latest_row, build_list = _find_prior_stats(view, drink.id)
+        if latest_row is None:
+            state = _ViewRebuild(view, StatsAccumulator(), None)
+        else:
+            current = None if _is_checkpoint(latest_row.stats.get("total_pours", 0)) else latest_row
+            state = _ViewRebuild(view, StatsAccumulator(latest_row.stats), current)
+        for prior_drink in build_list:
+            self._add_to_view(state, prior_drink)
+        return state
+
+    def _add_to_view(self, state, drink):
+        if not state.dirty:
+            state.starts_view = state.accumulator.is_empty()
+        state.accumulator.add(drink)
+        state.last_drink = drink
+        state.dirty = True
+        if _is_checkpoint(state.accumulator.total_pours):
+            # The accumulator keeps changing while the row waits to be
+            # written, so it must be given its own copy.
+            self._write(state, snapshot=True)
+            state.row = None
+
+    def _write(self, state, snapshot):
+        drink = state.last_drink
+        stats = state.accumulator.as_dict()
+        if snapshot:
+            stats = copy.deepcopy(stats)
+        summary = state.accumulator.summary()
+        if state.row is not None:
+            state.row.drink = drink
+            state.row.time = drink.time
+            state.row.stats = stats
+            state.row.summary = summary
+            self.updates.append(state.row)
+        else:
+            view = state.view
+            self.creates.append(
+                models.Stats(
+                    drink=drink,
+                    user=view.user,
+                    time=drink.time,
+                    session=view.session,
+                    keg=view.keg,
+                    stats=stats,
+                    summary=summary,
+                    is_first=state.starts_view,
+                )
+            )
+        state.dirty = False
+
+
+def _is_checkpoint(total_pours):
+    if not CHECKPOINT_INTERVAL:
+        return False
+    return total_pours % CHECKPOINT_INTERVAL == 0
+
+
+def _restore_view(view_tuple, drink_id):
+    """Rebuilds the current row of a view as of its last drink before `drink_id`."""
+    try:
+        view = StatsView.from_tuple(view_tuple)
+    except models.User.DoesNotExist, models.DrinkingSession.DoesNotExist, models.Keg.DoesNotExist:
+        return
+    last_drink = view.get_prior_drinks(drink_id).first()
+    if last_drink is None:
+        return
+    if not models.Stats.objects.filter(
+        drink=last_drink, user=view.user, session=view.session, keg=view.keg
+    ).exists():
+        _build_single_view(last_drink, view)
+
+
+def _save_view_stats(drink, view, accumulator, latest_row, is_first):
+    """Records the stats of `view` as of `drink`, returning the row written.
+
+    The view's latest row is moved forward in place, unless it is a
+    checkpoint; then it is kept and a new current row is started.
+    """
+    stats = accumulator.as_dict()
+    summary = accumulator.summary()
+    if latest_row is not None and not _is_checkpoint(latest_row.stats.get("total_pours", 0)):
+        latest_row.drink = drink
+        latest_row.time = drink.time
+        latest_row.stats = stats
+        latest_row.summary = summary
+        latest_row.save(update_fields=["drink", "time", "stats", "summary"])
+        return latest_row
+    return models.Stats.objects.create(
+        drink=drink,
+        user=view.user,
+        time=drink.time,
+        session=view.session,
+        keg=view.keg,
+        stats=stats,
+        summary=summary,
+        is_first=is_first,
+    )
+
+
+def _find_prior_stats(view, drink_id):
+    """Finds the stats a view had before `drink_id`.
+
+    Returns:
+        A `(Stats, drinks)` pair: the view's latest row before `drink_id`, or
+        None if there is none, and the list of the view's drinks after that
+        row and before `drink_id`, oldest first, which still have to be
+        applied to it.
+    """
+    # One lookup on the (user, session, keg, drink) index, however many
+    # drinks the view has had since its latest row.
+    latest_row = (
+        models.Stats.objects.filter(
+            user=view.user, session=view.session, keg=view.keg, drink_id__lt=drink_id
+        )
+        .order_by("-drink_id", "-id")
+        .first()
+    )
+    prior_drinks = view.get_prior_drinks(drink_id).select_related("user", "session", "keg")
+    if latest_row is not None:
+        prior_drinks = prior_drinks.filter(id__gt=latest_row.drink_id)
+    build_list = list(prior_drinks)[::-1]
+    return latest_row, build_list
+
+
+def _build_single_view(drink, view, prior=None):
     """Generates all stats for a drink in the specified view.
 
     Args:
         drink: The target drink.
         view: The view.
-        prior_stats: Dictionary of previous stats for this view.  If None,
-            indicates that the prior stats are unknown.  When prior stats
-            are unknown, they will be queried or generated as needed.
+        prior: A `(StatsAccumulator, Stats)` pair holding the previous stats
+            for this view and the view's latest row; the accumulator is
+            advanced in place.  If None, indicates that the prior stats are
+            unknown.  When prior stats are unknown, they will be queried or
+            generated as needed.
+
+    Returns:
+        The `(StatsAccumulator, Stats)` pair for the view, including `drink`.
     """
     logger.debug(f">>> Building stats for {view}")
 
-    build_list = [drink]
-    if prior_stats is None:
-        prior_stats = Dict()
-        prior_drinks_in_view = view.get_prior_drinks(drink)
-        if prior_drinks_in_view.count():
-            # Starting with the most recent prior drink, get its stats row.
-            # If stats don't exist, add drink to build list and continue
-            # until a stats row is found or all drinks are exhausted.
-            # N.B. we avoid a recursive algorithm due to potentially large recursion
-            # depth in certain cases.
-            for prior_drink in prior_drinks_in_view:
-                try:
-                    prior_stats = Dict(
-                        models.Stats.objects.get(
-                            drink=prior_drink, user=view.user, session=view.session, keg=view.keg
-                        ).stats
-                    )
-                    break
-                except models.Stats.DoesNotExist:
-                    build_list.insert(0, prior_drink)
+    if prior is None:
+        latest_row, build_list = _find_prior_stats(view, drink.id)
+        build_list.append(drink)
+        accumulator = StatsAccumulator(latest_row.stats if latest_row else None)
+    else:
+        build_list = [drink]
+        accumulator, latest_row = prior
 
     # Build all drinks on the hit list.
     for build_drink in build_list:
         logger.debug(f"  - operating on drink {build_drink.id}")
-        stats = BUILDER.build(drink=build_drink, previous_stats=prior_stats)
-        models.Stats.objects.create(
-            drink=build_drink,
-            user=view.user,
-            time=build_drink.time,
-            session=view.session,
-            keg=view.keg,
-            stats=stats.to_dict(),
-            is_first=(not prior_stats),
-        )
-        prior_stats = stats
+        is_first = accumulator.is_empty()
+        accumulator.add(build_drink)
+        latest_row = _save_view_stats(build_drink, view, accumulator, latest_row, is_first)
     logger.debug("<<< Done.")
-    return stats
+    return accumulator, latest_row
 
 
 def _build_all_views(drink, results_cache=None):
@@ -272,18 +552,25 @@ def _build_all_views(drink, results_cache=None):
         invalidate_first: If True, all statistics starting for and following
             this drink will be deleted first.  Typically this is True when the
             target drink was modified, and False when it is a new (newest) Drink.
-        results_cache: A cache mapping view.as_tuple() -> stats.  Will be modified
-            with the results of this method.
+        results_cache: A cache mapping view.as_tuple() -> the view's
+            `(StatsAccumulator, Stats)` pair.  Will be modified with the
+            results of this method.
     """
     if results_cache is None:
         results_cache = {}
 
+    for view in _views_for_drink(drink):
+        cache_key = view.as_tuple()
+        prior = results_cache.get(cache_key)
+        results_cache[cache_key] = _build_single_view(drink, view, prior=prior)
+
+
+def _views_for_drink(drink):
+    """Returns the distinct views `drink` counts towards."""
+    views = {}
     for user in (None, drink.user):
         for session in (None, drink.session):
             for keg in (None, drink.keg):
                 view = StatsView(user, session, keg)
-                cache_key = view.as_tuple()
-
-                prior_stats = results_cache.get(cache_key)
-                stats = _build_single_view(drink, view, prior_stats=prior_stats)
-                results_cache[cache_key] = stats
+                views.setdefault(view.as_tuple(), view)
+    return list(views.values())
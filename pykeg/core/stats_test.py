@@ -1,9 +1,13 @@
 import copy
+import json
+from unittest import mock
 
 from addict import Dict
+from django.db import connection
 from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 
-from . import models
+from . import models, stats
 from .testutils import make_datetime
 
 
@@ -219,3 +223,167 @@ class StatsTestCase(TransactionTestCase):
         # UTC's monday (day = 1).
         self.assertEqual({"0": 1000.0}, stats.volume_by_day_of_week)
         self.assertEqual(600, self.users[0].get_stats().total_volume_ml)
+
+    def test_blob_format_is_stable(self):
+        """Stored blobs keep their exact key order and value types."""
+        drink_data = [
+            (100, self.users[0], make_datetime(2012, 1, 2, 12, 0)),
+            (250.5, self.users[1], make_datetime(2012, 1, 2, 12, 5)),
+            (300, None, make_datetime(2013, 6, 7, 18, 0)),
+            (50, self.users[0], make_datetime(2013, 6, 7, 18, 30)),
+        ]
+        for volume_ml, user, when in drink_data:
+            d = models.Drink.record_drink(
+                "kegboard.flow0",
+                ticks=int(volume_ml),
+                volume_ml=volume_ml,
+                username=user.username if user else None,
+                pour_time=when,
+            )
+
+        row = models.Stats.objects.get(drink=d, user=None, session=None, keg=None)
+        expected = (
+            '{"average_volume_ml": 175.125, "greatest_volume_id": 3, "greatest_volume_ml": 300.0, '
+            '"has_guest_pour": true, "keg_ids": [1], '
+            '"largest_session": {"session_id": 1, "volume_ml": 350.5}, "last_drink_id": 4, '
+            '"registered_drinkers": ["2", "3", "1"], "sessions_count": 2, "total_pours": 4, '
+            '"total_volume_ml": 700.5, "volume_by_day_of_week": {"1": 350.5, "5": 350.0}, '
+            '"volume_by_drinker": {"2": 150.0, "3": 250.5, "1": 300.0}, '
+            '"volume_by_session": {"1": 350.5, "2": 350.0}, '
+            '"volume_by_year": {"2012": 350.5, "2013": 350.0}}'
+        )
+        self.assertEqual(expected, json.dumps(row.stats))
+        row = models.Stats.objects.get(drink=d, user=d.user, session=d.session, keg=d.keg)
+        expected = (
+            '{"average_volume_ml": 50.0, "greatest_volume_id": 4, "greatest_volume_ml": 50.0, '
+            '"has_guest_pour": false, "keg_ids": [1], '
+            '"largest_session": {"session_id": 2, "volume_ml": 350.0}, "last_drink_id": 4, '
+            '"registered_drinkers": ["2"], "sessions_count": 1, "total_pours": 1, '
+            '"total_volume_ml": 50.0, "volume_by_day_of_week": {"5": 50.0}, '
+            '"volume_by_drinker": {"2": 50.0}, "volume_by_session": {"2": 50.0}, '
+            '"volume_by_year": {"2013": 50.0}}'
+        )
+        self.assertEqual(expected, json.dumps(row.stats))
+
+    def record(self, volume_ml, user, when=None):
+        return models.Drink.record_drink(
+            "kegboard.flow0",
+            ticks=volume_ml,
+            volume_ml=volume_ml,
+            username=user.username,
+            pour_time=when or make_datetime(2012, 1, 2, 12, 0),
+        )
+
+    def test_single_current_row_per_view(self):
+        for volume_ml in (100, 200, 300):
+            self.record(volume_ml, self.users[0])
+
+        system_rows = models.Stats.objects.filter(user=None, session=None, keg=None)
+        self.assertEqual(1, system_rows.count())
+        self.assertEqual(600, system_rows.get().stats["total_volume_ml"])
+        self.assertEqual(8, models.Stats.objects.count())
+
+    @mock.patch("pykeg.core.stats.CHECKPOINT_INTERVAL", 2)
+    def test_checkpoints(self):
+        drinks = [self.record(100 * (i + 1), self.users[0]) for i in range(5)]
+
+        # Checkpoints after pours 2 and 4, plus the current row.
+        system_rows = models.Stats.objects.filter(user=None, session=None, keg=None)
+        self.assertEqual(
+            [drinks[1].id, drinks[3].id, drinks[4].id],
+            sorted(system_rows.values_list("drink_id", flat=True)),
+        )
+
+        # Changing a drink resumes from the preceding checkpoint.
+        drinks[2].set_volume(50)
+        self.assertEqual(1250, models.KegbotSite.get().get_stats().total_volume_ml)
+        self.assertEqual(1250, self.users[0].get_stats().total_volume_ml)
+        self.assertEqual(3, system_rows.count())
+
+    def test_cancel_latest_drink_of_view(self):
+        self.record(100, self.users[0])
+        self.record(200, self.users[1])
+        last = self.record(300, self.users[0])
+
+        last.cancel_drink()
+        self.assertEqual(100, self.users[0].get_stats().total_volume_ml)
+        self.assertEqual(200, self.users[1].get_stats().total_volume_ml)
+        self.assertEqual(300, models.KegbotSite.get().get_stats().total_volume_ml)
+        self.assertFalse(models.Stats.objects.filter(drink__isnull=True).exists())
+
+    @mock.patch("pykeg.core.stats.CHECKPOINT_INTERVAL", 1)
+    def test_snapshot_per_drink(self):
+        for volume_ml in (100, 200, 300):
+            self.record(volume_ml, self.users[0])
+        system_rows = models.Stats.objects.filter(user=None, session=None, keg=None)
+        self.assertEqual(3, system_rows.count())
+        self.assertEqual(600, models.KegbotSite.get().get_stats().total_volume_ml)
+
+    def stats_rows(self):
+        return list(
+            models.Stats.objects.order_by(
+                "drink_id", "user_id", "session_id", "keg_id"
+            ).values_list("drink_id", "user_id", "session_id", "keg_id", "is_first", "stats")
+        )
+
+    @mock.patch("pykeg.core.stats.CHECKPOINT_INTERVAL", 2)
+    def test_bulk_rebuild_matches_incremental(self):
+        drinks = [self.record(100 * (i + 1), self.users[i % 2]) for i in range(7)]
+        # Rebuild one drink at a time, since `largest_session` reflects the
+        # session as of the rebuild rather than as of the drink.
+        stats.invalidate_all()
+        for drink in drinks:
+            stats.build_for_id(drink.id)
+        expected = self.stats_rows()
+
+        stats.invalidate_all()
+        stats.rebuild_from_id(0, batch_size=3)
+        self.assertEqual(expected, self.stats_rows())
+
+        stats.rebuild_from_id(drinks[3].id, batch_size=3)
+        self.assertEqual(expected, self.stats_rows())
+
+    def test_bulk_rebuild_queries(self):
+        for i in range(20):
+            self.record(100, self.users[i % 3])
+        stats.invalidate_all()
+
+        with CaptureQueriesContext(connection) as queries:
+            stats.rebuild_from_id(0, batch_size=100)
+        # Not one query per drink or per row.
+        self.assertLess(len(queries), 15)
+        self.assertEqual(2000, models.KegbotSite.get().get_stats().total_volume_ml)
+
+    def test_reassign_rebuilds_affected_views(self):
+        drinks = [self.record(100 * (i + 1), self.users[i % 3]) for i in range(6)]
+        bystander = models.Stats.objects.filter(user=self.users[2])
+        bystander_rows = list(bystander.order_by("id").values_list("id", "drink_id", "stats"))
+
+        drinks[0].reassign(self.users[1])
+        drinks[1].set_volume(50)
+        drinks[3].cancel_drink()
+
+        self.assertEqual(
+            bystander_rows, list(bystander.order_by("id").values_list("id", "drink_id", "stats"))
+        )
+        self.assertEqual({}, self.users[0].get_stats())
+        user_stats = self.users[1].get_stats()
+        self.assertEqual(650, user_stats.total_volume_ml)
+        self.assertEqual({"user2": 650}, user_stats.volume_by_drinker)
+        self.assertEqual(1550, models.KegbotSite.get().get_stats().total_volume_ml)
+
+    @mock.patch("pykeg.core.stats.CHECKPOINT_INTERVAL", 1)
+    def test_find_prior_stats(self):
+        drinks = [self.record(100, self.users[0]) for i in range(6)]
+        stats.invalidate(drinks[1].id)
+        view = stats.StatsView(user=self.users[0])
+
+        with CaptureQueriesContext(connection) as queries:
+            latest_row, build_list = stats._find_prior_stats(view, drinks[5].id)
+        self.assertEqual(2, len(queries))
+        self.assertEqual(drinks[0].id, latest_row.drink_id)
+        self.assertEqual([d.id for d in drinks[1:5]], [d.id for d in build_list])
+
+        latest_row, build_list = stats._find_prior_stats(view, drinks[0].id)
+        self.assertIsNone(latest_row)
+        self.assertEqual([], build_list)
@@ -1,18 +1,43 @@
 """Tasks for the Kegbot core."""
 
+import json
 import logging
+from datetime import timedelta
+from functools import partial
 
+from django.conf import settings
 from django.db import transaction
-from django_rq import job
+from django_redis import get_redis_connection
+from django_rq import get_queue, job
 
 from pykeg import notification
+from pykeg.api import cache as api_cache
+from pykeg.api import conditional
 from pykeg.backup import backup
 from pykeg.plugin import util as plugin_util
 
-from . import stats
+from . import kb_common, models, stats
 
 logger = logging.getLogger(__name__)
 
+# Stats work waiting for the stats worker, as a sorted set of views (see
+# `stats.views_for()`) scored by the first drink id each needs rebuilding
+# from.  The member `ALL_VIEWS` stands for every view.
+PENDING_STATS_KEY = "kb:stats:pending"
+ALL_VIEWS = "*"
+# Set while a `build_pending_stats` job is queued but not yet started; work
+# scheduled meanwhile is picked up by that job rather than queuing another.
+STATS_JOB_QUEUED_KEY = "kb:stats:queued"
+# Bounds how long a lost job (for example, a flushed queue) can hold up
+# stats: after this, the next scheduled work queues a fresh job.
+STATS_JOB_QUEUED_TTL = 300
+# A failed `build_pending_stats` job is tried again after this long (by
+# the workers' scheduler), with the work it failed on.
+STATS_JOB_RETRY_SECONDS = 60
+# Set while a sensor's old readings were pruned recently (see
+# `schedule_thermolog_pruning`).
+THERMOLOG_PRUNED_KEY = "kb:thermolog:pruned:{sensor_id}"
+
 
 def schedule_tasks(events):
     """Synchronously schedules tasks related to the given events."""
@@ -24,14 +49,112 @@ def schedule_tasks(events):
     notification.handle_new_system_events(events)
 
 
+def schedule_stats(drink_id, views=None):
+    """Schedules a stats rebuild from `drink_id` for `views`, or all views.
+
+    Work scheduled while a rebuild job is already queued is folded into
+    that job, which rebuilds everything pending from the lowest drink id;
+    a burst of pours thus costs one rebuild rather than one per pour.
+    """
+    members = [ALL_VIEWS] if views is None else [json.dumps(list(v)) for v in views]
+    if getattr(settings, "RQ", {}).get("COMMIT_MODE", "on_db_commit") == "auto":
+        _schedule_stats(drink_id, members)
+    else:
+        # Like queued jobs, pending work only becomes visible once the drink
+        # is committed; otherwise a job already running could take the work
+        # before it can see the drink.
+        transaction.on_commit(partial(_schedule_stats, drink_id, members))
+
+
+def _schedule_stats(drink_id, members):
+    client = get_redis_connection("default")
+    with client.pipeline() as pipe:
+        # LT keeps the lowest drink id for views already pending.
+        pipe.zadd(PENDING_STATS_KEY, dict.fromkeys(members, drink_id), lt=True)
+        pipe.set(STATS_JOB_QUEUED_KEY, 1, nx=True, ex=STATS_JOB_QUEUED_TTL)
+        _, newly_queued = pipe.execute()
+    if newly_queued:
+        build_pending_stats.delay()
+
+
+def _take_pending_stats(client):
+    with client.pipeline() as pipe:
+        pipe.zrange(PENDING_STATS_KEY, 0, -1, withscores=True)
+        pipe.delete(PENDING_STATS_KEY)
+        pending, _ = pipe.execute()
+    return {member.decode(): int(score) for member, score in pending}
+
+
+@job("stats")
+def build_pending_stats():
+    """Rebuilds all stats work scheduled with `schedule_stats()`."""
+    client = get_redis_connection("default")
+    # Clear the flag before taking the work, so anything scheduled from now
+    # on queues another job instead of being missed.
+    client.delete(STATS_JOB_QUEUED_KEY)
+    pending = _take_pending_stats(client)
+    if not pending:
+        return
+
+    drink_id = min(pending.values())
+    logger.info(f"build_pending_stats drink_id={drink_id} views={len(pending)}")
+    try:
+        with transaction.atomic():
+            if ALL_VIEWS in pending:
+                stats.rebuild_from_id(drink_id)
+            else:
+                stats.rebuild_views(drink_id, [tuple(json.loads(m)) for m in pending])
+    except Exception:
+        # Put the work back, and queue a job to retry it rather than leave
+        # it for the next pour, unless one is already queued.
+        with client.pipeline() as pipe:
+            pipe.zadd(PENDING_STATS_KEY, pending, lt=True)
+            pipe.set(STATS_JOB_QUEUED_KEY, 1, nx=True, ex=STATS_JOB_QUEUED_TTL)
+            _, newly_queued = pipe.execute()
+        if newly_queued:
+            get_queue("stats").enqueue_in(
+                timedelta(seconds=STATS_JOB_RETRY_SECONDS), build_pending_stats
+            )
+        raise
+    # Cached API responses embed stats.
+    api_cache.invalidate()
+    conditional.record_change("stats")
+
+
 @job("stats")
-def build_stats(drink_id, rebuild_following):
+def build_stats(drink_id, rebuild_following, views=None):
+    """Builds stats for one drink; superseded by `schedule_stats()`."""
     logger.info(f"build_stats drink_id={drink_id} rebuild_following={rebuild_following}")
     with transaction.atomic():
-        if rebuild_following:
+        if rebuild_following and views is not None:
+            stats.rebuild_views(drink_id, views)
+        elif rebuild_following:
             stats.rebuild_from_id(drink_id)
         else:
             stats.build_for_id(drink_id)
+    api_cache.invalidate()
+    conditional.record_change("stats")
+
+
+def schedule_thermolog_pruning(sensor_id):
+    """Queues pruning of a sensor's old readings, at most once per interval.
+
+    Readings arrive every minute or so per sensor; pruning on each would be
+    a delete per reading for rows that expire by the day.
+    """
+    client = get_redis_connection("default")
+    key = THERMOLOG_PRUNED_KEY.format(sensor_id=sensor_id)
+    if client.set(key, 1, nx=True, ex=kb_common.THERMO_SENSOR_PRUNE_MINUTES * 60):
+        prune_thermologs.delay(sensor_id)
+
+
+@job
+def prune_thermologs(sensor_id):
+    """Deletes a sensor's readings that are past the history window."""
+    sensor = models.ThermoSensor.objects.filter(id=sensor_id).first()
+    if sensor:
+        deleted = sensor.prune_readings()
+        logger.info(f"prune_thermologs sensor_id={sensor_id} deleted={deleted}")
 
 
 @job
@@ -0,0 +1,89 @@
+"""Unittests for pykeg.core.tasks"""
+
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TransactionTestCase
+from django_redis import get_redis_connection
+
+from . import models, tasks
+from .testutils import make_datetime
+
+
+class ScheduleStatsTestCase(TransactionTestCase):
+    def setUp(self):
+        self.client = get_redis_connection("default")
+        self.client.delete(tasks.PENDING_STATS_KEY, tasks.STATS_JOB_QUEUED_KEY)
+
+    def tearDown(self):
+        self.client.delete(tasks.PENDING_STATS_KEY, tasks.STATS_JOB_QUEUED_KEY)
+
+    @mock.patch.object(tasks.build_pending_stats, "delay")
+    @mock.patch.object(tasks.stats, "rebuild_views")
+    def test_burst_is_coalesced(self, rebuild_views, delay):
+        tasks.schedule_stats(12, [(1, 5, 2), (None, None, None)])
+        tasks.schedule_stats(10, [(3, 5, 2), (None, None, None)])
+        tasks.schedule_stats(11, [(1, 5, 2), (None, None, None)])
+        self.assertEqual(1, delay.call_count)
+
+        tasks.build_pending_stats()
+        rebuild_views.assert_called_once()
+        drink_id, views = rebuild_views.call_args.args
+        self.assertEqual(10, drink_id)
+        self.assertEqual({(1, 5, 2), (3, 5, 2), (None, None, None)}, set(views))
+
+        # Nothing is left over, and the next pour queues a new job.
+        tasks.build_pending_stats()
+        self.assertEqual(1, rebuild_views.call_count)
+        tasks.schedule_stats(13, [(1, 5, 2)])
+        self.assertEqual(2, delay.call_count)
+
+    @mock.patch.object(tasks.build_pending_stats, "delay")
+    @mock.patch.object(tasks.stats, "rebuild_from_id")
+    def test_all_views(self, rebuild_from_id, delay):
+        tasks.schedule_stats(20, [(1, 5, 2)])
+        tasks.schedule_stats(30)
+        tasks.build_pending_stats()
+        rebuild_from_id.assert_called_once_with(20)
+
+    @mock.patch.object(tasks, "get_queue")
+    @mock.patch.object(tasks.build_pending_stats, "delay")
+    @mock.patch.object(tasks.stats, "rebuild_views", side_effect=RuntimeError)
+    def test_failed_work_is_kept(self, rebuild_views, delay, get_queue):
+        tasks.schedule_stats(10, [(1, 5, 2)])
+        with self.assertRaises(RuntimeError):
+            tasks.build_pending_stats()
+        self.assertEqual(10, self.client.zscore(tasks.PENDING_STATS_KEY, "[1, 5, 2]"))
+        # A retry is queued for it, and new work joins that job.
+        get_queue.return_value.enqueue_in.assert_called_once_with(
+            timedelta(seconds=tasks.STATS_JOB_RETRY_SECONDS), tasks.build_pending_stats
+        )
+        delay.reset_mock()
+        tasks.schedule_stats(11, [(1, 5, 2)])
+        delay.assert_not_called()
+
+
+class ThermologPruningTestCase(TransactionTestCase):
+    def setUp(self):
+        self.sensor = models.ThermoSensor.objects.create(raw_name="kb.thermo0", nice_name="t0")
+        self.key = tasks.THERMOLOG_PRUNED_KEY.format(sensor_id=self.sensor.id)
+        self.client = get_redis_connection("default")
+        self.client.delete(self.key)
+
+    def tearDown(self):
+        self.client.delete(self.key)
+
+    @mock.patch.object(tasks.prune_thermologs, "delay")
+    def test_pruning_is_amortized(self, delay):
+        for minute in range(3):
+            self.sensor.log_sensor_reading(4.0, when=make_datetime(2026, 10, 1, 12, minute))
+        delay.assert_called_once_with(self.sensor.id)
+
+    def test_prune_thermologs(self):
+        models.Thermolog.objects.create(
+            sensor=self.sensor, temp=4.0, time=make_datetime(2000, 1, 1, 0, 0)
+        )
+        tasks.prune_thermologs(self.sensor.id)
+        self.assertEqual(0, self.sensor.thermolog_set.count())
+        # Deleted sensors are skipped.
+        tasks.prune_thermologs(self.sensor.id + 1)
@@ -0,0 +1,137 @@
+"""Live kegboard activity over redis pub/sub, for tap-room displays.
+
+The event endpoint publishes as it goes: pour updates and recorded
+pours on a channel per tap, temperatures on a channel per sensor, all
+in the same pipeline that saves the device's state (see
+`state.DeviceBatch`). `LiveStream` relays the channels a display asks
+for as server-sent events.
+
+Each stream holds a web server thread, so a process serves at most
+`MAX_STREAMS` at once, and each ends after `STREAM_SECONDS`; browsers'
+EventSource reconnects on its own. A slow reader only ever sees the
+latest pour update per tap: older ones are dropped rather than queued.
+"""
+
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django_redis import get_redis_connection
+
+TAP_CHANNEL = "kegboard:live:tap:{tap_id}"
+SENSOR_CHANNEL = "kegboard:live:sensor:{sensor_id}"
+
+# Concurrent streams per process; the rest of the API needs threads too.
+MAX_STREAMS = getattr(settings, "KEGBOT_LIVE_MAX_STREAMS", 2)
+STREAM_SECONDS = getattr(settings, "KEGBOT_LIVE_STREAM_SECONDS", 300)
+HEARTBEAT_SECONDS = 15
+# Most messages relayed per read; anything past this waits for the next.
+MAX_BATCH = 64
+RETRY_MS = 1000
+
+_slots = threading.BoundedSemaphore(MAX_STREAMS)
+
+
+def tap_channel(tap_id):
+    return cache.make_key(TAP_CHANNEL.format(tap_id=tap_id))
+
+
+def sensor_channel(sensor_id):
+    return cache.make_key(SENSOR_CHANNEL.format(sensor_id=sensor_id))
+
+
+def encode(event_type, **fields):
+    return json.dumps({"type": event_type, **fields}, separators=(",", ":"))
+
+
+def _coalesce(messages):
+    """Keeps every message, except all but the latest pour update per tap."""
+    latest = {}
+    for index, message in enumerate(messages):
+        if message["type"] == "pour_update":
+            latest[message.get("tap_id")] = index
+    return [
+        message
+        for index, message in enumerate(messages)
+        if message["type"] != "pour_update" or latest[message.get("tap_id")] == index
+    ]
+
+
+def _format(message):
+    return f"event: {message['type']}\ndata: {json.dumps(message, separators=(',', ':'))}\n\n"
+
+
+class StreamsExhausted(Exception):
+    """Raised when this process is already serving `MAX_STREAMS`."""
+
+
+class LiveStream:
+    """Server-sent events for the given taps and sensors (tap_ids=None: all).
+
+    Iterate it for the response body. `close()` frees the stream's slot;
+    Django calls it when the response finishes, whether or not the body
+    was ever read.
+    """
+
+    def __init__(self, tap_ids=None, sensor_ids=(), duration=None, clock=time.monotonic):
+        if not _slots.acquire(blocking=False):
+            raise StreamsExhausted()
+        self._open = True
+        self.pubsub = None
+        self.clock = clock
+        self.duration = STREAM_SECONDS if duration is None else duration
+        try:
+            self.pubsub = get_redis_connection("default").pubsub(ignore_subscribe_messages=True)
+            if tap_ids is None:
+                self.pubsub.psubscribe(tap_channel("*"), sensor_channel("*"))
+            else:
+                self.pubsub.subscribe(
+                    *[tap_channel(tap_id) for tap_id in tap_ids],
+                    *[sensor_channel(sensor_id) for sensor_id in sensor_ids],
+                )
+        except BaseException:
+            self.close()
+            raise
+
+    def _read(self, timeout):
+        """Returns the next messages, waiting up to `timeout` for the first."""
+        messages = []
+        message = self.pubsub.get_message(timeout=timeout)
+        while message is not None:
+            if message["type"] in ("message", "pmessage"):
+                try:
+                    messages.append(json.loads(message["data"]))
+                except ValueError:
+                    pass
+            if len(messages) >= MAX_BATCH:
+                break
+            message = self.pubsub.get_message(timeout=0)
+        return _coalesce(messages)
+
+    def __iter__(self):
+        yield f"retry: {RETRY_MS}\n\n"
+        now = self.clock()
+        deadline = now + self.duration
+        last_sent = now
+        while now < deadline:
+            timeout = max(0, min(HEARTBEAT_SECONDS, deadline - now))
+            messages = self._read(timeout)
+            now = self.clock()
+            if messages:
+                yield "".join(_format(message) for message in messages)
+                last_sent = now
+            elif now - last_sent >= HEARTBEAT_SECONDS:
+                yield ": keepalive\n\n"
+                last_sent = now
+
+    def close(self):
+        if not self._open:
+            return
+        self._open = False
+        try:
+            if self.pubsub is not None:
+                self.pubsub.close()
+        finally:
+            _slots.release()
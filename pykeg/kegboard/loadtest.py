@@ -0,0 +1,270 @@
+"""Load generator for the kegboard event protocol.
+
+Simulates a fleet of paired boards talking to this server, in process,
+and measures every batch: latency, database queries and redis commands.
+Boards heartbeat, present tokens, stream pour updates and deliver pours
+the way real ones do, acking the commands they are sent.
+
+Used by ``kegbot kegboard_loadtest`` and by ``loadtest_test.py``.
+"""
+
+import json
+import random
+import statistics
+import time
+from unittest import mock
+
+import redis
+from django.db import connection
+from django.test import Client
+
+from pykeg.core import models
+
+from . import state
+
+BOARD_PREFIX = "loadtest-"
+ENDPOINT = "/api/kegboard-event"
+# Status heartbeats go out every this many batches, per board.
+HEARTBEAT_EVERY = 10
+# Rounds in a pour: token, then pour updates, then the pour itself.
+POUR_ROUNDS = 4
+
+
+class Board:
+    """One simulated, paired board."""
+
+    def __init__(self, name, token, meter_numbers, rfid, seed=0):
+        self.name = name
+        self.token = token
+        self.meter_numbers = meter_numbers
+        self.rfid = rfid
+        self.boot_id = f"{name}-boot"
+        self.rng = random.Random(f"{seed}:{name}")
+        self.last_id = 0
+        self.rounds = 0
+        self.grant_id = None
+        self.acks = []
+        self.pours = 0
+
+    def _event(self, event_type, data, age_ms=0):
+        self.last_id += 1
+        return {"id": self.last_id, "type": event_type, "age_ms": age_ms, "data": data}
+
+    def next_batch(self):
+        """Returns the board's next envelope."""
+        events = [
+            self._event("command_result", {"command": command_id, "result": "ok"})
+            for command_id in self.acks
+        ]
+        self.acks = []
+        if self.rounds % HEARTBEAT_EVERY == 0:
+            meters = [
+                {"meter_number": number, "total_ticks": self.pours * 1000, "ml_per_tick": 0.5}
+                for number in self.meter_numbers
+            ]
+            data = {
+                "state": "heartbeat",
+                "fw_version": "4.0.0",
+                "uptime_ms": self.rounds * 1000,
+                "events_dropped": 0,
+                "config": {"heartbeat_ms": 60000, "pour_update_ms": 1000, "queue_capacity": 16},
+                "meters": meters,
+            }
+            events.append(self._event("status", data))
+
+        step = self.rounds % POUR_ROUNDS
+        meter_number = self.meter_numbers[self.pours % len(self.meter_numbers)]
+        pour_id = f"{self.name}-{self.pours}"
+        if step == 0:
+            data = {"auth_device": "core.rfid", "token": self.rfid, "action": "attached"}
+            events.append(self._event("token", data))
+        elif step < POUR_ROUNDS - 1:
+            data = {
+                "meter_number": meter_number,
+                "pour_id": pour_id,
+                "volume_ml": 100.0 * step,
+                "duration_ms": 1000 * step,
+            }
+            events.append(self._event("pour_update", data))
+        else:
+            data = {
+                "meter_number": meter_number,
+                "pour_id": pour_id,
+                "volume_ml": round(self.rng.uniform(200, 500), 1),
+                "duration_ms": 4000,
+                "ticks": 800,
+            }
+            if self.grant_id:
+                data["grant_id"] = self.grant_id
+            events.append(self._event("pour", data, age_ms=self.rng.randrange(0, 2000)))
+            self.pours += 1
+        self.rounds += 1
+
+        return {
+            "v": 1,
+            "device": self.name,
+            "boot_id": self.boot_id,
+            "sent_uptime_ms": self.rounds * 1000,
+            "events": events,
+        }
+
+    def handle_response(self, body):
+        for command in body.get("commands", []):
+            if command["type"] == "authorize":
+                self.grant_id = command["data"]["grant_id"]
+            self.acks.append(command["id"])
+
+
+def create_fleet(count, meters_per_board=2, seed=0):
+    """Creates `count` paired boards, each with its own taps, kegs and drinker."""
+    boards = []
+    for index in range(count):
+        name = f"{BOARD_PREFIX}{index}"
+        for number in range(meters_per_board):
+            tap = models.KegTap.create_tap(
+                f"{name} tap {number}",
+                meter_name=f"{name}.flow{number}",
+                toggle_name=f"{name}.relay{number}",
+            )
+            models.Keg.start_keg(
+                tap,
+                beverage_name="Load Test Lager",
+                beverage_type="beer",
+                producer_name="Load Test Brewing",
+                style_name="Lager",
+            )
+        controller = models.Controller.objects.get(name=name)
+        controller.auth_token = state.mint_token()
+        controller.save()
+        username = f"{BOARD_PREFIX}drinker-{index}"
+        models.User.objects.create(username=username, email=f"{username}@example.com")
+        rfid = f"{index:08x}"
+        models.AuthenticationToken.create_auth_token("core.rfid", rfid, username=username)
+        boards.append(
+            Board(name, controller.auth_token, list(range(meters_per_board)), rfid, seed=seed)
+        )
+    return boards
+
+
+def forget_fleet(boards):
+    """Drops the boards' redis state: roster entries, cursors, commands."""
+    for board in boards:
+        state.forget_token(board.token)
+        state.forget_device(board.name)
+
+
+class Report:
+    """Measurements of a run, per batch and in total."""
+
+    def __init__(self):
+        self.latencies = []
+        self.batches = 0
+        self.events = 0
+        self.errors = 0
+        self.queries = 0
+        self.redis_commands = 0
+        self.redis_round_trips = 0
+        self.elapsed = 0.0
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        if len(latencies) > 1:
+            cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+            p50, p99 = cuts[49], cuts[98]
+        else:
+            p50 = p99 = latencies[0] if latencies else 0.0
+        events = self.events or 1
+        return {
+            "batches": self.batches,
+            "events": self.events,
+            "errors": self.errors,
+            "events_per_second": self.events / self.elapsed if self.elapsed else 0.0,
+            "p50_ms": p50 * 1000,
+            "p99_ms": p99 * 1000,
+            "max_ms": latencies[-1] * 1000 if latencies else 0.0,
+            "queries_per_event": self.queries / events,
+            "redis_commands_per_event": self.redis_commands / events,
+            "redis_round_trips_per_batch": self.redis_round_trips / (self.batches or 1),
+        }
+
+
+class _Counters:
+    """Counts database queries and redis commands while active."""
+
+    def __init__(self, report):
+        self.report = report
+        self._patches = []
+
+    def _query(self, execute, sql, params, many, context):
+        self.report.queries += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        report = self.report
+        execute_command = redis.Redis.execute_command
+        pipeline_execute = redis.client.Pipeline.execute
+
+        def count_command(client, *args, **options):
+            report.redis_commands += 1
+            report.redis_round_trips += 1
+            return execute_command(client, *args, **options)
+
+        def count_pipeline(pipe, *args, **kwargs):
+            if pipe.command_stack:
+                report.redis_commands += len(pipe.command_stack)
+                report.redis_round_trips += 1
+            return pipeline_execute(pipe, *args, **kwargs)
+
+        self._patches = [
+            mock.patch.object(redis.Redis, "execute_command", count_command),
+            mock.patch.object(redis.client.Pipeline, "execute", count_pipeline),
+        ]
+        for patch in self._patches:
+            patch.start()
+        self._wrapper = connection.execute_wrapper(self._query)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._wrapper.__exit__(*exc_info)
+        for patch in reversed(self._patches):
+            patch.stop()
+
+
+def run(boards, rounds, client=None, callback=None):
+    """Sends `rounds` batches from every board, round-robin; returns a Report.
+
+    Background work the batches cause (stats rebuilds, plugin and
+    notification delivery, deferred event processing) is not queued: the
+    report covers the endpoint alone.
+    """
+    client = client or Client()
+    report = Report()
+    with (
+        mock.patch("pykeg.core.tasks.schedule_stats"),
+        mock.patch("pykeg.core.tasks.schedule_tasks"),
+        mock.patch("pykeg.kegboard.views.ASYNC_EVENTS", False),
+    ):
+        started = time.perf_counter()
+        for round_number in range(rounds):
+            for board in boards:
+                batch = board.next_batch()
+                with _Counters(report):
+                    sent = time.perf_counter()
+                    response = client.post(
+                        ENDPOINT,
+                        data=json.dumps(batch),
+                        content_type="application/json",
+                        HTTP_AUTHORIZATION=f"Bearer {board.token}",
+                    )
+                    report.latencies.append(time.perf_counter() - sent)
+                report.batches += 1
+                report.events += len(batch["events"])
+                if response.status_code != 200:
+                    report.errors += 1
+                    continue
+                board.handle_response(response.json())
+            if callback:
+                callback(round_number + 1, report)
+        report.elapsed = time.perf_counter() - started
+    return report
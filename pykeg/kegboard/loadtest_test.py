@@ -0,0 +1,64 @@
+"""Tests for the kegboard load generator, and the endpoint benchmarks."""
+
+import pytest
+from django.core.cache import cache
+from django.test import TestCase
+
+from pykeg.core import models
+from pykeg.core.util import get_version
+from pykeg.kegboard import loadtest, state
+
+try:
+    import pytest_benchmark
+except ImportError:
+    pytest_benchmark = None
+
+
+def _setup_site():
+    cache.clear()
+    site = models.KegbotSite.get()
+    site.is_setup = True
+    site.server_version = get_version()
+    site.save()
+
+
+class LoadTestTest(TestCase):
+    def setUp(self):
+        _setup_site()
+
+    def test_fleet_pours_are_recorded(self):
+        boards = loadtest.create_fleet(2, meters_per_board=2)
+        report = loadtest.run(boards, loadtest.POUR_ROUNDS * 2)
+
+        self.assertEqual(0, report.errors)
+        self.assertEqual(2 * loadtest.POUR_ROUNDS * 2, report.batches)
+        drinks = models.Drink.objects.filter(pour_id__startswith=loadtest.BOARD_PREFIX)
+        self.assertEqual(4, drinks.count())
+        # Every pour went through a token grant, and was attributed.
+        self.assertEqual(
+            {f"{loadtest.BOARD_PREFIX}drinker-0", f"{loadtest.BOARD_PREFIX}drinker-1"},
+            set(drinks.values_list("user__username", flat=True)),
+        )
+        # Both boards' taps were poured from.
+        self.assertEqual(4, drinks.values("keg").distinct().count())
+
+        summary = report.summary()
+        self.assertGreater(summary["queries_per_event"], 0)
+        self.assertGreater(summary["redis_commands_per_event"], 0)
+        self.assertLessEqual(summary["p50_ms"], summary["p99_ms"])
+
+        loadtest.forget_fleet(boards)
+        self.assertIsNone(state.get_device(boards[0].name))
+
+
+@pytest.mark.skipif(pytest_benchmark is None, reason="requires pytest-benchmark")
+@pytest.mark.django_db
+@pytest.mark.parametrize("board_count", [1, 10])
+def test_benchmark_event_batches(benchmark, board_count):
+    _setup_site()
+    boards = loadtest.create_fleet(board_count)
+    report = benchmark.pedantic(loadtest.run, args=(boards, 40), rounds=1, iterations=1)
+    loadtest.forget_fleet(boards)
+
+    assert report.errors == 0
+    benchmark.extra_info.update(report.summary())
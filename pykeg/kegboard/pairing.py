@@ -37,8 +37,9 @@ def allow_device(name):
     controller, created = models.Controller.objects.get_or_create(
         name=name, defaults={"model_name": "Kegboard"}
     )
-    controller.auth_token = token
+    old_token, controller.auth_token = controller.auth_token, token
     controller.save(update_fields=["auth_token"])
+    state.forget_token(old_token)
     state.stage_token(name, token)
     state.set_device_state(name, state.STATE_ALLOWED)
     return controller
@@ -53,7 +54,11 @@ def revoke_device(name):
 
     The controller row (and its meters, taps, drink history) is kept.
     """
-    models.Controller.objects.filter(name=name).update(auth_token=None)
+    controllers = models.Controller.objects.filter(name=name, auth_token__isnull=False)
+    tokens = list(controllers.values_list("auth_token", flat=True))
+    controllers.update(auth_token=None)
+    for token in tokens:
+        state.forget_token(token)
     state.forget_device(name)
 
 
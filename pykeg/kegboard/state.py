@@ -10,18 +10,41 @@ redis costs at most a re-approval click — never a credential and
 never a drink.
 """
 
+import hashlib
+import json
 import secrets
+import time
 from datetime import timedelta
 
 from django.core.cache import cache
 from django.utils import timezone
+from django_redis import get_redis_connection
+
+from pykeg.core.cache import KegbotCache
+
+from . import live
 
 ROSTER_KEY = "kegboard:device:{name}"
+# Sorted set of device names, scored by when each was last seen.
+ROSTER_INDEX_KEY = "kegboard:roster"
 TOKEN_SLOT_KEY = "kegboard:token-delivery:{name}"
 CURSOR_KEY = "kegboard:cursor:{name}"
-COMMANDS_KEY = "kegboard:commands:{name}"
+# A hash; older versions kept a pickled list at "kegboard:commands:{name}".
+COMMANDS_KEY = "kegboard:command-queue:{name}"
 POUR_UPDATE_KEY = "kegboard:pour-update:{tap_id}"
 GRANT_KEY = "kegboard:grant:{grant_id}"
+# Bearer token -> Controller; keyed by digest so tokens never sit in redis.
+AUTH_KEY = "kegboard:auth:{digest}"
+# Event batches awaiting the worker, oldest first (KEGBOT_KEGBOARD_ASYNC).
+INBOX_KEY = "kegboard:inbox:{name}"
+# Set while a worker job for the device is queued but not yet started.
+INBOX_QUEUED_KEY = "kegboard:inbox-queued:{name}"
+# Held by the worker draining the device's inbox.
+INBOX_LOCK_KEY = "kegboard:inbox-lock:{name}"
+# Failed attempts at the device's oldest batch.
+INBOX_ATTEMPTS_KEY = "kegboard:inbox-attempts:{name}"
+# Batches that failed INBOX_MAX_ATTEMPTS times, set aside for inspection.
+INBOX_DEAD_KEY = "kegboard:inbox-dead:{name}"
 
 # Devices are dropped from the roster when silent this long. Matches
 # the protocol's 7-day dedup retention guidance.
@@ -32,11 +55,33 @@ TOKEN_SLOT_TTL = int(timedelta(hours=1).total_seconds())
 # Commands are re-sent until acked; authorize/deny are stale within
 # minutes regardless (the drinker is standing at the tap).
 COMMANDS_TTL = int(timedelta(hours=1).total_seconds())
+# Pending commands kept per device; past this the oldest are dropped.
+COMMANDS_MAX = 16
 POUR_UPDATE_TTL = 10
 # Pours echo their grant_id and can deliver long after the grant ended
 # (queued through an outage); keep the attribution record as long as
 # the dedup retention window. Lost redis -> late pours become guest.
 GRANT_TTL = ROSTER_TTL
+# Pairing changes invalidate explicitly; the TTL only bounds a revoke
+# racing an in-flight batch.
+AUTH_TTL = 60
+# Bound how long a lost job or crashed worker can stall a device's inbox.
+INBOX_QUEUED_TTL = 300
+INBOX_LOCK_TTL = 300
+# A failing batch is retried with backoff, within INBOX_QUEUED_TTL, and
+# set aside after its last attempt so that later batches can drain.
+INBOX_RETRY_INTERVALS = [5, 15, 60, 120]
+INBOX_MAX_ATTEMPTS = len(INBOX_RETRY_INTERVALS) + 1
+INBOX_DEAD_TTL = ROSTER_TTL
+
+# Bumped whenever a controller's meters, toggles or taps change; see
+# `pykeg.kegboard.topology`. Read here so `DeviceBatch` can load it along
+# with the device's state.
+TOPOLOGY_CACHE = KegbotCache(
+    prefix="kegboard",
+    generation_fn=time.time_ns,
+    generation_key_name="topology_generation",
+)
 
 STATE_PENDING = "pending"
 STATE_DENIED = "denied"
@@ -64,26 +109,53 @@ def get_device(name):
     return cache.get(ROSTER_KEY.format(name=name))
 
 
-def list_devices():
-    # cache.keys() returns decorated raw keys (prefix/version); recover
-    # the device name from the suffix and re-fetch through the cache api.
-    marker = ROSTER_KEY.format(name="")
-    names = [key.rsplit(marker, 1)[1] for key in cache.keys(ROSTER_KEY.format(name="*"))]
-    entries = [get_device(name) for name in sorted(set(names))]
-    return sorted(
-        (entry for entry in entries if entry),
-        key=lambda entry: entry.get("last_seen") or "",
-        reverse=True,
-    )
+def _index_device(pipe, name):
+    pipe.zadd(cache.make_key(ROSTER_INDEX_KEY), {name: time.time()})
 
 
-def update_device(name, **fields):
-    """Merges fields into the device's roster entry, refreshing its TTL."""
+def list_devices(offset=0, limit=None):
+    """Returns roster entries, most recently seen first.
+
+    Reads the roster index rather than scanning the keyspace: one
+    pipeline for a page of names, and one MGET for their entries. Names
+    whose entries have expired are dropped from the index on the way.
+    """
+    client = get_redis_connection("default")
+    index_key = cache.make_key(ROSTER_INDEX_KEY)
+    stop = -1 if limit is None else offset + limit - 1
+    with client.pipeline() as pipe:
+        pipe.zremrangebyscore(index_key, "-inf", time.time() - ROSTER_TTL)
+        pipe.zrevrange(index_key, offset, stop)
+        names = [name.decode() for name in pipe.execute()[-1]]
+
+    keys = {name: ROSTER_KEY.format(name=name) for name in names}
+    entries = cache.get_many(keys.values())
+    expired = [name for name, key in keys.items() if key not in entries]
+    if expired:
+        client.zrem(index_key, *expired)
+    return [entries[key] for key in keys.values() if key in entries]
+
+
+def count_devices():
+    """Returns the number of devices in the roster index."""
+    return get_redis_connection("default").zcard(cache.make_key(ROSTER_INDEX_KEY))
+
+
+def _merge_device(name, entry, fields):
     now = timezone.now().isoformat()
-    entry = get_device(name) or {"device": name, "first_seen": now, "state": STATE_PENDING}
+    entry = entry or {"device": name, "first_seen": now, "state": STATE_PENDING}
     entry["last_seen"] = now
     entry.update(fields)
-    cache.set(ROSTER_KEY.format(name=name), entry, ROSTER_TTL)
+    return entry
+
+
+def update_device(name, **fields):
+    """Merges fields into the device's roster entry, refreshing its TTL."""
+    entry = _merge_device(name, get_device(name), fields)
+    with get_redis_connection("default").pipeline() as pipe:
+        cache.set(ROSTER_KEY.format(name=name), entry, ROSTER_TTL, client=pipe)
+        _index_device(pipe, name)
+        pipe.execute()
     return entry
 
 
@@ -92,10 +164,11 @@ def set_device_state(name, state):
 
 
 def forget_device(name):
-    cache.delete(ROSTER_KEY.format(name=name))
-    cache.delete(CURSOR_KEY.format(name=name))
-    cache.delete(COMMANDS_KEY.format(name=name))
-    cache.delete(TOKEN_SLOT_KEY.format(name=name))
+    with get_redis_connection("default").pipeline() as pipe:
+        for pattern in (ROSTER_KEY, CURSOR_KEY, COMMANDS_KEY, TOKEN_SLOT_KEY):
+            cache.delete(pattern.format(name=name), client=pipe)
+        pipe.zrem(cache.make_key(ROSTER_INDEX_KEY), name)
+        pipe.execute()
 
 
 # One-shot token delivery.
@@ -130,24 +203,71 @@ def set_cursor(name, boot_id, last_id):
 
 # Server -> device command queue. Commands ride every 200 response
 # until the device acknowledges them with a command_result event.
+#
+# The queue is a redis hash of command id -> command, so enqueue and ack
+# are single atomic commands however many workers serve the device.
+# Each entry records its enqueue time, which orders the queue.
+
+
+def _commands_key(name):
+    return cache.make_key(COMMANDS_KEY.format(name=name))
+
+
+def _new_command(command_type, data):
+    return {"id": mint_command_id(), "type": command_type, "data": data}
+
+
+def _queue_commands(pipe, name, commands):
+    """Queues commands on a pipeline, which then returns the queue length."""
+    key = _commands_key(name)
+    now = time.time_ns()
+    for i, command in enumerate(commands):
+        pipe.hset(key, command["id"], json.dumps({"queued": now + i, "command": command}))
+    pipe.expire(key, COMMANDS_TTL)
+    pipe.hlen(key)
+
+
+def _decode_commands(entries):
+    entries = sorted((json.loads(entry) for entry in entries.values()), key=lambda e: e["queued"])
+    return [entry["command"] for entry in entries]
+
+
+def _trim_commands(name, length):
+    """Drops the oldest commands past `COMMANDS_MAX`.
+
+    The queue is read and trimmed in a WATCH/MULTI transaction, retried
+    if it changes in between, so concurrent trims (or a command queued or
+    acknowledged meanwhile) never drop more than the excess.
+    """
+    if length <= COMMANDS_MAX:
+        return
+    key = _commands_key(name)
+
+    def trim(pipe):
+        commands = _decode_commands(pipe.hgetall(key))
+        stale = [command["id"] for command in commands[: len(commands) - COMMANDS_MAX]]
+        pipe.multi()
+        if stale:
+            pipe.hdel(key, *stale)
+
+    get_redis_connection("default").transaction(trim, key)
 
 
 def queue_command(name, command_type, data):
-    command = {"id": mint_command_id(), "type": command_type, "data": data}
-    commands = cache.get(COMMANDS_KEY.format(name=name)) or []
-    commands.append(command)
-    cache.set(COMMANDS_KEY.format(name=name), commands, COMMANDS_TTL)
+    command = _new_command(command_type, data)
+    with get_redis_connection("default").pipeline() as pipe:
+        _queue_commands(pipe, name, [command])
+        length = pipe.execute()[-1]
+    _trim_commands(name, length)
     return command
 
 
 def pending_commands(name):
-    return cache.get(COMMANDS_KEY.format(name=name)) or []
+    return _decode_commands(get_redis_connection("default").hgetall(_commands_key(name)))
 
 
 def ack_command(name, command_id):
-    key = COMMANDS_KEY.format(name=name)
-    commands = [c for c in (cache.get(key) or []) if c["id"] != command_id]
-    cache.set(key, commands, COMMANDS_TTL)
+    get_redis_connection("default").hdel(_commands_key(name), command_id)
 
 
 # Grant records: the server-side meaning of a grant_id. The device only
@@ -171,3 +291,248 @@ def stash_pour_update(tap_id, data):
 
 def get_pour_update(tap_id):
     return cache.get(POUR_UPDATE_KEY.format(tap_id=tap_id))
+
+
+# Authentication cache.
+
+
+def _auth_key(token):
+    return AUTH_KEY.format(digest=hashlib.sha256(token.encode()).hexdigest())
+
+
+def forget_token(token):
+    """Drops the cached controller for a bearer token, if any."""
+    if token:
+        cache.delete(_auth_key(token))
+
+
+# Deferred event processing: batches accepted by the endpoint, applied in
+# order by a worker (see `tasks.apply_deferred_events`).
+
+
+def _inbox_key(pattern, name):
+    return cache.make_key(pattern.format(name=name))
+
+
+def lock_inbox(name):
+    """Claims the device's inbox for one worker; False if already claimed."""
+    client = get_redis_connection("default")
+    with client.pipeline() as pipe:
+        # A job that starts clears the queued flag, so that batches
+        # arriving from now on queue another.
+        pipe.delete(_inbox_key(INBOX_QUEUED_KEY, name))
+        pipe.set(_inbox_key(INBOX_LOCK_KEY, name), 1, nx=True, ex=INBOX_LOCK_TTL)
+        return bool(pipe.execute()[-1])
+
+
+def unlock_inbox(name, retrying=False):
+    """Releases the inbox; returns True if batches arrived meanwhile and
+    no job is queued for them, in which case the caller queues one.
+
+    A failed job is `retrying`: it leaves the inbox marked as queued, so
+    that batches arriving before its retry don't queue another job.
+    """
+    client = get_redis_connection("default")
+    if retrying:
+        with client.pipeline() as pipe:
+            pipe.delete(_inbox_key(INBOX_LOCK_KEY, name))
+            pipe.set(_inbox_key(INBOX_QUEUED_KEY, name), 1, ex=INBOX_QUEUED_TTL)
+            pipe.execute()
+        return False
+    with client.pipeline() as pipe:
+        pipe.delete(_inbox_key(INBOX_LOCK_KEY, name))
+        pipe.llen(_inbox_key(INBOX_KEY, name))
+        _, pending = pipe.execute()
+    if not pending:
+        return False
+    return bool(client.set(_inbox_key(INBOX_QUEUED_KEY, name), 1, nx=True, ex=INBOX_QUEUED_TTL))
+
+
+def peek_inbox(name):
+    """Returns the device's oldest deferred batch, or None."""
+    client = get_redis_connection("default")
+    client.expire(_inbox_key(INBOX_LOCK_KEY, name), INBOX_LOCK_TTL)
+    record = client.lindex(_inbox_key(INBOX_KEY, name), 0)
+    return None if record is None else json.loads(record)
+
+
+def pop_inbox(name):
+    """Drops the batch `peek_inbox()` returned, once it has been applied."""
+    with get_redis_connection("default").pipeline() as pipe:
+        pipe.lpop(_inbox_key(INBOX_KEY, name))
+        pipe.delete(_inbox_key(INBOX_ATTEMPTS_KEY, name))
+        pipe.execute()
+
+
+def count_inbox_failure(name):
+    """Counts a failed attempt at the oldest batch; returns the attempts so far."""
+    with get_redis_connection("default").pipeline() as pipe:
+        pipe.incr(_inbox_key(INBOX_ATTEMPTS_KEY, name))
+        pipe.expire(_inbox_key(INBOX_ATTEMPTS_KEY, name), INBOX_DEAD_TTL)
+        return pipe.execute()[0]
+
+
+def bury_inbox(name):
+    """Moves the oldest batch to the device's dead-letter list."""
+    dead_key = _inbox_key(INBOX_DEAD_KEY, name)
+    with get_redis_connection("default").pipeline() as pipe:
+        pipe.lmove(_inbox_key(INBOX_KEY, name), dead_key, "LEFT", "RIGHT")
+        pipe.expire(dead_key, INBOX_DEAD_TTL)
+        pipe.delete(_inbox_key(INBOX_ATTEMPTS_KEY, name))
+        pipe.execute()
+
+
+def get_dead_batches(name):
+    """Returns the device's dead-letter batches, oldest first."""
+    records = get_redis_connection("default").lrange(_inbox_key(INBOX_DEAD_KEY, name), 0, -1)
+    return [json.loads(record) for record in records]
+
+
+# Batched access, for the event endpoint.
+
+
+class DeviceBatch:
+    """One device's state, read and written in a round trip each.
+
+    `load()` fetches the device's roster entry, pairing slot, dedup
+    cursor, pending commands and the topology generation, plus the
+    given grants and the controller cached for the given bearer token,
+    in a single pipeline. The methods below then work on that snapshot,
+    mirroring the module-level functions, and `save()` writes every
+    change back in another.
+    """
+
+    def __init__(self, name, grant_ids=(), token=None):
+        self.name = name
+        self.token = token
+        self.controller = None
+        self.device = None
+        self.staged_token = None
+        self.cursor = None
+        self.commands = []
+        self.topology_generation = None
+        self.grants = {grant_id: None for grant_id in grant_ids}
+        self._writes = {}
+        self._deletes = set()
+        self._queued = []
+        self._acked = set()
+        self._messages = []
+        self._deferred = []
+        # Set by `save()` when a worker job must be queued for the inbox.
+        self.needs_worker = False
+
+    def _key(self, pattern):
+        return pattern.format(name=self.name)
+
+    def load(self):
+        keys = [self._key(ROSTER_KEY), self._key(TOKEN_SLOT_KEY), self._key(CURSOR_KEY)]
+        keys.append(TOPOLOGY_CACHE.generation_key)
+        if self.token:
+            keys.append(_auth_key(self.token))
+        keys += [GRANT_KEY.format(grant_id=grant_id) for grant_id in self.grants]
+        with get_redis_connection("default").pipeline(transaction=False) as pipe:
+            pipe.mget([cache.make_key(key) for key in keys])
+            pipe.hgetall(_commands_key(self.name))
+            values, commands = pipe.execute()
+
+        values = [None if value is None else cache.client.decode(value) for value in values]
+        self.device, self.staged_token, self.cursor, self.topology_generation = values[:4]
+        values = values[4:]
+        if self.token:
+            self.controller = values.pop(0)
+        self.grants = dict(zip(self.grants, values))
+        self.commands = _decode_commands(commands)
+        return self
+
+    def _set(self, key, value, ttl):
+        self._deletes.discard(key)
+        self._writes[key] = (value, ttl)
+
+    def _delete(self, key):
+        self._writes.pop(key, None)
+        self._deletes.add(key)
+
+    def cache_controller(self, controller):
+        """Remembers the controller `token` authenticated as."""
+        self.controller = controller
+        self._set(_auth_key(self.token), controller, AUTH_TTL)
+
+    def update_device(self, **fields):
+        self.device = _merge_device(self.name, self.device, fields)
+        self._set(self._key(ROSTER_KEY), self.device, ROSTER_TTL)
+        return self.device
+
+    def take_staged_token(self):
+        token, self.staged_token = self.staged_token, None
+        if token is not None:
+            self._delete(self._key(TOKEN_SLOT_KEY))
+        return token
+
+    def set_cursor(self, boot_id, last_id):
+        self.cursor = {"boot_id": boot_id, "last_id": last_id}
+        self._set(self._key(CURSOR_KEY), self.cursor, CURSOR_TTL)
+
+    def queue_command(self, command_type, data):
+        command = _new_command(command_type, data)
+        self.commands = [*self.commands, command]
+        self._queued.append(command)
+        return command
+
+    def ack_command(self, command_id):
+        self.commands = [c for c in self.commands if c["id"] != command_id]
+        self._queued = [c for c in self._queued if c["id"] != command_id]
+        self._acked.add(command_id)
+
+    def get_grant(self, grant_id):
+        if grant_id not in self.grants:
+            self.grants[grant_id] = get_grant(grant_id)
+        return self.grants[grant_id]
+
+    def store_grant(self, grant_id, username):
+        self.grants[grant_id] = {"user": username}
+        self._set(GRANT_KEY.format(grant_id=grant_id), self.grants[grant_id], GRANT_TTL)
+
+    def stash_pour_update(self, tap_id, data):
+        self._set(POUR_UPDATE_KEY.format(tap_id=tap_id), data, POUR_UPDATE_TTL)
+        self.publish(live.tap_channel(tap_id), live.encode("pour_update", tap_id=tap_id, **data))
+
+    def defer(self, record):
+        """Appends a batch to the device's inbox, for the worker."""
+        self._deferred.append(json.dumps(record))
+
+    def publish(self, channel, message):
+        """Publishes to live displays (see `live`) once saved."""
+        self._messages.append((channel, message))
+
+    def save(self):
+        pending = (self._writes, self._deletes, self._queued, self._acked, self._messages)
+        if not (any(pending) or self._deferred):
+            return
+        with get_redis_connection("default").pipeline() as pipe:
+            for key, (value, ttl) in self._writes.items():
+                cache.set(key, value, ttl, client=pipe)
+            for key in self._deletes:
+                cache.delete(key, client=pipe)
+            if self._key(ROSTER_KEY) in self._writes:
+                _index_device(pipe, self.name)
+            if self._acked:
+                pipe.hdel(_commands_key(self.name), *self._acked)
+            for channel, message in self._messages:
+                pipe.publish(channel, message)
+            if self._deferred:
+                pipe.rpush(_inbox_key(INBOX_KEY, self.name), *self._deferred)
+                queued_at = len(pipe)
+                pipe.set(_inbox_key(INBOX_QUEUED_KEY, self.name), 1, nx=True, ex=INBOX_QUEUED_TTL)
+            if self._queued:
+                _queue_commands(pipe, self.name, self._queued)
+            results = pipe.execute()
+        if self._deferred:
+            self.needs_worker = bool(results[queued_at])
+        if self._queued:
+            _trim_commands(self.name, results[-1])
+        self._writes.clear()
+        self._deletes.clear()
+        self._queued = []
+        self._acked = set()
+        self._messages = []
+        self._deferred = []
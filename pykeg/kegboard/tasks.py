@@ -0,0 +1,68 @@
+"""Worker side of deferred kegboard event processing (KEGBOT_KEGBOARD_ASYNC)."""
+
+import logging
+from datetime import datetime
+
+from django_rq import job
+from rq import Retry
+
+from pykeg.core import models
+
+from . import state, views
+
+logger = logging.getLogger(__name__)
+
+
+def _apply_batch(record):
+    controller = models.Controller.objects.filter(pk=record["controller"]).first()
+    if controller is None:
+        logger.warning(f"kegboard: controller {record['controller']} is gone, batch dropped")
+        return
+    grant_ids = {
+        event["data"].get("grant_id")
+        for event in record["events"]
+        if event["type"] == "pour" and isinstance(event["data"].get("grant_id"), str)
+    }
+    device_state = state.DeviceBatch(controller.name, grant_ids).load()
+    received = datetime.fromisoformat(record["received"])
+    views.apply_events(controller, device_state, record["events"], received)
+    device_state.save()
+
+
+@job(
+    "default",
+    retry=Retry(max=len(state.INBOX_RETRY_INTERVALS), interval=state.INBOX_RETRY_INTERVALS),
+)
+def apply_deferred_events(name):
+    """Applies a device's deferred event batches, oldest first.
+
+    A batch leaves the inbox only once applied, so a crash repeats it
+    (pours are deduplicated by pour_id). If a batch fails, the job fails
+    with it still queued, and is retried with backoff; after
+    `state.INBOX_MAX_ATTEMPTS` failures the batch is logged and moved to
+    the device's dead-letter list, and the batches behind it are applied.
+    """
+    if not state.lock_inbox(name):
+        # Another worker is draining this inbox, and will requeue for
+        # anything it leaves behind.
+        return
+    try:
+        while (record := state.peek_inbox(name)) is not None:
+            try:
+                _apply_batch(record)
+            except Exception:
+                attempts = state.count_inbox_failure(name)
+                if attempts < state.INBOX_MAX_ATTEMPTS:
+                    raise
+                logger.exception(
+                    f"kegboard: batch for {name} failed {attempts} times, moved to "
+                    f"{state.INBOX_DEAD_KEY.format(name=name)}"
+                )
+                state.bury_inbox(name)
+            else:
+                state.pop_inbox(name)
+    except Exception:
+        state.unlock_inbox(name, retrying=True)
+        raise
+    if state.unlock_inbox(name):
+        apply_deferred_events.delay(name)
@@ -2,14 +2,18 @@
 
 import json
 from datetime import timedelta
+from unittest import mock
 
+import redis
 from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
 from pykeg.core import models
 from pykeg.core.util import get_version
-from pykeg.kegboard import state
+from pykeg.kegboard import live, pairing, state, tasks, topology, views
 
 ENDPOINT = "/api/kegboard-event"
 DEVICE = "kegboard-a1b2c3"
@@ -249,6 +253,22 @@ class PourTest(KegboardTestCase):
         self.assertEqual(200, response.status_code)
         self.assertFalse(models.Drink.objects.filter(pour_id="pour-1").exists())
 
+    def test_queued_pours_are_recorded_together(self):
+        token = self.pair()
+        events = [
+            self.pour_event(event_id=i, pour_id=f"pour-{i}", meter_number=i % 2)
+            for i in range(1, 9)
+        ]
+        with (
+            CaptureQueriesContext(connection) as queries,
+            mock.patch("pykeg.core.tasks.schedule_stats") as schedule_stats,
+        ):
+            self.assertEqual(200, self.post(events, token=token).status_code)
+        self.assertEqual(8, models.Drink.objects.filter(pour_id__startswith="pour-").count())
+        self.assertEqual(1, schedule_stats.call_count)
+        lookups = [q for q in queries if "pour_id" in q["sql"] and "SELECT" in q["sql"]]
+        self.assertEqual(1, len(lookups))
+
     def test_pour_update_is_stashed(self):
         token = self.pair()
         event = {
@@ -363,6 +383,89 @@ class TokenAuthTest(KegboardTestCase):
         self.assertEqual([], response.json()["commands"])
 
 
+class RosterTest(KegboardTestCase):
+    def test_devices_listed_most_recent_first(self):
+        for name in ("kb-1", "kb-2", "kb-3"):
+            state.update_device(name)
+        state.update_device("kb-1", fw_version="4.0.1")
+
+        names = [entry["device"] for entry in state.list_devices()]
+        self.assertEqual(["kb-1", "kb-3", "kb-2"], names)
+        self.assertEqual(3, state.count_devices())
+        self.assertEqual(
+            ["kb-3", "kb-2"], [entry["device"] for entry in state.list_devices(offset=1, limit=2)]
+        )
+
+    def test_forgotten_and_expired_devices_leave_the_index(self):
+        state.update_device("kb-1")
+        state.update_device("kb-2")
+        state.forget_device("kb-1")
+        # As if the entry's TTL had run out.
+        cache.delete(state.ROSTER_KEY.format(name="kb-2"))
+
+        self.assertEqual([], state.list_devices())
+        self.assertEqual(0, state.count_devices())
+
+    def test_event_batches_keep_the_index(self):
+        self.post([self.status_event()])
+        self.assertEqual([DEVICE], [entry["device"] for entry in state.list_devices()])
+
+    def test_listing_does_not_scan_keys(self):
+        state.update_device("kb-1")
+        with mock.patch.object(cache, "keys", side_effect=AssertionError("KEYS scan")):
+            self.assertEqual(1, len(state.list_devices()))
+
+
+class CommandQueueTest(KegboardTestCase):
+    def test_commands_are_ordered_and_acked_individually(self):
+        first = state.queue_command(DEVICE, "deny", {"n": 1})
+        second = state.queue_command(DEVICE, "deny", {"n": 2})
+        third = state.queue_command(DEVICE, "deny", {"n": 3})
+        self.assertEqual([first, second, third], state.pending_commands(DEVICE))
+
+        state.ack_command(DEVICE, second["id"])
+        state.ack_command(DEVICE, "cmd_unknown")
+        self.assertEqual([first, third], state.pending_commands(DEVICE))
+
+    def test_queue_is_bounded(self):
+        commands = [
+            state.queue_command(DEVICE, "deny", {"n": n}) for n in range(state.COMMANDS_MAX + 3)
+        ]
+        self.assertEqual(commands[3:], state.pending_commands(DEVICE))
+
+    def test_trim_retries_when_the_queue_changes(self):
+        commands = [
+            state.queue_command(DEVICE, "deny", {"n": n}) for n in range(state.COMMANDS_MAX)
+        ]
+        decode = state._decode_commands
+
+        def ack_while_trimming(entries):
+            # The newest command is acknowledged between the read and the trim.
+            if decode_commands.call_count == 1:
+                state.ack_command(DEVICE, commands[-1]["id"])
+            return decode(entries)
+
+        with mock.patch.object(
+            state, "_decode_commands", side_effect=ack_while_trimming
+        ) as decode_commands:
+            extra = state.queue_command(DEVICE, "deny", {"n": state.COMMANDS_MAX})
+        self.assertEqual(2, decode_commands.call_count)
+        self.assertEqual([*commands[:-1], extra], state.pending_commands(DEVICE))
+
+    def test_batch_keeps_commands_queued_concurrently(self):
+        device_state = state.DeviceBatch(DEVICE).load()
+        # Queued by another worker while this batch is being processed.
+        other = state.queue_command(DEVICE, "deny", {"n": 1})
+        mine = device_state.queue_command("deny", {"n": 2})
+        device_state.save()
+        self.assertEqual([other, mine], state.pending_commands(DEVICE))
+
+    def test_forget_device_drops_commands(self):
+        state.queue_command(DEVICE, "deny", {})
+        state.forget_device(DEVICE)
+        self.assertEqual([], state.pending_commands(DEVICE))
+
+
 class StatusTest(KegboardTestCase):
     def test_status_updates_health_and_meters(self):
         token = self.pair()
@@ -397,3 +500,340 @@ class StatusTest(KegboardTestCase):
         good = self.pour_event(event_id=2)
         self.assertEqual(200, self.post([bad, good], token=token).status_code)
         self.assertTrue(models.Drink.objects.filter(pour_id="pour-1").exists())
+
+
+class AuthCacheTest(KegboardTestCase):
+    def controller_queries(self, *args, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(*args, **kwargs)
+        return response, [q["sql"] for q in queries if "core_controller" in q["sql"]]
+
+    def test_known_board_skips_the_database(self):
+        token = self.pair()
+        self.post([self.status_event(event_id=1)], device=self.controller.name, token=token)
+        response, queries = self.controller_queries(
+            [self.status_event(event_id=2)], device=self.controller.name, token=token
+        )
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([], queries)
+
+    def test_token_is_not_stored_in_redis(self):
+        token = self.pair()
+        self.post([self.status_event()], device=self.controller.name, token=token)
+        self.assertEqual([], [key for key in cache.keys("*") if token in key])
+
+    def test_revoke_takes_effect_immediately(self):
+        token = self.pair()
+        self.post([self.status_event(event_id=1)], device=self.controller.name, token=token)
+        pairing.revoke_device(self.controller.name)
+        response = self.post(
+            [self.status_event(event_id=2)], device=self.controller.name, token=token
+        )
+        self.assertEqual(401, response.status_code)
+
+    def test_reallow_replaces_cached_token(self):
+        token = self.pair()
+        self.post([self.status_event(event_id=1)], device=self.controller.name, token=token)
+        pairing.allow_device(self.controller.name)
+        response = self.post(
+            [self.status_event(event_id=2)], device=self.controller.name, token=token
+        )
+        self.assertEqual(401, response.status_code)
+
+
+class TopologyTest(KegboardTestCase):
+    CONFIG_TABLES = ("core_flowmeter", "core_flowtoggle", "core_kegtap")
+
+    def pour_update_event(self, event_id=1, meter_number=0):
+        data = {"meter_number": meter_number, "pour_id": "p", "volume_ml": 1.0, "duration_ms": 1}
+        return {"id": event_id, "type": "pour_update", "age_ms": 0, "data": data}
+
+    def config_queries(self, events, token):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(200, self.post(events, token=token).status_code)
+        return [q["sql"] for q in queries if any(t in q["sql"] for t in self.CONFIG_TABLES)]
+
+    def test_hot_path_makes_no_config_queries(self):
+        token = self.pair()
+        models.AuthenticationToken.objects.create(
+            auth_device="core.rfid", token_value="0089f2c4", user=self.user
+        )
+        self.post([self.pour_update_event(event_id=1)], token=token)
+        # Forget this process's copy; redis still has the snapshot.
+        topology._local.clear()
+
+        token_event = {
+            "id": 3,
+            "type": "token",
+            "age_ms": 0,
+            "data": {"auth_device": "core.rfid", "token": "0089f2c4", "action": "attached"},
+        }
+        events = [self.pour_update_event(event_id=2), token_event, self.status_event(event_id=4)]
+        self.assertEqual([], self.config_queries(events, token))
+
+        authorize = state.pending_commands(self.controller.name)[0]["data"]
+        self.assertEqual([0, 1], authorize["meter_numbers"])
+        self.assertEqual([0, 1], authorize["relay_numbers"])
+
+    def test_rewiring_invalidates(self):
+        token = self.pair()
+        self.post([self.pour_update_event(event_id=1)], token=token)
+        main_tap = models.KegTap.objects.get(pk=1)
+        second_tap = models.KegTap.objects.get(pk=2)
+        second_tap.connect_meter(main_tap.current_meter())
+
+        self.post([self.pour_update_event(event_id=2)], token=token)
+        self.assertEqual(second_tap.id, topology.get_topology(self.controller.id).tap_id(0))
+        self.assertEqual(1.0, state.get_pour_update(second_tap.id)["volume_ml"])
+
+    def test_deleted_tap_is_unbound(self):
+        token = self.pair()
+        self.post([self.pour_update_event(event_id=1)], token=token)
+        models.KegTap.objects.get(pk=1).delete()
+
+        self.post([self.pour_event(event_id=2)], token=token)
+        self.assertFalse(models.Drink.objects.filter(pour_id="pour-1").exists())
+        self.assertIsNone(topology.get_topology(self.controller.id).tap_id(0))
+
+
+class LiveTest(KegboardTestCase):
+    def read(self, stream):
+        """Returns the events a short-lived stream relays."""
+        try:
+            body = "".join(stream)
+        finally:
+            stream.close()
+        events = []
+        for chunk in body.split("\n\n"):
+            lines = dict(line.split(": ", 1) for line in chunk.splitlines() if ": " in line)
+            if "event" in lines:
+                events.append(json.loads(lines["data"]))
+        return events
+
+    def pour_update_event(self, event_id, volume_ml, meter_number=0):
+        data = {
+            "meter_number": meter_number,
+            "pour_id": "pour-1",
+            "volume_ml": volume_ml,
+            "duration_ms": 1,
+        }
+        return {"id": event_id, "type": "pour_update", "age_ms": 0, "data": data}
+
+    def test_tap_activity_is_relayed(self):
+        token = self.pair()
+        main_tap = models.KegTap.objects.get(pk=1)
+        main_tap.temperature_sensor = models.ThermoSensor.objects.create(
+            raw_name="kegboard.thermo-28ff", nice_name="thermo-28ff"
+        )
+        main_tap.save()
+        stream = live.LiveStream([1], [main_tap.temperature_sensor_id], duration=0.2)
+        temperature = {
+            "id": 4,
+            "type": "temperature",
+            "age_ms": 0,
+            "data": {"sensor": "thermo-28ff", "temp_c": 4.25},
+        }
+        events = [
+            self.pour_update_event(1, 100.0),
+            self.pour_update_event(2, 200.0),
+            # Another tap's update isn't relayed.
+            self.pour_update_event(3, 50.0, meter_number=1),
+            temperature,
+            self.pour_event(event_id=5),
+        ]
+        self.assertEqual(200, self.post(events, token=token).status_code)
+
+        relayed = self.read(stream)
+        # Only the latest update per tap survives.
+        self.assertEqual(["pour_update", "temperature", "pour"], [e["type"] for e in relayed])
+        self.assertEqual(200.0, relayed[0]["volume_ml"])
+        self.assertEqual(4.25, relayed[1]["temp_c"])
+        drink = models.Drink.objects.get(pour_id="pour-1")
+        self.assertEqual(
+            {"tap_id": 1, "drink_id": drink.id},
+            {
+                "tap_id": relayed[2]["tap_id"],
+                "drink_id": relayed[2]["drink_id"],
+            },
+        )
+
+    def test_streams_are_limited(self):
+        streams = [live.LiveStream(duration=0) for _ in range(live.MAX_STREAMS)]
+        with self.assertRaises(live.StreamsExhausted):
+            live.LiveStream(duration=0)
+        streams[0].close()
+        streams[0].close()
+        streams.append(live.LiveStream(duration=0))
+        for stream in streams:
+            stream.close()
+
+    def test_endpoint_streams_events(self):
+        response = self.client.get("/api/live?taps=1", HTTP_ACCEPT="text/event-stream")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("text/event-stream", response["Content-Type"])
+        response.close()
+
+        response = self.client.get("/api/live?taps=x", HTTP_ACCEPT="text/event-stream")
+        self.assertEqual(400, response.status_code)
+        response = self.client.get("/api/live?taps=999")
+        self.assertEqual(404, response.status_code)
+
+
+@mock.patch.object(views, "ASYNC_EVENTS", True)
+class DeferredEventsTest(KegboardTestCase):
+    def setUp(self):
+        super().setUp()
+        self.token = self.pair()
+        self.name = self.controller.name
+        models.AuthenticationToken.objects.create(
+            auth_device="core.rfid", token_value="0089f2c4", user=self.user
+        )
+        token_event = {
+            "id": 2,
+            "type": "token",
+            "age_ms": 0,
+            "data": {"auth_device": "core.rfid", "token": "0089f2c4", "action": "attached"},
+        }
+        self.events = [self.pour_event(event_id=1), token_event, self.status_event(event_id=3)]
+
+    def post_deferred(self, events):
+        with mock.patch.object(tasks.apply_deferred_events, "delay") as delay:
+            response = self.post(events, device=self.name, token=self.token)
+        self.assertEqual(200, response.status_code)
+        return response, delay
+
+    def test_batch_is_acknowledged_before_it_is_applied(self):
+        response, delay = self.post_deferred(self.events)
+        # Commands are answered straight away...
+        self.assertEqual(["authorize"], [c["type"] for c in response.json()["commands"]])
+        self.assertEqual({"boot_id": "boot-1", "last_id": 3}, state.get_cursor(self.name))
+        delay.assert_called_once_with(self.name)
+        # ...while pours and statuses wait for the worker.
+        self.assertFalse(models.Drink.objects.filter(pour_id="pour-1").exists())
+        self.assertEqual([1, 3], [e["id"] for e in state.peek_inbox(self.name)["events"]])
+
+        tasks.apply_deferred_events(self.name)
+        self.assertTrue(models.Drink.objects.filter(pour_id="pour-1").exists())
+        self.assertEqual("4.0.0", state.get_device(self.name)["fw_version"])
+        self.assertIsNone(state.peek_inbox(self.name))
+
+    def test_replayed_batch_is_not_queued_twice(self):
+        self.post_deferred(self.events)
+        _, delay = self.post_deferred(self.events)
+        delay.assert_not_called()
+        tasks.apply_deferred_events(self.name)
+        self.assertEqual(1, models.Drink.objects.filter(pour_id="pour-1").count())
+
+    def test_batches_apply_in_order_and_idempotently(self):
+        _, delay = self.post_deferred([self.pour_event(event_id=1)])
+        _, second_delay = self.post_deferred([self.pour_event(event_id=2, pour_id="pour-2")])
+        delay.assert_called_once()
+        # A job is already queued for the inbox.
+        second_delay.assert_not_called()
+
+        # A worker that dies after applying a batch repeats it.
+        tasks._apply_batch(state.peek_inbox(self.name))
+        tasks.apply_deferred_events(self.name)
+        drinks = models.Drink.objects.filter(pour_id__startswith="pour-").order_by("id")
+        self.assertEqual(["pour-1", "pour-2"], [d.pour_id for d in drinks])
+
+    def test_one_worker_per_device(self):
+        self.post_deferred(self.events)
+        self.assertTrue(state.lock_inbox(self.name))
+        tasks.apply_deferred_events(self.name)
+        self.assertIsNotNone(state.peek_inbox(self.name))
+
+        # The lock holder requeues for what it leaves behind.
+        self.assertTrue(state.unlock_inbox(self.name))
+
+    def test_failing_batch_is_retried_then_set_aside(self):
+        self.post_deferred([self.pour_event(event_id=1)])
+        apply_batch = tasks._apply_batch
+
+        def fail_first_pour(record):
+            if record["events"][0]["id"] == 1:
+                raise RuntimeError("lock wait timeout")
+            apply_batch(record)
+
+        with mock.patch.object(tasks, "_apply_batch", side_effect=fail_first_pour):
+            for _ in range(state.INBOX_MAX_ATTEMPTS - 1):
+                with self.assertRaises(RuntimeError):
+                    tasks.apply_deferred_events(self.name)
+                # The job's retry is pending: new batches don't queue another.
+                _, delay = self.post_deferred([self.pour_event(event_id=2, pour_id="pour-2")])
+                delay.assert_not_called()
+                self.assertEqual(1, state.peek_inbox(self.name)["events"][0]["id"])
+
+            # The last attempt sets the batch aside and drains the rest.
+            tasks.apply_deferred_events(self.name)
+        self.assertIsNone(state.peek_inbox(self.name))
+        self.assertEqual([1], [b["events"][0]["id"] for b in state.get_dead_batches(self.name)])
+        self.assertTrue(models.Drink.objects.filter(pour_id="pour-2").exists())
+        self.assertFalse(models.Drink.objects.filter(pour_id="pour-1").exists())
+
+
+class RoundTripTest(KegboardTestCase):
+    def count_round_trips(self, *args, **kwargs):
+        """Posts a batch; returns its redis round trips on kegboard keys."""
+        round_trips = []
+        execute_command = redis.Redis.execute_command
+        execute = redis.client.Pipeline.execute
+
+        def count_command(client, *args, **options):
+            if any(":kegboard:" in str(key) for key in args[1:2]):
+                round_trips.append(args[0])
+            return execute_command(client, *args, **options)
+
+        def count_pipeline(pipe, *args, **kwargs):
+            commands = [command for command, _ in pipe.command_stack]
+            if any(":kegboard:" in str(command[1]) for command in commands):
+                round_trips.append("pipeline")
+            return execute(pipe, *args, **kwargs)
+
+        with (
+            mock.patch.object(redis.Redis, "execute_command", count_command),
+            mock.patch.object(redis.client.Pipeline, "execute", count_pipeline),
+        ):
+            response = self.post(*args, **kwargs)
+        self.assertIn(response.status_code, (200, 401))
+        return round_trips
+
+    def test_batch_reads_and_writes_once(self):
+        token = self.pair()
+        models.AuthenticationToken.objects.create(
+            auth_device="core.rfid", token_value="0089f2c4", user=self.user
+        )
+        events = [
+            self.status_event(event_id=1),
+            {
+                "id": 2,
+                "type": "token",
+                "age_ms": 0,
+                "data": {"auth_device": "core.rfid", "token": "0089f2c4", "action": "attached"},
+            },
+            {
+                "id": 3,
+                "type": "pour_update",
+                "age_ms": 0,
+                "data": {"meter_number": 0, "pour_id": "p", "volume_ml": 1.0, "duration_ms": 1},
+            },
+            self.pour_event(event_id=4, grant_id="g_0001"),
+        ]
+        state.store_grant("g_0001", self.user.username)
+        topology.get_topology(self.controller.id)
+        self.assertEqual(
+            ["pipeline", "pipeline"],
+            self.count_round_trips(events, device=self.controller.name, token=token),
+        )
+
+        name = self.controller.name
+        self.assertEqual("4.0.0", state.get_device(name)["fw_version"])
+        self.assertEqual({"boot_id": "boot-1", "last_id": 4}, state.get_cursor(name))
+        self.assertEqual(["authorize"], [c["type"] for c in state.pending_commands(name)])
+        meter = models.FlowMeter.objects.get(controller=self.controller, port_name="flow0")
+        self.assertEqual("p", state.get_pour_update(meter.tap_id)["pour_id"])
+        self.assertEqual(self.user, models.Drink.objects.get(pour_id="pour-1").user)
+
+    def test_pairing_reads_and_writes_once(self):
+        self.assertEqual(["pipeline", "pipeline"], self.count_round_trips([self.status_event()]))
+        self.assertEqual(state.STATE_PENDING, state.get_device(DEVICE)["state"])
@@ -0,0 +1,104 @@
+"""Per-controller kegboard topology: which meters and relays serve which taps.
+
+Every pour, pour update and token event needs this, and it only changes
+when taps are rewired. Snapshots are cached in redis under a generation
+(see `pykeg.core.cache.KegbotCache`) that any meter, toggle or tap change
+bumps, and in-process per generation; the event endpoint loads the
+generation alongside the device's state, so resolving a meter or the
+relays for a grant costs no queries at all.
+"""
+
+from pykeg.core import models
+from pykeg.core.cache import SEP
+from pykeg.kegboard.state import TOPOLOGY_CACHE
+
+# Snapshots from stale generations are never read again; let them go.
+SNAPSHOT_TTL = 24 * 60 * 60
+
+# Controller id -> (generation, Topology), for this process.
+_local = {}
+
+
+def port_number(port_name, prefix):
+    """Returns N for a port named `<prefix>N`, or None."""
+    if port_name.startswith(prefix):
+        try:
+            return int(port_name[len(prefix) :])
+        except ValueError:
+            pass
+    return None
+
+
+class Topology:
+    """A controller's wiring, from its meter and relay port numbers."""
+
+    def __init__(self, meters, relays):
+        # Meter number -> {"tap_id", "ticks_per_ml"}.
+        self.meters = meters
+        # Tap id -> relay numbers.
+        self.relays = relays
+
+    def tap_id(self, meter_number):
+        """Returns the id of the tap the meter serves, or None."""
+        meter = self.meters.get(meter_number)
+        return meter["tap_id"] if meter else None
+
+    def ticks_per_ml(self, meter_number):
+        meter = self.meters.get(meter_number)
+        return meter["ticks_per_ml"] if meter else None
+
+    def meter_numbers(self):
+        return sorted(self.meters)
+
+    def relay_numbers(self, meter_numbers):
+        """Returns the relays bound to the taps of the given meters."""
+        tap_ids = {self.tap_id(number) for number in meter_numbers} - {None}
+        return sorted(number for tap_id in tap_ids for number in self.relays.get(tap_id, []))
+
+
+def build_topology(controller_id):
+    """Reads a controller's wiring from the database, as plain data."""
+    meters = {}
+    rows = models.FlowMeter.objects.filter(controller_id=controller_id)
+    for port_name, tap_id, ticks_per_ml in rows.values_list("port_name", "tap_id", "ticks_per_ml"):
+        number = port_number(port_name, "flow")
+        if number is not None:
+            meters[number] = {"tap_id": tap_id, "ticks_per_ml": ticks_per_ml}
+
+    relays = {}
+    rows = models.FlowToggle.objects.filter(controller_id=controller_id, tap__isnull=False)
+    for port_name, tap_id in rows.values_list("port_name", "tap_id"):
+        number = port_number(port_name, "relay")
+        if number is not None:
+            relays.setdefault(tap_id, []).append(number)
+    return {"meters": meters, "relays": {tap_id: sorted(v) for tap_id, v in relays.items()}}
+
+
+def get_topology(controller_id, generation=None):
+    """Returns the controller's `Topology`, from the nearest cache.
+
+    Args:
+        controller_id: The controller's id.
+        generation: The current topology generation, if the caller has
+            already read it (see `state.DeviceBatch`).
+    """
+    if not generation:
+        generation = TOPOLOGY_CACHE.get_generation()
+    cached = _local.get(controller_id)
+    if cached and cached[0] == generation:
+        return cached[1]
+
+    key = SEP.join(("topology", str(controller_id), str(generation)))
+    data = TOPOLOGY_CACHE.get(key)
+    if data is None:
+        data = build_topology(controller_id)
+        TOPOLOGY_CACHE.set(key, data, SNAPSHOT_TTL)
+    topology = Topology(data["meters"], data["relays"])
+    _local[controller_id] = (generation, topology)
+    return topology
+
+
+def invalidate():
+    """Starts a new topology generation, so every snapshot is rebuilt."""
+    TOPOLOGY_CACHE.update_generation()
+    _local.clear()
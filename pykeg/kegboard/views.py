@@ -10,6 +10,7 @@ events and stats behave exactly as for any other drink.
 import logging
 from datetime import timedelta
 
+from django.conf import settings
 from django.http import JsonResponse
 from django.utils import timezone
 from drf_spectacular.utils import extend_schema
@@ -19,7 +20,7 @@ from rest_framework.response import Response
 
 from pykeg.core import models
 
-from . import state
+from . import live, state, tasks, topology
 
 logger = logging.getLogger(__name__)
 
@@ -130,21 +131,19 @@ def _bearer_token(request):
     return None
 
 
-def _pairing_response(device_name, request):
+def _pairing_response(device_state, request):
     """The 401 pairing flow for any request we can't authenticate."""
-    staged = state.take_staged_token(device_name)
+    staged = device_state.take_staged_token()
     if staged is not None:
-        state.update_device(device_name, state=state.STATE_PAIRED, last_error=None)
+        device_state.update_device(state=state.STATE_PAIRED, last_error=None)
         return JsonResponse({"pairing": {"state": "allowed", "token": staged}}, status=401)
 
-    entry = state.get_device(device_name)
+    entry = device_state.device
     if entry and entry.get("state") == state.STATE_DENIED:
-        state.update_device(device_name, ip=_client_ip(request), last_error=None)
+        device_state.update_device(ip=_client_ip(request), last_error=None)
         return JsonResponse({"pairing": {"state": "denied"}}, status=401)
 
-    state.update_device(
-        device_name, state=state.STATE_PENDING, ip=_client_ip(request), last_error=None
-    )
+    device_state.update_device(state=state.STATE_PENDING, ip=_client_ip(request), last_error=None)
     return JsonResponse({"pairing": {"state": "pending"}}, status=401)
 
 
@@ -163,64 +162,72 @@ def _note_rejected_batch(request, error):
     state.update_device(device_name, ip=_client_ip(request), last_error=str(error)[:300])
 
 
-def _port_number(port_name, prefix):
-    if port_name.startswith(prefix):
-        try:
-            return int(port_name[len(prefix) :])
-        except ValueError:
-            pass
-    return None
-
-
-def _find_meter(controller, number):
-    return models.FlowMeter.objects.filter(controller=controller, port_name=f"flow{number}").first()
-
-
-def _handle_pour(controller, data, event_time):
-    meter = _find_meter(controller, data["meter_number"])
-    if not meter or not meter.tap:
+def _handle_pour(controller, device_state, data, event_time):
+    """Stages a pour; a batch's pours are recorded together by `_record_pours`."""
+    wiring = topology.get_topology(controller.id, device_state.topology_generation)
+    tap_id = wiring.tap_id(data["meter_number"])
+    if tap_id is None:
         logger.warning(
             f"kegboard {controller.name}: pour on unbound meter {data['meter_number']}, dropped"
         )
-        return
-    if models.Drink.objects.filter(pour_id=data["pour_id"]).exists():
-        return
+        return None
     # Identity never travels down: the pour echoes our grant_id and we
     # resolve the user from the grant record. No grant -> guest pour.
     username = None
     grant_id = data.get("grant_id")
     if grant_id:
-        grant = state.get_grant(grant_id)
+        grant = device_state.get_grant(grant_id)
         if grant:
             username = grant.get("user")
         else:
             logger.warning(
                 f"kegboard {controller.name}: unknown grant {grant_id!r}, recording as guest"
             )
-    if username and not models.User.objects.filter(username=username).exists():
-        logger.warning(f"kegboard {controller.name}: unknown user {username!r}, recording as guest")
-        username = None
-    try:
-        models.Drink.record_drink(
-            meter.tap,
-            ticks=data.get("ticks") or 0,
-            volume_ml=data["volume_ml"],
-            username=username,
-            pour_time=event_time,
-            duration=data["duration_ms"] // 1000,
-            tick_time_series=data.get("tick_series", ""),
-            pour_id=data["pour_id"],
+    return {
+        "tap": tap_id,
+        "ticks": data.get("ticks") or 0,
+        "volume_ml": data["volume_ml"],
+        "username": username,
+        "pour_time": event_time,
+        "duration": data["duration_ms"] // 1000,
+        "tick_time_series": data.get("tick_series", ""),
+        "pour_id": data["pour_id"],
+    }
+
+
+def _record_pours(controller, device_state, pours):
+    """Records a batch's staged pours in one go (see `Drink.record_drinks`)."""
+    taps = models.KegTap.objects.select_related("current_keg").in_bulk(
+        {pour["tap"] for pour in pours}
+    )
+    tap_ids = {}
+    for pour in pours:
+        tap_ids[pour["pour_id"]] = pour["tap"]
+        pour["tap"] = taps.get(pour["tap"])
+        if pour["tap"] is None:
+            logger.warning(f"kegboard {controller.name}: pour on deleted tap, dropped")
+    drinks = models.Drink.record_drinks([pour for pour in pours if pour["tap"] is not None])
+    for drink in drinks:
+        tap_id = tap_ids[drink.pour_id]
+        message = live.encode(
+            "pour",
+            tap_id=tap_id,
+            drink_id=drink.id,
+            pour_id=drink.pour_id,
+            volume_ml=drink.volume_ml,
+            username=drink.user.username,
+            time=drink.time.isoformat(),
         )
-    except ValueError as e:
-        logger.warning(f"kegboard {controller.name}: pour dropped: {e}")
+        device_state.publish(live.tap_channel(tap_id), message)
 
 
-def _handle_pour_update(controller, data, event_time):
-    meter = _find_meter(controller, data["meter_number"])
-    if not meter or not meter.tap:
+def _handle_pour_update(controller, device_state, data, event_time):
+    wiring = topology.get_topology(controller.id, device_state.topology_generation)
+    tap_id = wiring.tap_id(data["meter_number"])
+    if tap_id is None:
         return
-    state.stash_pour_update(
-        meter.tap_id,
+    device_state.stash_pour_update(
+        tap_id,
         {
             "pour_id": data["pour_id"],
             "volume_ml": data["volume_ml"],
@@ -230,7 +237,7 @@ def _handle_pour_update(controller, data, event_time):
     )
 
 
-def _handle_temperature(controller, data, event_time):
+def _handle_temperature(controller, device_state, data, event_time):
     raw_name = f"{controller.name}.{data['sensor']}"
     sensor, _ = models.ThermoSensor.objects.get_or_create(
         raw_name=raw_name, defaults={"nice_name": data["sensor"]}
@@ -239,9 +246,18 @@ def _handle_temperature(controller, data, event_time):
         sensor.log_sensor_reading(data["temp_c"], when=event_time)
     except ValueError as e:
         logger.warning(f"kegboard {controller.name}: temperature dropped: {e}")
+        return
+    message = live.encode(
+        "temperature",
+        sensor_id=sensor.id,
+        sensor=sensor.nice_name,
+        temp_c=data["temp_c"],
+        time=event_time.isoformat(),
+    )
+    device_state.publish(live.sensor_channel(sensor.id), message)
 
 
-def _handle_token(controller, data, event_time):
+def _handle_token(controller, device_state, data, event_time):
     if data["action"] != "attached":
         # Detaches are audit-only; the grant lifecycle arrives via
         # grant_end events.
@@ -255,32 +271,16 @@ def _handle_token(controller, data, event_time):
         # v1 policy: the grant covers every meter on the board. The
         # meter<->relay association is ours: energize the relays bound
         # to the granted meters' taps.
-        meters = []
-        tap_ids = set()
-        for meter in controller.meters.all():
-            number = _port_number(meter.port_name, "flow")
-            if number is None:
-                continue
-            meters.append(number)
-            if meter.tap_id is not None:
-                tap_ids.add(meter.tap_id)
-        relays = sorted(
-            number
-            for number in (
-                _port_number(toggle.port_name, "relay")
-                for toggle in controller.toggles.all()
-                if toggle.tap_id in tap_ids
-            )
-            if number is not None
-        )
+        wiring = topology.get_topology(controller.id, device_state.topology_generation)
+        meters = wiring.meter_numbers()
+        relays = wiring.relay_numbers(meters)
         grant_id = state.mint_grant_id()
-        state.store_grant(grant_id, token.user.username)
-        state.queue_command(
-            controller.name,
+        device_state.store_grant(grant_id, token.user.username)
+        device_state.queue_command(
             "authorize",
             {
                 "grant_id": grant_id,
-                "meter_numbers": sorted(meters),
+                "meter_numbers": meters,
                 "relay_numbers": relays,
                 "max_idle_ms": AUTHORIZE_IDLE_MS,
                 "auth_device": data["auth_device"],
@@ -294,16 +294,14 @@ def _handle_token(controller, data, event_time):
             reason = "Token is disabled"
         else:
             reason = "Token not assigned to a user"
-        state.queue_command(
-            controller.name,
+        device_state.queue_command(
             "deny",
             {"auth_device": data["auth_device"], "token": data["token"], "reason": reason},
         )
 
 
-def _handle_status(controller, data, event_time):
-    state.update_device(
-        controller.name,
+def _handle_status(controller, device_state, data, event_time):
+    device_state.update_device(
         state=state.STATE_PAIRED,
         fw_version=data["fw_version"],
         uptime_ms=data["uptime_ms"],
@@ -312,21 +310,28 @@ def _handle_status(controller, data, event_time):
         config=data["config"],
         meters=data.get("meters"),
     )
+    wiring = topology.get_topology(controller.id, device_state.topology_generation)
     for entry in data.get("meters") or []:
         number = entry.get("meter_number")
         ml_per_tick = entry.get("ml_per_tick")
         if not isinstance(number, int) or not ml_per_tick:
             continue
+        ticks_per_ml = 1.0 / ml_per_tick
+        known = wiring.ticks_per_ml(number)
+        if known is not None and abs(known - ticks_per_ml) <= 1e-9:
+            # Statuses repeat every heartbeat; only touch what changed.
+            continue
         meter, _ = models.FlowMeter.objects.get_or_create(
             controller=controller, port_name=f"flow{number}"
         )
-        ticks_per_ml = 1.0 / ml_per_tick
         if abs(meter.ticks_per_ml - ticks_per_ml) > 1e-9:
             meter.ticks_per_ml = ticks_per_ml
             meter.save(update_fields=["ticks_per_ml"])
+        # The save started a new generation; later events must see it.
+        device_state.topology_generation = None
 
 
-def _handle_grant_end(controller, data, event_time):
+def _handle_grant_end(controller, device_state, data, event_time):
     """Grant lifecycle bookkeeping.
 
     The pour events are the volume record; the grant totals here are
@@ -340,12 +345,20 @@ def _handle_grant_end(controller, data, event_time):
     )
 
 
-def _handle_command_result(controller, data, event_time):
+def _handle_command_result(controller, device_state, data, event_time):
     if data["result"] != "ok":
         logger.warning(f"kegboard {controller.name}: command {data['command']}: {data}")
-    state.ack_command(controller.name, data["command"])
+    device_state.ack_command(data["command"])
+
 
+# With KEGBOT_KEGBOARD_ASYNC, the endpoint only applies these itself: they
+# write no database rows and shape the response (commands) or the live
+# display. Everything else is queued for a worker (see `tasks`).
+ASYNC_EVENTS = settings.KEGBOT["KEGBOT_KEGBOARD_ASYNC"]
+INLINE_EVENT_TYPES = {"token", "command_result", "pour_update"}
 
+# Handlers return None, except "pour", which stages a pour to record with
+# the rest of the batch's.
 EVENT_HANDLERS = {
     "pour": _handle_pour,
     "pour_update": _handle_pour_update,
@@ -357,6 +370,38 @@ EVENT_HANDLERS = {
 }
 
 
+def apply_events(controller, device_state, events, received):
+    """Applies new events, in order, to the device's state and the database.
+
+    Args:
+        controller: The device's Controller.
+        device_state: The device's loaded `state.DeviceBatch`; the caller
+            saves it.
+        events: Envelope events not yet applied.
+        received: When the batch carrying them arrived; events are dated
+            by their age relative to it.
+    """
+    pours = []
+    for event in events:
+        handler = EVENT_HANDLERS.get(event["type"])
+        if not handler:
+            logger.debug(f"kegboard {controller.name}: ignoring event type {event['type']!r}")
+            continue
+        data_serializer = DATA_SERIALIZERS[event["type"]](data=event["data"])
+        if not data_serializer.is_valid():
+            logger.warning(
+                f"kegboard {controller.name}: bad {event['type']} payload, dropped: "
+                f"{data_serializer.errors}"
+            )
+            continue
+        event_time = received - timedelta(milliseconds=event["age_ms"])
+        pour = handler(controller, device_state, data_serializer.validated_data, event_time)
+        if pour is not None:
+            pours.append(pour)
+    if pours:
+        _record_pours(controller, device_state, pours)
+
+
 @extend_schema(exclude=True)
 @api_view(["POST"])
 @authentication_classes([])
@@ -381,41 +426,54 @@ def kegboard_event(request):
 
     device_name = batch["device"]
     token = _bearer_token(request)
-    controller = (
-        models.Controller.objects.filter(auth_token=token).first() if token is not None else None
-    )
+    # Redis state is read once up front, including the grants that pours
+    # refer to and the controller the token last authenticated as, and
+    # written back once at the end.
+    grant_ids = {
+        event["data"].get("grant_id")
+        for event in batch["events"]
+        if event["type"] == "pour" and isinstance(event["data"].get("grant_id"), str)
+    }
+    device_state = state.DeviceBatch(device_name, grant_ids, token=token).load()
+    controller = device_state.controller
+    if controller is None and token is not None:
+        controller = models.Controller.objects.filter(auth_token=token).first()
+        if controller is not None:
+            device_state.cache_controller(controller)
     if controller is None:
-        return _pairing_response(device_name, request)
-
-    state.update_device(
-        controller.name, state=state.STATE_PAIRED, ip=_client_ip(request), last_error=None
-    )
+        response = _pairing_response(device_state, request)
+        device_state.save()
+        return response
+    if controller.name != device_name:
+        # State belongs to the controller the token was issued to.
+        device_state.save()
+        device_state = state.DeviceBatch(controller.name, grant_ids).load()
+    device_state.update_device(state=state.STATE_PAIRED, ip=_client_ip(request), last_error=None)
 
     # Dedup: ids are monotonic per boot and the device queue does not
     # survive reboot, so one (boot_id, last_id) cursor is complete.
-    cursor = state.get_cursor(controller.name)
+    cursor = device_state.cursor
     last_seen_id = cursor["last_id"] if cursor and cursor["boot_id"] == batch["boot_id"] else 0
 
     received = timezone.now()
-    max_id = last_seen_id
-    for event in batch["events"]:
-        if event["id"] <= last_seen_id:
-            continue
-        max_id = max(max_id, event["id"])
-        handler = EVENT_HANDLERS.get(event["type"])
-        if not handler:
-            logger.debug(f"kegboard {controller.name}: ignoring event type {event['type']!r}")
-            continue
-        data_serializer = DATA_SERIALIZERS[event["type"]](data=event["data"])
-        if not data_serializer.is_valid():
-            logger.warning(
-                f"kegboard {controller.name}: bad {event['type']} payload, dropped: "
-                f"{data_serializer.errors}"
+    events = [event for event in batch["events"] if event["id"] > last_seen_id]
+    max_id = max([last_seen_id, *(event["id"] for event in events)])
+    if ASYNC_EVENTS:
+        inline = [event for event in events if event["type"] in INLINE_EVENT_TYPES]
+        deferred = [event for event in events if event["type"] not in INLINE_EVENT_TYPES]
+        apply_events(controller, device_state, inline, received)
+        if deferred:
+            device_state.defer(
+                {"controller": controller.id, "received": received.isoformat(), "events": deferred}
             )
-            continue
-        event_time = received - timedelta(milliseconds=event["age_ms"])
-        handler(controller, data_serializer.validated_data, event_time)
+    else:
+        apply_events(controller, device_state, events, received)
 
-    state.set_cursor(controller.name, batch["boot_id"], max_id)
+    # The cursor advances in the same transaction that queues deferred
+    # events, so an accepted event is never lost nor queued twice.
+    device_state.set_cursor(batch["boot_id"], max_id)
+    device_state.save()
+    if device_state.needs_worker:
+        tasks.apply_deferred_events.delay(controller.name)
 
-    return Response({"commands": state.pending_commands(controller.name)})
+    return Response({"commands": device_state.commands})
@@ -17,6 +17,15 @@ def pytest_load_initial_conftests(early_config, parser, args):
     logger.info(f"setting KEGBOT_DATA_DIR to {TEMP_DATA_DIR}")
 
 
+@pytest.fixture(autouse=True)
+def _reset_site_cache():
+    """Forgets the process-wide site row, which test databases don't keep."""
+    yield
+    from pykeg.core import models
+
+    models.invalidate_site_cache()
+
+
 @pytest.hookimpl
 def pytest_sessionfinish(session, exitstatus):
     logger.info(f"removing KEGBOT_DATA_DIR {TEMP_DATA_DIR}")
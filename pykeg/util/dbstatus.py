@@ -1,7 +1,21 @@
 """Wraps some common database problems in usable errors."""
 
-from django.db import connection
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connection
 from django.db.migrations.executor import MigrationExecutor
+from django.db.migrations.recorder import MigrationRecorder
+
+# How often, in seconds, a cached status is revalidated against the
+# applied-migrations table. Falsy disables revalidation; the status is
+# then only recomputed after `invalidate()`.
+RECHECK_SECONDS = getattr(settings, "KEGBOT_DB_STATUS_RECHECK_SECONDS", 60)
+
+# Process-wide cache of (checked_at, applied_migrations, error), where
+# error is None or an (exception class, arguments) pair; see
+# `check_db_status_cached()`.
+_CACHED_STATUS = None
 
 
 class DatabaseStatusError(Exception):
@@ -31,3 +45,71 @@ def check_db_status():
     if plan:
         migration = plan[0][0]
         raise NeedMigration(migration.name)
+
+
+def _applied_migrations():
+    """Returns the set of applied migrations, or None if unknown.
+
+    A single query against the migrations table, with no schema
+    introspection and no migration graph.
+    """
+    try:
+        return frozenset(
+            MigrationRecorder.Migration.objects.using(connection.alias).values_list("app", "name")
+        )
+    except DatabaseError:
+        return None
+
+
+def _error_args(error):
+    if isinstance(error, NeedMigration):
+        return type(error), (error.migration_name,)
+    return type(error), error.args
+
+
+def _compute_status():
+    try:
+        check_db_status()
+    except DatabaseNotInitialized as e:
+        return None, _error_args(e)
+    except DatabaseStatusError as e:
+        return _applied_migrations(), _error_args(e)
+    return _applied_migrations(), None
+
+
+def check_db_status_cached(now=None):
+    """Like `check_db_status()`, but memoized for the whole process.
+
+    The full check (table introspection plus a migration graph) runs
+    once; afterwards the result is reused until `invalidate()` is
+    called, or until a periodic revalidation finds that the set of
+    applied migrations has changed (for example, `kegbot migrate` was
+    run from another process).
+    """
+    global _CACHED_STATUS
+    if now is None:
+        now = time.monotonic()
+
+    cached = _CACHED_STATUS
+    if cached is None:
+        applied, error = _compute_status()
+        _CACHED_STATUS = (now, applied, error)
+    else:
+        checked_at, applied, error = cached
+        if RECHECK_SECONDS and now - checked_at >= RECHECK_SECONDS:
+            current = _applied_migrations() if applied is not None else None
+            if current is None or current != applied:
+                applied, error = _compute_status()
+            _CACHED_STATUS = (now, applied, error)
+
+    if error is not None:
+        # A fresh exception each time: raising a shared one would rewrite
+        # its traceback and context under concurrent threads.
+        error_class, args = error
+        raise error_class(*args)
+
+
+def invalidate():
+    """Discards the cached status; the next check recomputes it."""
+    global _CACHED_STATUS
+    _CACHED_STATUS = None
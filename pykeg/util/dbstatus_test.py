@@ -0,0 +1,63 @@
+"""Tests for the dbstatus module."""
+
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from pykeg.util import dbstatus
+
+
+class CachedDbStatusTests(TestCase):
+    def setUp(self):
+        dbstatus.invalidate()
+
+    def tearDown(self):
+        dbstatus.invalidate()
+
+    def test_status_is_computed_once(self):
+        with mock.patch.object(
+            dbstatus, "check_db_status", wraps=dbstatus.check_db_status
+        ) as check:
+            dbstatus.check_db_status_cached(now=0)
+            with CaptureQueriesContext(connection) as queries:
+                dbstatus.check_db_status_cached(now=1)
+                dbstatus.check_db_status_cached(now=2)
+            self.assertEqual(1, check.call_count)
+            self.assertEqual(0, len(queries))
+
+    def test_invalidate_forces_full_check(self):
+        with mock.patch.object(
+            dbstatus, "check_db_status", wraps=dbstatus.check_db_status
+        ) as check:
+            dbstatus.check_db_status_cached(now=0)
+            dbstatus.invalidate()
+            dbstatus.check_db_status_cached(now=1)
+            self.assertEqual(2, check.call_count)
+
+    def test_revalidation_is_cheap_when_unchanged(self):
+        with mock.patch.object(
+            dbstatus, "check_db_status", wraps=dbstatus.check_db_status
+        ) as check:
+            dbstatus.check_db_status_cached(now=0)
+            with CaptureQueriesContext(connection) as queries:
+                dbstatus.check_db_status_cached(now=dbstatus.RECHECK_SECONDS + 1)
+            self.assertEqual(1, check.call_count)
+            self.assertEqual(1, len(queries))
+
+    def test_revalidation_notices_new_migrations(self):
+        dbstatus.check_db_status_cached(now=0)
+        with mock.patch.object(
+            dbstatus, "check_db_status", side_effect=dbstatus.NeedMigration("0099_new")
+        ):
+            with mock.patch.object(dbstatus, "_applied_migrations", return_value=frozenset()):
+                with self.assertRaises(dbstatus.NeedMigration):
+                    dbstatus.check_db_status_cached(now=dbstatus.RECHECK_SECONDS + 1)
+            # The failure is cached too, and raised afresh each time.
+            with self.assertRaises(dbstatus.NeedMigration) as first:
+                dbstatus.check_db_status_cached(now=dbstatus.RECHECK_SECONDS + 2)
+            with self.assertRaises(dbstatus.NeedMigration) as second:
+                dbstatus.check_db_status_cached(now=dbstatus.RECHECK_SECONDS + 3)
+            self.assertIsNot(first.exception, second.exception)
+            self.assertEqual("0099_new", second.exception.migration_name)
@@ -71,7 +71,3 @@ class ApiRequestMiddleware:
         if util.is_api_v1_request(request):
             return util.wrap_exception(request, exception)
         return None
-
-
-def cache_key(request):
-    return f"api:{request.get_full_path()}"
@@ -3,6 +3,7 @@ import logging
 from django.db import connection
 from django.http import JsonResponse
 from django.utils import timezone
+from packaging.version import Version
 
 from pykeg.core import models
 from pykeg.core.util import get_version_object, must_upgrade, set_current_request
@@ -72,6 +73,7 @@ class IsSetupMiddleware:
 
     def __init__(self, get_response):
         self.get_response = get_response
+        self.app_version = get_version_object()
 
     def __call__(self, request):
         request.need_setup = False
@@ -88,9 +90,10 @@ class IsSetupMiddleware:
                 request.session = {}
                 request.session["_auth_user_backend"] = None
 
-        # First confirm the database is working.
+        # First confirm the database is working. The migration check is
+        # cached process-wide; steady-state requests do no introspection.
         try:
-            dbstatus.check_db_status()
+            dbstatus.check_db_status_cached()
         except dbstatus.DatabaseNotInitialized:
             logger.warning("Database is not initialized, sending to setup ...")
             request.need_setup = True
@@ -99,24 +102,26 @@ class IsSetupMiddleware:
             logger.warning("Database needs migration, sending to setup ...")
             request.need_upgrade = True
 
-        # If the database looks good, check the data.
+        # If the database looks good, check the data. The site row (cached,
+        # see `KegbotSite.get()`) serves both the version check and
+        # `request.kbsite`.
         if not request.need_setup:
-            installed_version = models.KegbotSite.get_installed_version()
-            if installed_version is None:
+            site = models.KegbotSite.get(create=False)
+            if site is None:
                 logger.warning("Kegbot not installed, sending to setup ...")
                 request.need_setup = True
             else:
+                installed_version = Version(site.server_version)
                 request.installed_version_string = str(installed_version)
-                if must_upgrade(installed_version, get_version_object()):
+                if must_upgrade(installed_version, self.app_version):
                     logger.warning("Kegbot upgrade required, sending to setup ...")
                     request.need_upgrade = True
 
-        # Lastly verify the kbsite record.
-        if not request.need_setup:
-            request.kbsite = models.KegbotSite.objects.get(name="default")
-            if not request.kbsite.is_setup:
-                logger.warning("Setup incomplete, sending to setup ...")
-                request.need_setup = True
+                # Lastly verify the kbsite record.
+                request.kbsite = site
+                if not site.is_setup:
+                    logger.warning("Setup incomplete, sending to setup ...")
+                    request.need_setup = True
 
         return self.get_response(request)
 
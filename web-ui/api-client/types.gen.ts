@@ -1155,6 +1155,9 @@ export type DrinkingSession = {
     timezone?: string;
     name?: string | null;
     readonly stats: unknown;
+    readonly stats_summary: {
+        [key: string]: unknown;
+    };
 };
 
 export type EmailChangeRequestRequest = {
@@ -1308,6 +1311,9 @@ export type Keg = {
     readonly illustration: string;
     readonly illustration_thumbnail: string;
     readonly stats: unknown;
+    readonly stats_summary: {
+        [key: string]: unknown;
+    };
 };
 
 /**
@@ -2023,6 +2029,9 @@ export type KegbotSite = {
      */
     enable_users?: boolean;
     readonly stats: unknown;
+    readonly stats_summary: {
+        [key: string]: unknown;
+    };
 };
 
 export type LoginRequest = {
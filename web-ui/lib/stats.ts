@@ -36,3 +36,22 @@ export function asStats(value: unknown): StatsBlob {
   }
   return {};
 }
+
+/**
+ * Shape of the compact stats summary (`stats_summary`) served in lists.
+ *
+ * Mirrors StatsAccumulator.summary() in pykeg/core/stats.py.
+ */
+export interface StatsSummary {
+  total_volume_ml?: number;
+  total_pours?: number;
+  /** The biggest drinkers, keyed by username. */
+  top_drinkers?: Record<string, number>;
+}
+
+export function asStatsSummary(value: unknown): StatsSummary {
+  if (value && typeof value === "object" && !Array.isArray(value)) {
+    return value as StatsSummary;
+  }
+  return {};
+}
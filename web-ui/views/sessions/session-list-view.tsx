@@ -25,7 +25,7 @@ import { useFormatters } from "@/components/use-formatters";
 import { unwrap } from "@/lib/api";
 import { datePartsInZone, formatDateTime, formatTime, monthName } from "@/lib/format";
 import { intParam } from "@/lib/params";
-import { asStats } from "@/lib/stats";
+import { asStatsSummary } from "@/lib/stats";
 import { useAsyncData } from "@/lib/use-async-data";
 import { useCursorList } from "@/lib/use-cursor-list";
 import { MONO_FONT } from "@/theme/typography";
@@ -72,8 +72,8 @@ function activeDays(directory: SessionDirectory | null, year: number, month: num
 /** Large per-session card for the day view. */
 function SessionDayCard({ session }: { session: DrinkingSession }) {
   const { volume } = useFormatters();
-  const stats = asStats(session.stats);
-  const drinkers = stats.volume_by_drinker ?? {};
+  const summary = asStatsSummary(session.stats_summary);
+  const drinkers = summary.top_drinkers ?? {};
   return (
     <Paper variant="outlined" sx={{ p: 3 }}>
       <Stack spacing={2}>
@@ -99,7 +99,7 @@ function SessionDayCard({ session }: { session: DrinkingSession }) {
             </Typography>
             <Typography variant="body2" color="text.secondary" sx={{ mt: 0.25 }}>
               {formatTime(session.start_time)} — {formatTime(session.end_time)} ·{" "}
-              {stats.total_pours ?? 0} pours
+              {summary.total_pours ?? 0} pours
             </Typography>
           </Box>
           <Typography sx={{ fontFamily: MONO_FONT, fontWeight: 600, fontSize: "2rem" }}>